@@ -0,0 +1,168 @@
+"""
+Cancellation of a running backend.
+
+SIGTERM, SIGINT and SIGHUP, or a "cancel" line on stdin with
+--control-stdin (pkexec'd processes cannot be signalled by the user who
+started them), set the cancel flag and stop every command started through
+proc.run: each runs in its own process group, which gets SIGTERM and, after
+GRACE_S, SIGKILL. The main thread then unwinds with Cancelled, so locks are
+released by their context managers and steps undo their partial work
+through undo().
+
+The flag and the process groups belong to a Scope: the whole process for
+the CLI, one Run() call in the D-Bus helper (see scoped()), so cancelling
+one caller's run leaves the others alone.
+"""
+import contextvars
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from . import events
+
+GRACE_S = 3.0
+EXIT_CODE = 130
+
+
+class Cancelled(SystemExit):
+    def __init__(self):
+        super().__init__(EXIT_CODE)
+
+
+class Scope:
+    def __init__(self):
+        self.event = threading.Event()
+        self.requested_at: Optional[float] = None
+        # Process groups of running commands. No lock: request() runs inside
+        # a signal handler, and set add/discard/copy are atomic under the GIL.
+        self.groups: set[int] = set()
+
+    def signal_groups(self, sig: int):
+        for pgid in list(self.groups):
+            try:
+                os.killpg(pgid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def request(self):
+        """Flag the cancel and stop all running commands (signal-handler safe)."""
+        if self.event.is_set():
+            return
+        self.requested_at = time.monotonic()
+        self.event.set()
+        self.signal_groups(signal.SIGTERM)
+
+
+_process = Scope()
+_scope: contextvars.ContextVar = contextvars.ContextVar("arksigner_cancel", default=_process)
+_raised = False
+
+
+def current() -> Scope:
+    return _scope.get()
+
+
+@contextmanager
+def scoped():
+    """Give the block (and the threads that copy its context) a scope of its own."""
+    scope = Scope()
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def requested() -> bool:
+    return current().event.is_set()
+
+
+def check():
+    """Raise Cancelled if a cancel was requested (for worker threads)."""
+    if requested():
+        raise Cancelled()
+
+
+def register(pgid: int):
+    current().groups.add(pgid)
+
+
+def unregister(pgid: int):
+    current().groups.discard(pgid)
+
+
+def request():
+    """Cancel the current scope (signal-handler safe)."""
+    current().request()
+
+
+def kill_later(scope: Scope):
+    """SIGKILL what is left of a cancelled scope's commands after GRACE_S."""
+    def reap():
+        time.sleep(GRACE_S)
+        scope.signal_groups(signal.SIGKILL)
+
+    threading.Thread(target=reap, daemon=True).start()
+
+
+def _reaper():
+    _process.event.wait()
+    time.sleep(GRACE_S)
+    _process.signal_groups(signal.SIGKILL)
+
+
+def _on_signal(_signum, _frame):
+    global _raised
+    _process.request()
+    # Unwind once; a second Ctrl-C must not interrupt the cleanup
+    if not _raised:
+        _raised = True
+        raise Cancelled()
+
+
+def _read_control():
+    for line in sys.stdin:
+        if line.strip() == "cancel":
+            break
+    # A closed control channel means the GUI is gone: cancel as well
+    _process.request()
+    # Wake the main thread so it unwinds promptly
+    os.kill(os.getpid(), signal.SIGUSR1)
+
+
+def install(control_stdin: bool = False):
+    """Install the signal handlers; with control_stdin also watch stdin."""
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1):
+        signal.signal(sig, _on_signal)
+    threading.Thread(target=_reaper, daemon=True).start()
+    if control_stdin:
+        threading.Thread(target=_read_control, daemon=True).start()
+
+
+def teardown_ms() -> Optional[float]:
+    """Time since the cancel request, or None if there was none."""
+    at = current().requested_at
+    if at is None:
+        return None
+    return round((time.monotonic() - at) * 1000, 1)
+
+
+@contextmanager
+def undo(fn: Callable, *args, cancel_only: bool = False):
+    """
+    Run fn(*args) if the block is left by a cancel, or by any error unless
+    cancel_only. Cleanup failures are reported, not raised.
+    """
+    try:
+        yield
+    except BaseException:
+        if not cancel_only or requested():
+            try:
+                fn(*args)
+            except Exception as e:
+                events.warning(f"cleanup {getattr(fn, '__name__', fn)} failed: {e}")
+        raise
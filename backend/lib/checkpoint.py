@@ -0,0 +1,117 @@
+"""
+Step checkpoints for interrupted install/upgrade runs.
+
+Completed steps are recorded in STATE_DIR/checkpoint.json together with a
+fingerprint of their inputs (deb source and hash, suite, mirror, machine).
+With --resume a step is skipped when its fingerprint still matches and its
+output is still on disk. Step names carry their lock scope ("rootfs@native")
+so runs on different machines can share the file; a scope's entries are
+removed once its run completes.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+from . import paths
+from .util import ts
+
+FORMAT_VERSION = 1
+
+
+@contextmanager
+def _locked():
+    """Serialize read-modify-write of the file across threads and processes."""
+    paths.STATE_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(paths.CHECKPOINT_FILE.with_suffix(".lock"), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def fingerprint(**inputs) -> str:
+    data = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load() -> dict:
+    try:
+        data = json.loads(paths.CHECKPOINT_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != FORMAT_VERSION:
+        return {}
+    return data.get("steps", {})
+
+
+def _save(steps: dict):
+    paths.CHECKPOINT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".checkpoint.", dir=str(paths.CHECKPOINT_FILE.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "steps": steps}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, paths.CHECKPOINT_FILE)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def started(name: str, fp: str):
+    """Mark a step as in progress, so an interrupted run is recognizable."""
+    with _locked():
+        steps = load()
+        steps[name] = {"fingerprint": fp, "state": "started", "at": ts()}
+        _save(steps)
+
+
+def done(name: str, fp: str, **outputs):
+    with _locked():
+        steps = load()
+        steps[name] = {"fingerprint": fp, "state": "done", "at": ts(), "outputs": outputs}
+        _save(steps)
+
+
+def interrupted(name: str) -> bool:
+    return load().get(name, {}).get("state") == "started"
+
+
+def completed(name: str, fp: str, valid: Optional[Callable[[dict], bool]] = None) -> Optional[dict]:
+    """
+    Return the recorded entry if the step completed with the same inputs and
+    valid(outputs) still holds, else None.
+    """
+    entry = load().get(name)
+    if not entry or entry.get("state") != "done" or entry.get("fingerprint") != fp:
+        return None
+    try:
+        if valid is not None and not valid(entry.get("outputs", {})):
+            return None
+    except OSError:
+        return None
+    return entry
+
+
+def clear(scope: str):
+    """Forget the steps of one scope; the file goes once nothing is left."""
+    with _locked():
+        steps = {k: v for k, v in load().items() if not k.endswith(f"@{scope}")}
+        if steps:
+            _save(steps)
+        else:
+            paths.CHECKPOINT_FILE.unlink(missing_ok=True)
@@ -1,32 +1,36 @@
 import shutil
 import subprocess
 from pathlib import Path
+from typing import Optional
 
+from . import cancel, paths, systemd, units
+from .trace import annotate, traced
 from .util import (
-    OPT_DIR,
-    PKCS11_MODULE,
-    SERVICE_CONTAINER,
-    SERVICE_CONTAINER_PATH,
+    container_unit,
+    fstab_bind_line,
     progress,
     rootfs_dir,
     run,
-    sh,
+    umount_lazy,
 )
 
 
+@traced
 def cleanup_unix_export(machine: str):
-    exp = Path("/run/systemd/nspawn/unix-export") / machine
-    sh(f"umount -lf '{exp}' 2>/dev/null || true", check=False)
-    sh(f"rm -rf '{exp}' 2>/dev/null || true", check=False)
+    exp = paths.NSPAWN_EXPORT_DIR / machine
+    umount_lazy(exp)
+    shutil.rmtree(exp, ignore_errors=True)
 
 
+@traced
 def terminate_container(machine: str):
-    run(["systemctl", "stop", SERVICE_CONTAINER], check=False)
-    run(["machinectl", "terminate", machine], check=False)
+    systemd.stop_unit(container_unit(machine))
+    systemd.terminate_machine(machine)
     cleanup_unix_export(machine)
 
 
-def ensure_rootfs(machine: str, suite: str, mirror: str, recreate: bool):
+@traced
+def ensure_rootfs(machine: str, suite: str, mirror: str, recreate: bool, template: Optional[Path] = None):
     rootfs = rootfs_dir(machine)
 
     if recreate and rootfs.exists():
@@ -37,17 +41,47 @@ def ensure_rootfs(machine: str, suite: str, mirror: str, recreate: bool):
     if (rootfs / "etc/debian_version").exists():
         return
 
-    progress(20, "Preparing Debian rootfs (debootstrap)")
+    # A cancel must not leave a half-populated rootfs that we created
+    created = not rootfs.exists()
     rootfs.mkdir(parents=True, exist_ok=True)
-    run(["debootstrap", suite, str(rootfs), mirror], check=True)
+    with cancel.undo(_remove_partial, rootfs, created, cancel_only=True):
+        if template is not None:
+            progress(20, "Copying Debian rootfs from template")
+            run(["cp", "-a", "--reflink=auto", f"{template}/.", str(rootfs)], check=True)
+        else:
+            progress(20, "Preparing Debian rootfs (debootstrap)")
+            run(["debootstrap", suite, str(rootfs), mirror], check=True, stall=True)
     progress(45, "Debian rootfs ready")
 
 
+def _remove_partial(path: Path, created: bool = True):
+    if created:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def rootfs_template_dir(suite: str) -> Path:
+    return paths.STATE_DIR / f"rootfs-{suite}"
+
+
+@traced
+def build_rootfs_template(suite: str, mirror: str) -> Path:
+    """debootstrap once into a template that several new machines are copied from."""
+    template = rootfs_template_dir(suite)
+    shutil.rmtree(template, ignore_errors=True)
+    progress(20, "Preparing shared Debian rootfs template (debootstrap)")
+    template.mkdir(parents=True, exist_ok=True)
+    with cancel.undo(_remove_partial, template):
+        run(["debootstrap", suite, str(template), mirror], check=True, stall=True)
+    return template
+
+
+@traced
 def install_deb_inside_container(machine: str, deb_path: Path):
     progress(55, "Installing ArkSigner inside container")
     rootfs = rootfs_dir(machine)
     (rootfs / "root").mkdir(parents=True, exist_ok=True)
     shutil.copy2(deb_path, rootfs / "root/arksigner.deb")
+    annotate(bytes=deb_path.stat().st_size)
 
     cmd = (
         "set -e; export DEBIAN_FRONTEND=noninteractive;"
@@ -59,14 +93,16 @@ def install_deb_inside_container(machine: str, deb_path: Path):
     )
     
     try:
-        # Use --pipe for non-interactive execution
-        run([
-            "systemd-nspawn",
-            "-D", str(rootfs),
-            "--pipe",  # Non-interactive
-            "--quiet",  # Less noise
-            "/bin/bash", "-c", cmd  # -c instead of -lc (no login shell)
-        ], check=True)
+        # Use --pipe for non-interactive execution. On cancel nspawn gets
+        # SIGTERM and takes the container's processes down with it.
+        with cancel.undo((rootfs / "root/arksigner.deb").unlink, True, cancel_only=True):
+            run([
+                "systemd-nspawn",
+                "-D", str(rootfs),
+                "--pipe",  # Non-interactive
+                "--quiet",  # Less noise
+                "/bin/bash", "-c", cmd  # -c instead of -lc (no login shell)
+            ], check=True, stall=True)
     except subprocess.CalledProcessError as e:
         # Print detailed error for debugging
         error_msg = f"Container command failed:\nstdout: {e.stdout}\nstderr: {e.stderr}"
@@ -76,6 +112,7 @@ def install_deb_inside_container(machine: str, deb_path: Path):
     progress(75, "ArkSigner installed in container")
 
 
+@traced
 def ensure_bind_mount_from_container(machine: str):
     progress(85, "Binding ArkSigner to /opt/arksigner")
     rootfs = rootfs_dir(machine)
@@ -83,84 +120,84 @@ def ensure_bind_mount_from_container(machine: str):
     if not src.exists():
         raise SystemExit("ERROR: container /usr/bin/arksigner missing; install failed.")
 
-    OPT_DIR.mkdir(parents=True, exist_ok=True)
-    sh(f"umount -lf '{OPT_DIR}' 2>/dev/null || true", check=False)
-    sh(f"mount --bind '{src}' '{OPT_DIR}'", check=True)
+    paths.OPT_DIR.mkdir(parents=True, exist_ok=True)
+    module = paths.PKCS11_MODULE
+    if systemd.offline():
+        # Mounting is for the live host; an image under --root only gets the
+        # fstab entry and binds on its first boot
+        module = src / paths.PKCS11_MODULE.relative_to(paths.OPT_DIR)
+    else:
+        umount_lazy(paths.OPT_DIR)
+        run(["mount", "--bind", str(src), str(paths.OPT_DIR)], check=True)
 
-    # Persist bind in fstab
-    fstab_line = f"{src} {OPT_DIR} none bind 0 0"
-    fstab_path = Path("/etc/fstab")
-    fstab = fstab_path.read_text() if fstab_path.exists() else ""
-    if fstab_line not in fstab:
-        with open("/etc/fstab", "a", encoding="utf-8") as f:
-            f.write(f"{fstab_line}\n")
+    # Persist bind in fstab; a cancel before that leaves nothing mounted
+    with cancel.undo(umount_lazy, paths.OPT_DIR, cancel_only=True):
+        fstab_line = fstab_bind_line(machine)
+        fstab = paths.FSTAB.read_text() if paths.FSTAB.exists() else ""
+        if fstab_line not in fstab:
+            paths.FSTAB.parent.mkdir(parents=True, exist_ok=True)
+            with open(paths.FSTAB, "a", encoding="utf-8") as f:
+                f.write(f"{fstab_line}\n")
 
-    if not PKCS11_MODULE.exists():
-        raise SystemExit(f"ERROR: PKCS#11 module missing at {PKCS11_MODULE}")
+    if not module.exists():
+        raise SystemExit(f"ERROR: PKCS#11 module missing at {module}")
 
 
-def write_container_service(machine: str):
-    rootfs = rootfs_dir(machine)
-    content = f"""[Unit]
-Description=ArkSigner Debian Container (nspawn)
-After=pcscd.socket
-Requires=pcscd.socket
-
-[Service]
-Type=simple
-ExecStart=/usr/bin/systemd-nspawn \\
-  -D {rootfs} \\
-  --machine={machine} \\
-  --bind=/run/pcscd:/run/pcscd \\
-  --bind-ro=/dev/bus/usb:/dev/bus/usb \\
-  --console=passive \\
-  --keep-unit \\
-  /bin/bash -lc "/etc/init.d/arksignerd start; exec sleep infinity"
-KillMode=mixed
-Restart=always
-RestartSec=5
-
-[Install]
-WantedBy=multi-user.target
-"""
-    SERVICE_CONTAINER_PATH.write_text(content, encoding="utf-8")
-
-
-def enable_start_container(machine: str):
-    progress(92, "Enabling systemd service")
-    write_container_service(machine)
-    run(["systemctl", "daemon-reload"], check=True)
+def container_service_content(machine: str) -> str:
+    return units.render_container_unit(machine)
+
+
+def write_container_service(machine: str) -> bool:
+    return units.write_unit(paths.unit_file(container_unit(machine)), container_service_content(machine))
+
+
+@traced
+def restart_container_service(machine: str):
+    """Stop whatever runs in the machine and (re)start the unit from scratch."""
     terminate_container(machine)
-    cleanup_unix_export(machine)
-    run(["systemctl", "enable", "--now", SERVICE_CONTAINER], check=True)
+    systemd.enable_units([container_unit(machine)], now=True, check=True)
+
+
+@traced
+def enable_start_container(machine: str, payload_changed: bool = True) -> str:
+    progress(92, "Enabling systemd service")
+    unit = container_unit(machine)
+    report = units.apply_service(
+        unit,
+        paths.unit_file(unit),
+        container_service_content(machine),
+        payload_changed,
+        lambda: restart_container_service(machine),
+    )
     progress(100, "Completed")
+    return report
 
 
+@traced
 def uninstall_container(machine: str, purge: bool):
     """Uninstall container installation with optional purge."""
+    unit = container_unit(machine)
     progress(10, "Stopping container")
     terminate_container(machine)
     
     progress(25, "Disabling services")
-    run(["systemctl", "disable", SERVICE_CONTAINER], check=False)
-    SERVICE_CONTAINER_PATH.unlink(missing_ok=True)
+    systemd.disable_units([unit])
+    paths.unit_file(unit).unlink(missing_ok=True)
     
     progress(40, "Reloading systemd")
-    run(["systemctl", "daemon-reload"], check=False)
-    run(["systemctl", "reset-failed", SERVICE_CONTAINER], check=False)
+    systemd.daemon_reload()
+    systemd.reset_failed(unit)
 
     progress(55, "Unmounting bind mounts")
-    sh(f"umount -lf '{OPT_DIR}' 2>/dev/null || true", check=False)
+    umount_lazy(paths.OPT_DIR)
 
     progress(70, "Removing fstab entry")
     rootfs = rootfs_dir(machine)
-    src = rootfs / "usr/bin/arksigner"
-    fstab_line = f"{src} {OPT_DIR} none bind 0 0"
-    fstab_path = Path("/etc/fstab")
-    if fstab_path.exists():
-        orig = fstab_path.read_text().splitlines()
+    fstab_line = fstab_bind_line(machine)
+    if paths.FSTAB.exists():
+        orig = paths.FSTAB.read_text().splitlines()
         new = [l for l in orig if l.strip() != fstab_line]
-        fstab_path.write_text("\n".join(new) + ("\n" if new else ""), encoding="utf-8")
+        paths.FSTAB.write_text("\n".join(new) + ("\n" if new else ""), encoding="utf-8")
 
     if purge:
         progress(85, "Purging container rootfs")
@@ -169,7 +206,9 @@ def uninstall_container(machine: str, purge: bool):
     progress(100, "Completed")
 
 
-def repair_container(machine: str, force_terminate: bool = False, recreate_mounts: bool = False, clear_cache: bool = True):
+@traced
+def repair_container(machine: str, force_terminate: bool = False, recreate_mounts: bool = False, clear_cache: bool = True,
+                     bind_host: bool = True):
     """
     Repair container installation with optional advanced fixes.
     
@@ -178,52 +217,55 @@ def repair_container(machine: str, force_terminate: bool = False, recreate_mount
         force_terminate: Force terminate container even if active
         recreate_mounts: Remove and recreate bind mounts from scratch
         clear_cache: Run daemon-reload and reset-failed
+        bind_host: Machine backs the host's OPT_DIR bind mount (False for
+            the other machines of a fleet)
     """
+    unit = container_unit(machine)
     progress(10, "Starting repair")
     
     # Best-effort cleanup for "busy / unix-export mount point exists / directory tree busy"
     if force_terminate:
         progress(20, "Force terminating container")
-        run(["machinectl", "poweroff", machine], check=False)
+        systemd.poweroff_machine(machine)
         import time
         time.sleep(2)  # Wait for graceful shutdown
     
     progress(30, "Terminating container services")
     terminate_container(machine)
-    cleanup_unix_export(machine)
 
+    if bind_host:
+        _repair_bind_mount(machine, recreate_mounts)
+
+    if clear_cache:
+        progress(70, "Clearing systemd cache")
+        systemd.daemon_reload()
+        systemd.reset_failed(unit)
+    
+    progress(85, "Starting services")
+    systemd.start_unit(unit)
+    
+    progress(100, "Repair completed")
+
+
+def _repair_bind_mount(machine: str, recreate_mounts: bool):
     # Try to unmount OPT_DIR if it is stuck busy
     progress(40, "Cleaning up mounts")
-    sh(f"umount -lf '{OPT_DIR}' 2>/dev/null || true", check=False)
+    umount_lazy(paths.OPT_DIR)
     
     if recreate_mounts:
         progress(50, "Recreating bind mounts")
         # Remove from fstab first
-        rootfs = rootfs_dir(machine)
-        src = rootfs / "usr/bin/arksigner"
-        fstab_line = f"{src} {OPT_DIR} none bind 0 0"
-        fstab_path = Path("/etc/fstab")
-        if fstab_path.exists():
-            orig = fstab_path.read_text().splitlines()
+        fstab_line = fstab_bind_line(machine)
+        if paths.FSTAB.exists():
+            orig = paths.FSTAB.read_text().splitlines()
             new = [l for l in orig if l.strip() != fstab_line]
-            fstab_path.write_text("\n".join(new) + ("\n" if new else ""), encoding="utf-8")
+            paths.FSTAB.write_text("\n".join(new) + ("\n" if new else ""), encoding="utf-8")
         
         # Force unmount
-        sh(f"umount -lf '{OPT_DIR}' 2>/dev/null || true", check=False)
-        sh(f"umount -lf '{OPT_DIR}' 2>/dev/null || true", check=False)  # Twice for nested
+        umount_lazy(paths.OPT_DIR)
+        umount_lazy(paths.OPT_DIR)  # Twice for nested
 
     # Restore bind mount if possible
     progress(60, "Restoring bind mount")
     if (rootfs_dir(machine) / "usr/bin/arksigner").exists():
         ensure_bind_mount_from_container(machine)
-
-    if clear_cache:
-        progress(70, "Clearing systemd cache")
-        run(["systemctl", "daemon-reload"], check=False)
-        run(["systemctl", "reset-failed", SERVICE_CONTAINER], check=False)
-    
-    progress(85, "Starting services")
-    run(["systemctl", "start", SERVICE_CONTAINER], check=False)
-    
-    progress(100, "Repair completed")
-
@@ -1,23 +1,111 @@
+import io
+import re
 import shutil
+import tarfile
+import threading
 from pathlib import Path
 
-from .util import progress, sh
+from . import cancel, events, trace, watchdog
+from .util import progress, run
 
+_VERSION_RE = re.compile(r"arksigner-pub-(\d+(?:\.\d+)+)\.deb$")
 
-def download_deb(deb: str) -> Path:
+
+def deb_target_version(deb: str) -> str:
+    """Version encoded in a .deb URL/path name (arksigner-pub-X.Y.Z.deb), or ""."""
+    m = _VERSION_RE.search(deb.rstrip("/").rsplit("/", 1)[-1])
+    return m.group(1) if m else ""
+
+
+@trace.traced
+def deb_control_version(deb_path: Path) -> str:
+    """
+    Read Version: from a .deb without spawning ar/tar: walk the ar archive to
+    the control.tar.* member and open it with tarfile (gz/xz/bz2/plain).
+    """
+    try:
+        with open(deb_path, "rb") as f:
+            if f.read(8) != b"!<arch>\n":
+                return ""
+            while True:
+                hdr = f.read(60)
+                if len(hdr) < 60:
+                    return ""
+                name = hdr[:16].decode(errors="replace").strip().rstrip("/")
+                size = int(hdr[48:58].decode().strip())
+                if name.startswith("control.tar"):
+                    data = f.read(size)
+                    break
+                f.seek(size + (size & 1), 1)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+            for member in ("./control", "control"):
+                try:
+                    ctl = tf.extractfile(member)
+                except KeyError:
+                    continue
+                if ctl is None:
+                    continue
+                for line in ctl.read().decode(errors="replace").splitlines():
+                    if line.startswith("Version:"):
+                        return line.split(":", 1)[1].strip()
+    except (OSError, ValueError, tarfile.TarError):
+        pass
+    return ""
+
+
+def _report_bytes(path: Path, stop: threading.Event):
+    """Emit bytes events while curl writes the file."""
+    last = -1
+    while not stop.wait(0.5):
+        try:
+            size = path.stat().st_size
+        except OSError:
+            continue
+        if size != last:
+            events.emit("bytes", step="download", done=size)
+            last = size
+
+
+@trace.traced
+def download_deb(deb: str, out: Path, resume: bool = False) -> Path:
+    """
+    Fetch the .deb into out (see paths.deb_cache). Downloads go to a .part
+    file first; with resume=True an existing partial download is continued
+    (curl -C -).
+    """
     progress(5, "Preparing download")
-    out = Path("/tmp/arksigner.deb")
-
-    if deb.startswith("http://") or deb.startswith("https://"):
-        # Stage-based progress (can be upgraded later to parse curl %)
-        progress(8, "Downloading .deb")
-        sh(f"curl -fsSL '{deb}' -o '{out}'", check=True)
-    else:
-        src = Path(deb)
-        if not src.exists() or not src.name.endswith(".deb"):
-            raise SystemExit(f"ERROR: invalid --deb: {deb}")
-        shutil.copy2(src, out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    part = out.with_name(out.name + ".part")
 
+    # A cancelled download leaves nothing behind; a failed one stays resumable
+    with cancel.undo(part.unlink, True, cancel_only=True):
+        if deb.startswith("http://") or deb.startswith("https://"):
+            # Stage-based progress (can be upgraded later to parse curl %)
+            progress(8, "Downloading .deb")
+            stop = threading.Event()
+            if events.enabled():
+                threading.Thread(target=_report_bytes, args=(part, stop), daemon=True).start()
+            try:
+                if resume and part.exists():
+                    progress(8, f"Resuming download at {part.stat().st_size} bytes")
+                    r = run(["curl", "-fsSL", *watchdog.curl_args(), "-C", "-", deb, "-o", str(part)], check=False)
+                    if r.returncode != 0:
+                        # Server refused the range request or the part is stale
+                        part.unlink(missing_ok=True)
+                        run(["curl", "-fsSL", *watchdog.curl_args(), deb, "-o", str(part)], check=True)
+                else:
+                    run(["curl", "-fsSL", *watchdog.curl_args(), deb, "-o", str(part)], check=True)
+            finally:
+                stop.set()
+        else:
+            src = Path(deb)
+            if not src.exists() or not src.name.endswith(".deb"):
+                raise SystemExit(f"ERROR: invalid --deb: {deb}")
+            shutil.copy2(src, part)
+    part.replace(out)
+
+    size = out.stat().st_size
+    trace.annotate(bytes=size)
+    events.emit("bytes", step="download", done=size, total=size)
     progress(15, "Downloaded .deb")
     return out
-
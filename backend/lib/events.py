@@ -0,0 +1,127 @@
+"""
+Versioned JSON event stream for the GUI.
+
+With --events-fd N the backend writes one JSON object per line to file
+descriptor N, separate from the human-readable output on stdout:
+
+    {"v": 1, "type": "step-start", "ts": 1760000000.0, "step": "download"}
+
+pkexec closes every descriptor above 2 before it starts the backend, so
+the GUI uses --events-stdout instead: the same objects as lines tagged
+with EVENT_TAG on stdout, between the human-readable lines.
+
+Types: progress, step-start, step-end (duration_ms, ok), bytes, heartbeat,
+warning, action-result (one per --actions step), machine-result (one per
+machine in fleet runs), lock-wait (queue position while waiting for a lock),
+span (see trace.py), profile (--profile top entries), timeout (a command
+stopped by its step budget, stall detection or timeout, with the last
+output lines; see watchdog.py), cancelled (teardown_ms after a cancel, see
+cancel.py), result. Events emitted while working on one
+machine of a fleet carry a "machine" field. Without --events-fd nothing is
+written here and the classic "PROGRESS <pct> <msg>" text lines stay on stdout,
+as they do when the descriptor turns out not to be open.
+"""
+import errno
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from . import trace, watchdog
+
+PROTOCOL_VERSION = 1
+HEARTBEAT_INTERVAL = 5.0
+EVENT_TAG = "EVENT "
+
+_stream = None
+_tag = ""
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def open_stream(fd: int):
+    global _stream
+    try:
+        _stream = open(fd, "w", buffering=1, encoding="utf-8", closefd=False)
+    except OSError as e:
+        if e.errno != errno.EBADF:
+            raise
+        print(f"WARNING: --events-fd {fd} is not open; reporting progress as text", file=sys.stderr)
+        return
+    threading.Thread(target=_heartbeat, daemon=True).start()
+
+
+def open_stdout():
+    """Emit events as EVENT_TAG-prefixed lines on stdout (--events-stdout)."""
+    global _stream, _tag
+    _stream = sys.stdout
+    _tag = EVENT_TAG
+    threading.Thread(target=_heartbeat, daemon=True).start()
+
+
+def enabled() -> bool:
+    return _stream is not None
+
+
+def emit(type: str, **fields):
+    if _stream is None:
+        return
+    event = {"v": PROTOCOL_VERSION, "type": type, "ts": round(time.time(), 3)}
+    event.update(tags())
+    event.update(fields)
+    line = json.dumps(event, separators=(",", ":"), default=str)
+    with _lock:
+        try:
+            # One write per line: stdout may be shared with other threads' prints
+            _stream.write(_tag + line + "\n")
+            _stream.flush()
+        except (OSError, ValueError):
+            pass
+
+
+def tags() -> dict:
+    return getattr(_local, "tags", {})
+
+
+@contextmanager
+def tagged(**fields):
+    """Add fields to every event this thread emits inside the block."""
+    prev = tags()
+    _local.tags = {**prev, **fields}
+    try:
+        yield
+    finally:
+        _local.tags = prev
+
+
+def _heartbeat():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        emit("heartbeat")
+
+
+def warning(message: str):
+    emit("warning", message=message)
+
+
+def result(rc: int, action: Optional[str] = None, error: Optional[str] = None):
+    emit("result", rc=rc, action=action, error=error)
+
+
+@contextmanager
+def step(name: str):
+    """
+    Emit step-start/step-end (with duration) around a block, traced as a
+    span and run under the step's time budget (see watchdog.py).
+    """
+    emit("step-start", step=name)
+    t0 = time.monotonic()
+    ok = False
+    try:
+        with trace.span(name, cat="step"), watchdog.budget(name):
+            yield
+        ok = True
+    finally:
+        emit("step-end", step=name, duration_ms=round((time.monotonic() - t0) * 1000, 1), ok=ok)
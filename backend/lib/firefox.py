@@ -1,114 +1,223 @@
+"""
+NSS module registration for a user's browsers and mail client.
+
+One pass covers every NSS database profiles.databases() finds: Firefox and
+Thunderbird profiles and the Chromium-family ~/.pki/nssdb. Databases
+already pointing at the module are skipped (see nssdb.py); the others are
+updated with modutil concurrently, since each is independent. modutil runs
+with the owning user's credentials, so nothing in a home becomes root-owned.
+
+With all_users every login account (see users.py) is handled in one run:
+accounts are worked on by a pool, each under its own lock, and the result
+is a single summary table.
+"""
+import contextvars
+import os
+import pwd
 import shutil
-import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
+
+from . import locks, nssdb, paths, trace
+from .profiles import APP_ROOTS, Database, databases, databases_by_home
+from .trace import traced
+from .util import mutating, run, ts
+
+# modutil runs at once for one user
+DB_JOBS = 8
+# users worked on at once with all_users; each runs its modutil calls in turn
+USER_JOBS = 16
+
+APP_LABELS = {"firefox": "Firefox profile", "thunderbird": "Thunderbird profile", "chromium": "Chromium NSS DB"}
+
 
-from .util import PKCS11_MODULE, ts
+@traced
+def firefox_add(user: str, home: str, apps: Optional[list[str]] = None, all_users: bool = False) -> str:
+    """Register the module in every NSS database of the user (of apps, if given)."""
+    with mutating():
+        if all_users:
+            return _all_users_add(apps)
+        # Two modutil runs on one NSS database corrupt it
+        with locks.exclusive(f"nss-{user}", "firefox-add"):
+            return _nss_add(user, home, apps)
 
 
-def firefox_add(user: str, home: str) -> str:
-    if not PKCS11_MODULE.exists():
-        return f"[{ts()}] Firefox add failed: module missing: {PKCS11_MODULE}\n"
-    if shutil.which("modutil") is None:
-        return f"[{ts()}] Firefox add failed: modutil not found (install nss-tools)\n"
+def _user_env(user: str, home: str) -> dict:
+    # A clean environment, like sudo's env_reset, plus the module's libs
+    return {
+        "PATH": os.environ.get("PATH", "/usr/sbin:/usr/bin:/sbin:/bin"),
+        "HOME": home,
+        "USER": user,
+        "LOGNAME": user,
+        "LD_LIBRARY_PATH": f"{paths.OPT_DIR / 'libs'}:{paths.PKCS11_MODULE.parent}",
+    }
 
-    ffdir = Path(home) / ".mozilla/firefox"
-    if not ffdir.exists():
+
+def _states(dbs: list[Database]) -> dict[str, str]:
+    library = str(paths.PKCS11_MODULE)
+    return {db.path: nssdb.registration(Path(db.path), library)[0] for db in dbs}
+
+
+def _nss_add(user: str, home: str, apps: Optional[list[str]]) -> str:
+    if not paths.PKCS11_MODULE.exists():
+        return f"[{ts()}] NSS add failed: module missing: {paths.PKCS11_MODULE}\n"
+    try:
+        pwd.getpwnam(user)
+    except KeyError:
+        return f"[{ts()}] NSS add failed: unknown user: {user}\n"
+
+    # One worker per database: the index lists each one once
+    dbs = [db for db in databases(home, apps) if Path(db.path).is_dir()]
+    if not dbs:
+        roots = [str(Path(home) / APP_ROOTS[app][0]) for app in apps or APP_ROOTS]
         return (
-            f"[{ts()}] Firefox add failed: Firefox profile dir not found: {ffdir}\n"
-            "(Launch Firefox once first.)\n"
+            f"[{ts()}] NSS add failed: no NSS databases found ({', '.join(roots)})\n"
+            "(Launch the browser or mail client once first.)\n"
         )
 
-    profiles = list(ffdir.glob("*.default*")) + list(ffdir.glob("*.default-release*"))
-    if not profiles:
-        return f"[{ts()}] Firefox add: no profiles found under {ffdir}\n"
+    states = _states(dbs)
+    pending = [db for db in dbs if states[db.path] != nssdb.REGISTERED]
+    if pending and shutil.which("modutil") is None:
+        return f"[{ts()}] NSS add failed: modutil not found (install nss-tools)\n"
 
-    out = [f"[{ts()}] Adding PKCS#11 module to Firefox profiles (best-effort)\n"]
-    
-    # Set LD_LIBRARY_PATH to include ArkSigner libs
-    lib_dirs = [
-        "/opt/arksigner/libs",
-        "/opt/arksigner/drivers/akis/x64",
-    ]
-    ld_library_path = ":".join(lib_dirs)
-    
-    for prof in profiles:
-        if not prof.is_dir():
-            continue
-        
+    out = [f"[{ts()}] Adding PKCS#11 module to {len(dbs)} NSS database(s), "
+           f"{len(pending)} need changes (best-effort)\n"]
+    env = _user_env(user, home)
+
+    # Apply all changes in one concurrent pass; report in discovery order
+    results = {db.path: f"{APP_LABELS[db.app]}: {db.path}\n✓ Already registered\n\n"
+               for db in dbs if states[db.path] == nssdb.REGISTERED}
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(DB_JOBS, len(pending)), thread_name_prefix="nss") as pool:
+            futures = {
+                db.path: pool.submit(contextvars.copy_context().run, _register, db, {"user": user}, env,
+                                     states[db.path])
+                for db in pending
+            }
+            results.update((path, f.result()[1]) for path, f in futures.items())
+    out.extend(results[db.path] for db in dbs)
+    return "".join(out)
+
+
+def _all_users_add(apps: Optional[list[str]]) -> str:
+    from .users import login_users
+
+    if not paths.PKCS11_MODULE.exists():
+        return f"[{ts()}] NSS add failed: module missing: {paths.PKCS11_MODULE}\n"
+    accounts = login_users()
+    if not accounts:
+        return f"[{ts()}] NSS add: no login users with a home directory found\n"
+
+    by_home = databases_by_home([a.home for a in accounts], apps)
+    plan = {}
+    for account in accounts:
+        dbs = [db for db in by_home[account.home] if Path(db.path).is_dir()]
+        plan[account.name] = (account, dbs, _states(dbs))
+    pending = sum(1 for _a, dbs, states in plan.values() for db in dbs if states[db.path] != nssdb.REGISTERED)
+    if pending and shutil.which("modutil") is None:
+        return f"[{ts()}] NSS add failed: modutil not found (install nss-tools)\n"
+
+    def one(name: str) -> dict:
+        account, dbs, states = plan[name]
+        row = {"user": name, "databases": len(dbs), "registered": 0, "updated": 0, "failed": [], "elapsed": 0.0}
+        t0 = time.monotonic()
+        todo = [db for db in dbs if states[db.path] != nssdb.REGISTERED]
+        row["registered"] = len(dbs) - len(todo)
+        if todo:
+            with locks.exclusive(f"nss-{name}", "firefox-add"):
+                # Another run may have registered some meanwhile
+                states = _states(todo)
+                env = _user_env(name, account.home)
+                # Numeric ids: accounts of a --root image are unknown to this system
+                creds = {"user": account.uid, "group": account.gid}
+                for db in todo:
+                    if states[db.path] == nssdb.REGISTERED:
+                        row["registered"] += 1
+                    elif _register(db, creds, env, states[db.path])[0]:
+                        row["updated"] += 1
+                    else:
+                        row["failed"].append(db.path)
+        row["elapsed"] = time.monotonic() - t0
+        return row
+
+    with ThreadPoolExecutor(max_workers=min(USER_JOBS, len(accounts)), thread_name_prefix="nss-user") as pool:
+        futures = [pool.submit(contextvars.copy_context().run, one, a.name) for a in accounts]
+        rows = [f.result() for f in futures]
+    return _summary(rows)
+
+
+def _summary(rows: list[dict]) -> str:
+    out = [f"[{ts()}] NSS registration for {len(rows)} user(s)\n",
+           f"  {'USER':<20} {'DBS':>4} {'ALREADY':>7} {'UPDATED':>7} {'FAILED':>6} {'TIME':>7}\n"]
+    for r in rows:
+        out.append(f"  {r['user']:<20} {r['databases']:>4} {r['registered']:>7} {r['updated']:>7} "
+                   f"{len(r['failed']):>6} {r['elapsed']:>6.1f}s\n")
+    out.append(f"  {'total':<20} {sum(r['databases'] for r in rows):>4} "
+               f"{sum(r['registered'] for r in rows):>7} {sum(r['updated'] for r in rows):>7} "
+               f"{sum(len(r['failed']) for r in rows):>6}\n")
+    failed = [(r["user"], path) for r in rows for path in r["failed"]]
+    if failed:
+        out.append("Failed:\n")
+        out.extend(f"  {user}: {path}\n" for user, path in failed)
+    return "".join(out)
+
+
+def _register(db: Database, creds: dict, env: dict, state: str) -> tuple[bool, str]:
+    """Replace the ArkSigner module in one NSS database, as its user (creds: see proc.run)."""
+    prof = Path(db.path)
+    with trace.span(f"{db.app}:{db.name}", cat="nssdb", state=state):
         # First, try to delete existing module (ignore errors)
-        del_cmd = [
-            "sudo",
-            "-u",
-            user,
-            "env",
-            f"LD_LIBRARY_PATH={ld_library_path}",
-            "modutil",
-            "-dbdir",
-            f"sql:{prof}",
-            "-delete",
-            "ArkSigner",
-        ]
-        subprocess.run(del_cmd, text=True, capture_output=True, input="\n\n")
-        
+        del_cmd = ["modutil", "-dbdir", f"sql:{prof}", "-delete", nssdb.MODULE_NAME]
+        if state != nssdb.MISSING:
+            run(del_cmd, check=False, input="\n\n", timeout=10, env=env, **creds)
+
         # Now add the module with LD_LIBRARY_PATH set
         cmd = [
-            "sudo",
-            "-u",
-            user,
-            "env",
-            f"LD_LIBRARY_PATH={ld_library_path}",
             "modutil",
             "-dbdir",
             f"sql:{prof}",
             "-add",
-            "ArkSigner",
+            nssdb.MODULE_NAME,
             "-libfile",
-            str(PKCS11_MODULE),
+            str(paths.PKCS11_MODULE),
             "-force",
         ]
+
+        # Feed enters on stdin for any modutil prompt (no shell pipeline)
+        p = run(cmd, check=False, input="\n" * 8, timeout=10, env=env, **creds)
+        trace.annotate(rc=p.returncode)
+
+    out = [f"{APP_LABELS[db.app]}: {prof}\n"]
+    
+    # Success if rc is 0
+    if p.returncode == 0:
+        out.append("✓ Module added successfully\n")
+    else:
+        out.append(f"✗ Failed (rc={p.returncode})\n")
         
-        # Use yes command to pipe enters to modutil
-        full_cmd = f"yes '' | {' '.join(cmd)}"
-        p = subprocess.run(
-            full_cmd,
-            shell=True,
-            text=True,
-            capture_output=True,
-            timeout=10
-        )
-        
-        out.append(f"Profile: {prof}\n")
-        
-        # Success if rc is 0
-        if p.returncode == 0:
-            out.append("✓ Module added successfully\n")
-        else:
-            out.append(f"✗ Failed (rc={p.returncode})\n")
-            
-        # Only show actual errors, not prompts
-        if p.stderr.strip():
-            stderr_lines = [
-                line for line in p.stderr.splitlines()
-                if "ERROR:" in line and line.strip()
-            ]
-            if stderr_lines:
-                out.append("\n".join(stderr_lines) + "\n")
-        
-        out.append("\n")
-    return "".join(out)
+    # Only show actual errors, not prompts
+    if p.stderr.strip():
+        stderr_lines = [
+            line for line in p.stderr.splitlines()
+            if "ERROR:" in line and line.strip()
+        ]
+        if stderr_lines:
+            out.append("\n".join(stderr_lines) + "\n")
+    
+    out.append("\n")
+    return p.returncode == 0, "".join(out)
 
 
+@traced
 def check_pkcs11_dependencies() -> str:
     """Check if PKCS11 module has all required dependencies"""
-    if not PKCS11_MODULE.exists():
+    if not paths.PKCS11_MODULE.exists():
         return "Module not found"
     
     # Try to load the library to see what's missing
-    result = subprocess.run(
-        ["ldd", str(PKCS11_MODULE)],
-        text=True,
-        capture_output=True
-    )
+    result = run(["ldd", str(paths.PKCS11_MODULE)], check=False, timeout=10)
     
     missing = []
     for line in result.stdout.splitlines():
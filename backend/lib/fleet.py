@@ -0,0 +1,287 @@
+"""
+Fleet mode: one action across several containers.
+
+`--machine a,b,c` or `--all-machines` (every machine under MACHINES_DIR whose
+rootfs carries ArkSigner) runs install, upgrade, repair or status on each
+machine with at most --jobs workers. Steps all machines share run once, up
+front: pcscd, the download, and a debootstrap into a template rootfs that
+new machines are copied from.
+
+Only one machine can back the host's OPT_DIR bind mount: the one already
+in fstab, else the first one listed. Machines other than the one
+arksigner-nspawn.service was written for run under their own unit (see
+util.container_unit). Mutations hold the lock of every machine in the
+fleet for the whole run (see locks.py).
+"""
+import argparse
+import contextlib
+import contextvars
+import json
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+from . import cancel, checkpoint, events, locks, paths, trace
+from .util import in_fleet, mutating, ts
+
+FLEET_ACTIONS = ("install", "upgrade", "repair", "status")
+
+_MACHINE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def discover_machines() -> list[str]:
+    """Machines under MACHINES_DIR whose rootfs carries ArkSigner."""
+    try:
+        entries = sorted(paths.MACHINES_DIR.iterdir())
+    except OSError:
+        return []
+    return [p.name for p in entries if (p / "usr/bin/arksigner").is_dir()]
+
+
+def fleet_machines(args) -> list[str]:
+    if args.all_machines:
+        machines = discover_machines()
+        if not machines:
+            raise SystemExit(f"ERROR: no machines with ArkSigner found under {paths.MACHINES_DIR}")
+    else:
+        machines = list(dict.fromkeys(m.strip() for m in args.machine.split(",") if m.strip()))
+    for m in machines:
+        if not _MACHINE_NAME.match(m):
+            raise SystemExit(f"ERROR: invalid machine name: {m!r}")
+    return machines
+
+
+def bound_machine() -> Optional[str]:
+    """The machine whose tree is bound to OPT_DIR in fstab, if any."""
+    try:
+        fstab = paths.FSTAB.read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return None
+    opt_dir = str(paths.target(paths.OPT_DIR))
+    for line in fstab.splitlines():
+        fields = line.split()
+        if len(fields) < 2 or fields[1] != opt_dir:
+            continue
+        try:
+            rel = Path(fields[0]).relative_to(paths.target(paths.MACHINES_DIR))
+        except ValueError:
+            continue
+        if rel.parts[1:] == ("usr", "bin", "arksigner"):
+            return rel.parts[0]
+    return None
+
+
+def _machine_args(args, machine: str):
+    margs = argparse.Namespace(**vars(args))
+    margs.machine = machine
+    margs.all_machines = False
+    return margs
+
+
+def _each(fn: Callable, machines: list[str], jobs: int, announce: bool = False) -> dict[str, dict]:
+    """
+    Run fn(machine) for every machine on a pool of at most jobs threads.
+    Returns {machine: {"state", "elapsed", "error", "output"}} in input order.
+    """
+    def one(machine: str) -> dict:
+        t0 = time.monotonic()
+        output, error = None, None
+        with events.tagged(machine=machine), trace.span(machine, cat="machine"):
+            try:
+                output = fn(machine)
+            except cancel.Cancelled:
+                error = "cancelled"
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    error = e.code if isinstance(e.code, str) else f"exit code {e.code}"
+            except Exception as e:
+                error = str(e)
+            res = {"state": "ok" if error is None else "failed",
+                   "elapsed": time.monotonic() - t0, "error": error, "output": output}
+            if announce:
+                events.emit("machine-result", status=res["state"],
+                            duration_ms=round(res["elapsed"] * 1000, 1), error=error)
+                print(f"[{ts()}] {machine}: {res['state']} after {res['elapsed']:.1f}s", flush=True)
+        return res
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(machines))), thread_name_prefix="fleet") as pool:
+        # Workers inherit the caller's context (the D-Bus helper routes output by it)
+        futures = [pool.submit(contextvars.copy_context().run, one, m) for m in machines]
+        results = {m: f.result() for m, f in zip(machines, futures)}
+    # Workers stop at their next command after a cancel; unwind the run as a whole
+    cancel.check()
+    return results
+
+
+def _report(results: dict[str, dict]):
+    for machine, res in results.items():
+        if res["output"]:
+            print(f"==== {machine} ====")
+            print(res["output"], end="")
+
+    print("==== Fleet summary ====")
+    for machine, res in results.items():
+        line = f"  {res['state']:<8} {machine:<24} {res['elapsed']:6.1f}s"
+        if res["error"]:
+            line += f"  {res['error']}"
+        print(line.rstrip())
+
+    failed = [m for m, res in results.items() if res["state"] != "ok"]
+    if failed:
+        raise SystemExit(f"ERROR: {len(failed)} of {len(results)} machines failed: {', '.join(failed)}")
+
+
+def _status(args, machines: list[str]):
+    if args.json:
+        from .status import collect_status
+
+        def one_json(machine: str) -> dict:
+            with locks.shared(locks.scope(args.mode, machine)):
+                return collect_status(args.mode, machine, home=args.home, deep=args.deep)
+
+        results = _each(one_json, machines, args.jobs)
+        print(json.dumps({m: res["output"] if res["error"] is None else {"error": res["error"]}
+                          for m, res in results.items()}, indent=2))
+        return
+
+    from .status import status
+
+    def one(machine: str) -> str:
+        with locks.shared(locks.scope(args.mode, machine)):
+            return status(args.mode, machine, args.home)
+
+    _report(_each(one, machines, args.jobs))
+
+
+def _repair(args, machines: list[str]):
+    from .container_mode import repair_container
+    from .status import status
+    from .util import ensure_pcscd_socket
+
+    primary = bound_machine() or machines[0]
+
+    def one(machine: str) -> str:
+        host = locks.host(args.action) if machine == primary else contextlib.nullcontext()
+        with events.step("repair"), host:
+            repair_container(
+                machine,
+                force_terminate=args.force_terminate,
+                recreate_mounts=args.recreate_mounts,
+                clear_cache=args.clear_cache,
+                bind_host=(machine == primary),
+            )
+        return status(args.mode, machine, args.home)
+
+    with mutating():
+        ensure_pcscd_socket()
+        results = _each(one, machines, args.jobs, announce=True)
+    _report(results)
+
+
+def _apply(args, machines: list[str]):
+    from .plan import execute_plan, make_plan, share_download
+    from .status import status
+
+    bound = bound_machine()
+    primary = bound if bound in machines else machines[0]
+
+    planned = _each(lambda m: make_plan(_machine_args(args, m), fleet=True), machines, args.jobs)
+    plans = {m: res["output"] for m, res in planned.items() if res["error"] is None}
+    for machine, plan in plans.items():
+        if machine != primary and plan.has("bind-mount"):
+            plan.drop("bind-mount", f"{paths.OPT_DIR} is bound from {primary}")
+
+    if args.dry_run:
+        for machine, plan in plans.items():
+            print(f"==== {machine} ====")
+            print(plan.format(), end="")
+        for machine, res in planned.items():
+            if res["error"] is not None:
+                print(f"==== {machine} ====\n  cannot plan: {res['error']}")
+        return
+
+    with mutating():
+        # Shared steps, once for the whole fleet
+        if any(p.has("pcscd") for p in plans.values()):
+            from .util import ensure_pcscd_socket
+
+            with events.step("pcscd"):
+                ensure_pcscd_socket()
+            for plan in plans.values():
+                if plan.has("pcscd"):
+                    plan.drop("pcscd", "shared, enabled once for all machines")
+        share_download(list(plans.values()), args)
+
+        template = None
+        new_rootfs = [p for p in plans.values() if p.has("rootfs")]
+        if len(new_rootfs) > 1:
+            from .container_mode import build_rootfs_template
+
+            with events.step("rootfs-template"):
+                template = build_rootfs_template(args.suite, args.mirror)
+            for plan in new_rootfs:
+                plan.rootfs_template = template
+
+        def one(machine: str) -> str:
+            extra = execute_plan(plans[machine], _machine_args(args, machine))
+            out = status(args.mode, machine, args.home)
+            return out + ("\n" + extra if extra else "")
+
+        try:
+            results = _each(one, list(plans), args.jobs, announce=True)
+        finally:
+            if template is not None:
+                shutil.rmtree(template, ignore_errors=True)
+
+    results = {m: results.get(m, planned[m]) for m in machines}
+    if all(res["state"] == "ok" for res in results.values()):
+        # Nothing left to resume
+        for plan in plans.values():
+            checkpoint.clear(plan.scope)
+        checkpoint.clear("fleet")
+        paths.deb_cache("fleet").unlink(missing_ok=True)
+    _report(results)
+
+
+def run_fleet(args):
+    """Run args.action on every machine of the fleet."""
+    if args.mode != "container":
+        raise SystemExit("ERROR: several machines need --mode container")
+    if args.action not in FLEET_ACTIONS:
+        raise SystemExit(f"ERROR: {args.action} works on one machine at a time")
+
+    token = in_fleet.set(True)
+    try:
+        _run(args)
+    finally:
+        in_fleet.reset(token)
+
+
+def _run(args):
+    machines = fleet_machines(args)
+    if args.action == "status" and args.json:
+        _status(args, machines)
+        return
+
+    print(f"[{ts()}] Fleet: {args.action} on {len(machines)} machine(s), "
+          f"{min(args.jobs, len(machines))} at a time: {', '.join(machines)}")
+    if args.action == "status":
+        _status(args, machines)
+    elif args.dry_run:
+        _apply(args, machines)
+    else:
+        with locks.exclusive_all([locks.scope(args.mode, m) for m in machines], args.action):
+            if args.action == "repair":
+                _repair(args, machines)
+            else:
+                _apply(args, machines)
+
+    if args.firefox_add and not args.dry_run:
+        from .firefox import firefox_add
+
+        # Host-wide: the browser sees OPT_DIR, whichever machine backs it
+        with events.step("firefox-add"):
+            print(firefox_add(args.user, args.home, args.nss_apps, args.all_users), end="")
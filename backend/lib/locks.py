@@ -0,0 +1,200 @@
+"""
+Inter-process reader/writer locks under RUN_DIR (/run/arksigner-manager).
+
+Mutating actions hold an exclusive lock on their scope: one per container
+machine ("container-<machine>") or "native" for native mode. The few steps
+that touch host-wide state (OPT_DIR, fstab, the .deb cache) additionally
+take the short-lived "host" lock. Read-only actions take a shared lock on
+their scope but never wait for it: while a mutation holds it, status runs
+anyway and reports the holder (see holder()).
+
+Locks are flock(2) on RUN_DIR/<name>.lock, so a crashed holder releases
+them automatically. Waiters queue in FIFO order in RUN_DIR/<name>.queue/
+and report their position and the current holder through progress lines
+and "lock-wait" events.
+
+Holders are identified by pid and call: the D-Bus helper serves several
+callers from one process, each inside its own call() block.
+"""
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Optional
+
+from . import events, paths, watchdog
+from .util import progress, ts
+
+HOST = "host"
+POLL_INTERVAL = 0.2
+
+_call: contextvars.ContextVar = contextvars.ContextVar("arksigner_lock_call", default="main")
+
+
+@contextmanager
+def call():
+    """Mark the block as a call of its own, so it sees the process's other calls as holders."""
+    token = _call.set(uuid.uuid4().hex)
+    try:
+        yield
+    finally:
+        _call.reset(token)
+
+
+def scope(mode: str, machine: str) -> str:
+    return f"container-{machine}" if mode == "container" else "native"
+
+
+def _lock_file(name: str) -> Path:
+    return paths.RUN_DIR / f"{name}.lock"
+
+
+def _owner_file(name: str) -> Path:
+    return paths.RUN_DIR / f"{name}.owner"
+
+
+def _queue_dir(name: str) -> Path:
+    return paths.RUN_DIR / f"{name}.queue"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _open(name: str) -> int:
+    paths.RUN_DIR.mkdir(parents=True, exist_ok=True)
+    return os.open(_lock_file(name), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+
+
+def _try(fd: int, op: int) -> bool:
+    try:
+        fcntl.flock(fd, op | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def holder(name: str) -> Optional[dict]:
+    """Which other process or call holds name exclusively ({pid, action, since}), or None."""
+    try:
+        info = json.loads(_owner_file(name).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    pid = int(info.get("pid", 0)) if isinstance(info, dict) else 0
+    if (pid == os.getpid() and info.get("call") == _call.get()) or not _alive(pid):
+        return None
+    return info
+
+
+def _describe(info: Optional[dict]) -> str:
+    if not info:
+        return "another instance"
+    return f"{info.get('action', '?')} (pid {info.get('pid')}, since {info.get('since')})"
+
+
+def _queue_position(qdir: Path, ticket: str) -> int:
+    ahead = 0
+    for entry in sorted(qdir.iterdir()):
+        if entry.name >= ticket:
+            break
+        try:
+            pid = int(entry.name.split("-")[1])
+        except (IndexError, ValueError):
+            continue
+        if _alive(pid):
+            ahead += 1
+        else:
+            entry.unlink(missing_ok=True)
+    return ahead + 1
+
+
+def _wait(fd: int, name: str, op: int):
+    """Queue up behind earlier waiters and block until the lock is ours."""
+    qdir = _queue_dir(name)
+    qdir.mkdir(parents=True, exist_ok=True)
+    ticket = f"{time.time_ns():020d}-{os.getpid()}-{threading.get_native_id()}"
+    (qdir / ticket).touch()
+    last = None
+    t0 = time.monotonic()
+    try:
+        while True:
+            position = _queue_position(qdir, ticket)
+            if position == 1 and _try(fd, op):
+                return
+            info = holder(name)
+            if (position, info) != last:
+                last = (position, info)
+                events.emit("lock-wait", lock=name, position=position, holder=info)
+                progress(0, f"Waiting for {name} lock held by {_describe(info)}; position {position} in queue")
+            time.sleep(POLL_INTERVAL)
+    finally:
+        (qdir / ticket).unlink(missing_ok=True)
+        # Waiting in line does not eat into the step's time budget
+        watchdog.extend(time.monotonic() - t0)
+
+
+@contextmanager
+def exclusive(name: str, action: str):
+    """Hold name exclusively, waiting in line if someone else has it."""
+    fd = _open(name)
+    try:
+        # Do not overtake anyone already waiting in line
+        qdir = _queue_dir(name)
+        queued = qdir.is_dir() and any(qdir.iterdir())
+        if queued or not _try(fd, fcntl.LOCK_EX):
+            _wait(fd, name, fcntl.LOCK_EX)
+        _owner_file(name).write_text(
+            json.dumps({"pid": os.getpid(), "call": _call.get(), "action": action, "since": ts()}),
+            encoding="utf-8")
+        try:
+            yield
+        finally:
+            _owner_file(name).unlink(missing_ok=True)
+    finally:
+        # Closing the descriptor drops the flock
+        os.close(fd)
+
+
+@contextmanager
+def exclusive_all(names: list[str], action: str):
+    """Hold several locks; taken in sorted order so two callers cannot deadlock."""
+    with ExitStack() as stack:
+        for name in sorted(set(names)):
+            stack.enter_context(exclusive(name, action))
+        yield
+
+
+@contextmanager
+def shared(name: str):
+    """
+    Take a shared lock without ever waiting. Yields None when it was taken,
+    or the current holder's info when a mutation holds the lock.
+    """
+    try:
+        fd = _open(name)
+    except OSError:
+        # Read-only callers must work even where RUN_DIR is not writable
+        yield None
+        return
+    try:
+        if _try(fd, fcntl.LOCK_SH):
+            yield None
+        else:
+            yield holder(name) or {}
+    finally:
+        os.close(fd)
+
+
+def host(action: str):
+    return exclusive(HOST, action)
@@ -1,54 +1,91 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import sys
+import time
+from pathlib import Path
 
+from . import cancel, events, paths, trace, watchdog
 from .util import (
     DEFAULT_DEB_URL,
     DEFAULT_MACHINE,
     DEFAULT_MIRROR,
     DEFAULT_SUITE,
-    ensure_pcscd_socket,
+    mutating,
+    probe_cache,
     require_root,
-    status,
     ts,
 )
-from .container_mode import (
-    ensure_bind_mount_from_container,
-    ensure_rootfs,
-    enable_start_container,
-    install_deb_inside_container,
-    repair_container,
-    uninstall_container,
-)
-from .native_mode import (
-    deb_extract_to_opt,
-    enable_start_native,
-    patchelf_set_rpath,
-    repair_native,
-    uninstall_native,
-)
-from .download import download_deb
-from .firefox import firefox_add
 
+# Action modules (container_mode, native_mode, download, firefox, plan) are
+# imported inside the handlers below, so `--action status` only pays for
+# util/status and every pkexec invocation starts as fast as possible.
 
-def main():
-    require_root()
 
+def build_parser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(prog="arksigner-manager-cli")
     ap.add_argument("--mode", choices=["container", "native"], default="container")
     ap.add_argument(
         "--action",
-        required=True,
-        choices=["install", "upgrade", "status", "repair", "uninstall", "purge"],
+        choices=["install", "upgrade", "status", "repair", "uninstall", "purge", "firefox-add",
+                 "pkcs11-probe", "sign-bench"],
+    )
+    ap.add_argument(
+        "--actions",
+        metavar="A,B,...",
+        help="run several actions in order in one process, e.g. install,firefox-add,status",
+    )
+    ap.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="like --actions, from a JSON list ('-' for stdin); items are action names "
+             "or objects like {\"action\": \"repair\", \"recreate_mounts\": true}",
+    )
+    ap.add_argument(
+        "--serve",
+        action="store_true",
+        help="run as the D-Bus activated privileged helper (tr.org.arksigner.Manager1)",
     )
 
     ap.add_argument("--deb", default=DEFAULT_DEB_URL, help="deb URL or local path")
     ap.add_argument("--suite", default=DEFAULT_SUITE, help="container: debootstrap suite")
     ap.add_argument("--mirror", default=DEFAULT_MIRROR, help="container: debootstrap mirror")
-    ap.add_argument("--machine", default=DEFAULT_MACHINE, help="container: machine name")
+    ap.add_argument(
+        "--machine",
+        default=DEFAULT_MACHINE,
+        help="container: machine name, or a comma-separated list to run on several machines",
+    )
+    ap.add_argument(
+        "--all-machines",
+        action="store_true",
+        help="container: run on every machine under /var/lib/machines that has ArkSigner installed",
+    )
+    ap.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        metavar="N",
+        help="with several machines: how many to work on at once (default: 4)",
+    )
     ap.add_argument("--recreate", action="store_true", help="container: recreate rootfs")
 
-    ap.add_argument("--firefox-add", action="store_true", help="best-effort add PKCS#11 to Firefox (modutil)")
+    ap.add_argument(
+        "--firefox-add",
+        action="store_true",
+        help="best-effort add PKCS#11 to the user's NSS databases: Firefox, Thunderbird, Chromium (modutil)",
+    )
+    ap.add_argument(
+        "--nss-apps",
+        type=_nss_apps,
+        metavar="A,B,...",
+        help="with firefox-add: only these of firefox, thunderbird, chromium (default: all)",
+    )
+    ap.add_argument(
+        "--all-users",
+        action="store_true",
+        help="with firefox-add: every login user (UID_MIN..UID_MAX from login.defs, with a home) "
+             "instead of --user/--home; prints one summary table",
+    )
     ap.add_argument(
         "--native-rpath",
         action="store_true",
@@ -60,79 +97,496 @@ def main():
     ap.add_argument("--recreate-mounts", action="store_true", help="repair: recreate bind mounts from scratch")
     ap.add_argument("--clear-cache", action="store_true", default=True, help="repair: clear systemd cache (default: true)")
 
+    ap.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="install/upgrade: print the steps that would run and exit",
+    )
+    ap.add_argument(
+        "--resume",
+        action="store_true",
+        help="install/upgrade: skip steps an interrupted earlier run already completed",
+    )
+    ap.add_argument(
+        "--pkcs11-module",
+        metavar="PATH",
+        help="pkcs11-probe, sign-bench: module to load instead of ArkSigner's libakisp11.so "
+             "(e.g. /usr/lib/softhsm/libsofthsm2.so)",
+    )
+    ap.add_argument(
+        "--repeat",
+        type=_positive_int,
+        default=10,
+        metavar="N",
+        help="pkcs11-probe: rounds to run, each in a fresh process (default: 10)",
+    )
+    ap.add_argument("--slot", type=int, metavar="ID", help="sign-bench: slot to use (default: first with a token)")
+    ap.add_argument(
+        "--pin-file",
+        metavar="FILE",
+        help="sign-bench: read the token's user PIN from the first line of FILE ('-' for stdin)",
+    )
+    ap.add_argument("--key", metavar="LABEL", help="sign-bench: only the private key with this label")
+    ap.add_argument(
+        "--ops",
+        type=_positive_int,
+        default=200,
+        metavar="N",
+        help="sign-bench: signatures per key (default: 200)",
+    )
+    ap.add_argument(
+        "--sessions",
+        type=_positive_int,
+        default=1,
+        metavar="N",
+        help="sign-bench: concurrent sessions the signatures are spread over (default: 1)",
+    )
+    ap.add_argument("--results", metavar="FILE", help="sign-bench: also write the results as JSON to FILE")
+    ap.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="sign-bench: compare with earlier --results, e.g. taken in the other mode",
+    )
+    ap.add_argument("--json", action="store_true",
+                    help="status, pkcs11-probe, sign-bench: print structured JSON (with timings)")
+    ap.add_argument("--deep", action="store_true",
+                    help="status --json: also run the slow probes (PKCS#11 module libraries, disk usage)")
+    ap.add_argument(
+        "--trace",
+        metavar="OUT.json",
+        help="write timing spans as a Chrome trace-event file (opens in Perfetto)",
+    )
+    ap.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="DIR",
+        help="profile the action; writes pstats and collapsed stacks "
+             "(default dir: /var/log/arksigner-manager/profiles)",
+    )
+    ap.add_argument(
+        "--profiler",
+        choices=["cprofile", "sampling"],
+        default="cprofile",
+        help="with --profile: cProfile, or py-spy sampling when installed",
+    )
+    ap.add_argument(
+        "--root",
+        metavar="PREFIX",
+        help="operate on the system tree below PREFIX instead of / (also: ARKSIGNER_ROOT)",
+    )
+    ap.add_argument(
+        "--events-fd",
+        type=int,
+        metavar="FD",
+        help="write newline-delimited JSON progress events to this file descriptor",
+    )
+    ap.add_argument(
+        "--events-stdout",
+        action="store_true",
+        help="write the JSON events to stdout as 'EVENT {...}' lines (survives pkexec, "
+             "which closes other descriptors)",
+    )
+    ap.add_argument(
+        "--step-budget",
+        action="append",
+        type=watchdog.parse_budget,
+        metavar="STEP=SECONDS",
+        help="override a step's time budget, e.g. rootfs=7200 (0: unlimited; repeatable)",
+    )
+    ap.add_argument(
+        "--stall-timeout",
+        type=float,
+        metavar="SECONDS",
+        help=f"stop debootstrap/apt-get/curl after this long without output or progress "
+             f"(default: {watchdog.STALL_TIMEOUT_S:.0f}; 0: never)",
+    )
+    ap.add_argument(
+        "--control-stdin",
+        action="store_true",
+        help="cancel the run when a 'cancel' line arrives on stdin or stdin is closed",
+    )
+
     ap.add_argument("--user", default=os.environ.get("SUDO_USER", "") or os.environ.get("USER", "root"))
     ap.add_argument("--home", default=os.path.expanduser("~"))
+    return ap
 
-    args = ap.parse_args()
 
-    # Best-effort; do not hard fail if missing on some systems
-    ensure_pcscd_socket()
+def _nss_apps(value: str) -> list[str]:
+    from .profiles import APPS
 
-    # STATUS
-    if args.action == "status":
-        out = status(args.mode, args.machine)
-        if args.firefox_add:
-            out += "\n" + firefox_add(args.user, args.home)
-        print(out, end="")
+    apps = [a.strip() for a in value.split(",") if a.strip()]
+    unknown = [a for a in apps if a not in APPS]
+    if unknown or not apps:
+        raise argparse.ArgumentTypeError(f"expected a list of {', '.join(APPS)}, got {value!r}")
+    return apps
+
+
+def _positive_int(value: str) -> int:
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+    return n
+
+
+def main(argv=None):
+    ap = build_parser()
+    args = ap.parse_args(argv)
+    if args.control_stdin and args.batch == "-":
+        ap.error("--control-stdin and --batch - both read stdin; pass the batch as a file")
+
+    if args.root:
+        paths.set_root(args.root)
+    require_root()
+
+    if args.serve:
+        from .service import serve
+
+        serve()
         return
+    cancel.install(args.control_stdin)
+    watchdog.configure(args.step_budget, args.stall_timeout)
+    if args.trace:
+        trace.record()
+    steps = batch_steps(ap, args)
+    name = ",".join(s.action for s in steps)
 
-    # REPAIR
-    if args.action == "repair":
-        if args.mode == "container":
-            repair_container(
-                args.machine,
-                force_terminate=args.force_terminate,
-                recreate_mounts=args.recreate_mounts,
-                clear_cache=args.clear_cache,
-            )
-            out = status("container", args.machine)
+    if args.events_stdout:
+        events.open_stdout()
+    elif args.events_fd is not None:
+        events.open_stream(args.events_fd)
+
+    try:
+        if args.profile is None:
+            _run_and_report(steps, name)
         else:
-            repair_native(
-                recreate_mounts=args.recreate_mounts,
-                clear_cache=args.clear_cache,
-            )
-            out = status("native", args.machine)
-        if args.firefox_add:
-            out += "\n" + firefox_add(args.user, args.home)
-        print(out, end="")
+            from .profiling import profiled
+
+            with profiled(name, args.profile, args.profiler):
+                _run_and_report(steps, name)
+    finally:
+        if args.trace:
+            trace.write_chrome_trace(args.trace)
+
+
+def _run_and_report(steps: list, name: str):
+    try:
+        run_steps(steps)
+    except cancel.Cancelled:
+        teardown = cancel.teardown_ms()
+        print(f"[{ts()}] Cancelled; teardown took {teardown:.0f} ms", flush=True)
+        events.emit("cancelled", action=name, teardown_ms=teardown)
+        events.result(cancel.EXIT_CODE, action=name, error="cancelled")
+        raise
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            msg = e.code if isinstance(e.code, str) else None
+            events.result(1 if msg else int(e.code), action=name, error=msg)
+        else:
+            events.result(0, action=name)
+        raise
+    except Exception as e:
+        events.result(1, action=name, error=str(e))
+        raise
+    events.result(0, action=name)
+
+
+def _with_firefox(args, out: str) -> str:
+    if args.firefox_add:
+        from .firefox import firefox_add
+
+        with events.step("firefox-add"):
+            out += "\n" + firefox_add(args.user, args.home, args.nss_apps, args.all_users)
+    return out
+
+
+def _action_status(args):
+    if args.json:
+        import json
+
+        from .status import collect_status
+
+        print(json.dumps(collect_status(args.mode, args.machine, home=args.home, deep=args.deep),
+                         indent=2))
         return
 
-    # UNINSTALL / PURGE
-    if args.action in ("uninstall", "purge"):
-        purge = (args.action == "purge")
+    from .status import status
+
+    print(_with_firefox(args, status(args.mode, args.machine, args.home)), end="")
+
+
+def _action_firefox_add(args):
+    from .firefox import firefox_add
+
+    with events.step("firefox-add"):
+        print(firefox_add(args.user, args.home, args.nss_apps, args.all_users), end="")
+
+
+def _action_pkcs11_probe(args):
+    from .pkcs11 import format_probe, probe
+
+    module = Path(args.pkcs11_module) if args.pkcs11_module else paths.PKCS11_MODULE
+    with events.step("pkcs11-probe"):
+        result = probe(module, args.repeat)
+    if args.json:
+        import json
+
+        print(json.dumps(result, indent=2))
+    else:
+        print(format_probe(result), end="")
+    if result["failures"]:
+        raise SystemExit(f"ERROR: {len(result['failures'])} of {result['rounds']} probe rounds failed")
+
+
+def _action_sign_bench(args):
+    from . import signbench
+
+    module = Path(args.pkcs11_module) if args.pkcs11_module else paths.PKCS11_MODULE
+    baseline = signbench.load_results(args.compare) if args.compare else None
+    pin = signbench.read_pin(args.pin_file)
+    with events.step("sign-bench"):
+        result = signbench.bench(module, args.slot, pin, args.ops, args.sessions, args.key)
+    result["layout"] = signbench.layout(args.mode, args.machine)
+    if args.results:
+        signbench.save_results(result, args.results)
+
+    if args.json:
+        import json
+
+        print(json.dumps(result, indent=2))
+    else:
+        out = signbench.format_bench(result)
+        if baseline is not None:
+            out += "\n" + signbench.format_compare(result, baseline, args.compare)
+        print(out, end="")
+    failed = [k for k in result["keys"] if k["error"]]
+    if failed:
+        raise SystemExit(f"ERROR: signing failed for {len(failed)} of {len(result['keys'])} keys")
+
+
+def _action_repair(args):
+    from . import locks
+    from .status import status
+    from .util import ensure_pcscd_socket
+
+    # Repair touches OPT_DIR and fstab in both modes
+    with mutating(), locks.host(args.action):
+        # Best-effort; do not hard fail if missing on some systems
+        ensure_pcscd_socket()
+        with events.step("repair"):
+            if args.mode == "container":
+                from .container_mode import repair_container
+
+                repair_container(
+                    args.machine,
+                    force_terminate=args.force_terminate,
+                    recreate_mounts=args.recreate_mounts,
+                    clear_cache=args.clear_cache,
+                )
+            else:
+                from .native_mode import repair_native
+
+                repair_native(
+                    recreate_mounts=args.recreate_mounts,
+                    clear_cache=args.clear_cache,
+                )
+    print(_with_firefox(args, status(args.mode, args.machine, args.home)), end="")
+
+
+def _action_uninstall(args):
+    from . import checkpoint, locks
+
+    purge = (args.action == "purge")
+    scope = locks.scope(args.mode, args.machine)
+    with mutating(), events.step(args.action), locks.host(args.action):
         if args.mode == "container":
+            from .container_mode import uninstall_container
+
             uninstall_container(args.machine, purge=purge)
         else:
+            from .native_mode import uninstall_native
+
             uninstall_native(purge=purge)
-        print(f"[{ts()}] Uninstalled. mode={args.mode} purge={purge}\n", end="")
+        checkpoint.clear(scope)
+        if purge:
+            paths.deb_cache(scope).unlink(missing_ok=True)
+    print(f"[{ts()}] Uninstalled. mode={args.mode} purge={purge}\n", end="")
+
+
+def _action_apply(args):
+    """install / upgrade: only the steps the current state actually needs."""
+    from .plan import execute_plan, make_plan
+    from .status import status
+
+    plan = make_plan(args)
+    if args.dry_run:
+        print(plan.format(), end="")
         return
 
-    # INSTALL / UPGRADE
-    debp = download_deb(args.deb)
+    with mutating():
+        extra = execute_plan(plan, args)
+    out = status(args.mode, args.machine, args.home)
+    if extra:
+        out += "\n" + extra
+    print(_with_firefox(args, out), end="")
+
+
+ACTIONS = {
+    "install": _action_apply,
+    "upgrade": _action_apply,
+    "status": _action_status,
+    "repair": _action_repair,
+    "uninstall": _action_uninstall,
+    "purge": _action_uninstall,
+    "firefox-add": _action_firefox_add,
+    "pkcs11-probe": _action_pkcs11_probe,
+    "sign-bench": _action_sign_bench,
+}
+
+# Actions that never change system state
+READ_ONLY_ACTIONS = {"status", "pkcs11-probe", "sign-bench"}
+
+# Options that only make sense for the whole invocation, not per batch step
+_BATCH_GLOBAL = {
+    "serve", "actions", "batch", "events_fd", "events_stdout", "trace", "profile", "profiler", "root",
+    "control_stdin", "step_budget", "stall_timeout",
+}
 
-    extra = ""
-    if args.mode == "container":
-        # install can create rootfs; upgrade uses existing
-        if args.action == "install":
-            ensure_rootfs(args.machine, args.suite, args.mirror, recreate=args.recreate)
-        else:
-            ensure_rootfs(args.machine, args.suite, args.mirror, recreate=False)
 
-        install_deb_inside_container(args.machine, debp)
-        ensure_bind_mount_from_container(args.machine)
-        enable_start_container(args.machine)
-        out = status("container", args.machine)
+def run_action(args):
+    """Execute one parsed CLI invocation; output goes to stdout."""
+    if args.dry_run and args.action not in ("install", "upgrade"):
+        raise SystemExit("ERROR: --dry-run is only supported for install and upgrade")
+
+    with trace.span(args.action, cat="action"):
+        if args.all_machines or "," in args.machine:
+            from .fleet import run_fleet
+
+            run_fleet(args)
+            return
+        with _action_lock(args):
+            ACTIONS[args.action](args)
+
+
+def _action_lock(args):
+    """
+    Shared lock for read-only runs (never waits), exclusive lock on the
+    machine or mode for mutations. firefox-add locks the user's NSS databases
+    itself.
+    """
+    from contextlib import nullcontext
+
+    from . import locks
+
+    scope = locks.scope(args.mode, args.machine)
+    if args.action in READ_ONLY_ACTIONS or args.dry_run:
+        return locks.shared(scope)
+    if args.action == "firefox-add":
+        return nullcontext()
+    return locks.exclusive(scope, args.action)
+
+
+def batch_steps(ap: argparse.ArgumentParser, args) -> list:
+    """
+    Expand --actions / --batch into one namespace per step. Each step starts
+    from the command line options; --batch items may override them.
+    """
+    if args.batch:
+        import json
+
+        try:
+            if args.batch == "-":
+                items = json.load(sys.stdin)
+            else:
+                with open(args.batch, encoding="utf-8") as f:
+                    items = json.load(f)
+        except (OSError, ValueError) as e:
+            ap.error(f"--batch: cannot read {args.batch}: {e}")
+        if not isinstance(items, list):
+            ap.error("--batch: expected a JSON list")
+    elif args.actions:
+        items = [a.strip() for a in args.actions.split(",") if a.strip()]
+    elif args.action:
+        return [args]
     else:
-        deb_extract_to_opt(debp)
-        if args.native_rpath:
-            extra = patchelf_set_rpath()
-        enable_start_native()
-        out = status("native", args.machine)
-        if extra:
-            out += "\n" + extra
+        ap.error("--action is required")
 
-    if args.firefox_add:
-        out += "\n" + firefox_add(args.user, args.home)
+    if not items:
+        ap.error("no actions given")
+    steps = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"action": item}
+        if not isinstance(item, dict) or item.get("action") not in ACTIONS:
+            ap.error(f"unknown batch action: {item!r}")
+        step = argparse.Namespace(**vars(args))
+        # A global --dry-run previews the install/upgrade steps of the batch
+        step.dry_run = args.dry_run and item["action"] in ("install", "upgrade")
+        for key, value in item.items():
+            key = key.replace("-", "_")
+            if key in _BATCH_GLOBAL or not hasattr(step, key):
+                ap.error(f"unsupported batch option: {key}")
+            setattr(step, key, value)
+        steps.append(step)
+    return steps
+
+
+def run_steps(steps: list):
+    """
+    Run a single action as-is, or a batch in order with shared probe results.
+    A batch stops at the first failing step; every step gets a per-step
+    result event and a line in the summary.
+    """
+    first = steps[0]
+    if len(steps) == 1 and not (first.actions or first.batch):
+        run_action(first)
+        return
+
+    with probe_cache():
+        _run_batch(steps)
+
+
+def _run_batch(steps: list):
+    results = []
+    failure = None
+    for i, step in enumerate(steps):
+        if failure is not None:
+            results.append((step.action, "skipped", 0.0, None))
+            events.emit("action-result", index=i, action=step.action, status="skipped")
+            continue
+
+        print(f"==== [{i + 1}/{len(steps)}] {step.action} ====")
+        t0 = time.monotonic()
+        error = None
+        try:
+            run_action(step)
+        except cancel.Cancelled as e:
+            error = "cancelled"
+            failure = e
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = e.code if isinstance(e.code, str) else f"exit code {e.code}"
+                failure = e
+        except Exception as e:
+            error = str(e)
+            failure = e
+        elapsed = time.monotonic() - t0
+        state = "ok" if error is None else "failed"
+        results.append((step.action, state, elapsed, error))
+        events.emit("action-result", index=i, action=step.action, status=state,
+                    duration_ms=round(elapsed * 1000, 1), error=error)
 
-    print(out, end="")
+    print("==== Batch summary ====")
+    for action, state, elapsed, error in results:
+        line = f"  {state:<8} {action:<12}"
+        if state != "skipped":
+            line += f" {elapsed:6.1f}s"
+        if error:
+            line += f"  {error}"
+        print(line.rstrip())
 
+    if failure is not None:
+        raise failure
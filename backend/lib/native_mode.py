@@ -2,37 +2,43 @@ import shutil
 import tempfile
 from pathlib import Path
 
+from . import cancel, paths, systemd, units
+from .download import deb_control_version
+from .trace import annotate, traced
 from .util import (
-    OPT_DIR,
-    PKCS11_MODULE,
     SERVICE_NATIVE,
-    SERVICE_NATIVE_PATH,
     ensure_pcscd_socket,
     progress,
     run,
 )
 
 
-def write_native_service():
-    content = f"""[Unit]
-Description=ArkSigner Service (native)
-After=pcscd.socket
-Requires=pcscd.socket
+def native_service_content() -> str:
+    return units.render_native_unit()
 
-[Service]
-Type=simple
-User=root
-Environment=LD_LIBRARY_PATH={OPT_DIR}/libs:/usr/local/lib64
-ExecStart={OPT_DIR}/arksigner-universal
-Restart=always
-RestartSec=5
 
-[Install]
-WantedBy=multi-user.target
-"""
-    SERVICE_NATIVE_PATH.write_text(content, encoding="utf-8")
+def write_native_service() -> bool:
+    return units.write_unit(paths.unit_file(SERVICE_NATIVE), native_service_content())
 
 
+def _wipe_opt():
+    for child in list(paths.OPT_DIR.iterdir()):
+        try:
+            if child.is_dir():
+                shutil.rmtree(child, ignore_errors=True)
+            else:
+                child.unlink(missing_ok=True)
+        except Exception:
+            pass
+
+
+def _drop_partial_tree():
+    """After a cancel mid-copy: no half-installed tree, no stale version."""
+    _wipe_opt()
+    paths.NATIVE_VERSION_FILE.unlink(missing_ok=True)
+
+
+@traced
 def deb_extract_to_opt(deb_path: Path):
     progress(40, "Extracting .deb to /opt/arksigner")
 
@@ -42,8 +48,10 @@ def deb_extract_to_opt(deb_path: Path):
     with tempfile.TemporaryDirectory() as td:
         td = Path(td)
         shutil.copy2(deb_path, td / "pkg.deb")
+        annotate(bytes=deb_path.stat().st_size)
 
-        run(["ar", "x", str(td / "pkg.deb")], check=True)
+        # ar extracts into the working directory
+        run(["ar", "x", str(td / "pkg.deb")], check=True, cwd=str(td))
 
         data = None
         for cand in td.glob("data.tar.*"):
@@ -52,6 +60,8 @@ def deb_extract_to_opt(deb_path: Path):
         if data is None:
             raise SystemExit("ERROR: data.tar.* not found in deb.")
 
+        version = deb_control_version(deb_path)
+
         root = td / "root"
         root.mkdir(parents=True, exist_ok=True)
         run(["tar", "-xf", str(data), "-C", str(root)], check=True)
@@ -60,30 +70,24 @@ def deb_extract_to_opt(deb_path: Path):
         if not src.exists():
             raise SystemExit("ERROR: deb content missing usr/bin/arksigner")
 
-        OPT_DIR.mkdir(parents=True, exist_ok=True)
+        paths.OPT_DIR.mkdir(parents=True, exist_ok=True)
 
-        # wipe existing tree for clean upgrade
-        for child in list(OPT_DIR.iterdir()):
-            try:
-                if child.is_dir():
-                    shutil.rmtree(child, ignore_errors=True)
-                else:
-                    child.unlink(missing_ok=True)
-            except Exception:
-                pass
+        with cancel.undo(_drop_partial_tree, cancel_only=True):
+            # wipe existing tree for clean upgrade
+            _wipe_opt()
 
-        # copy; skip dotfiles
-        for item in src.iterdir():
-            if item.name.startswith("."):
-                continue
-            target = OPT_DIR / item.name
-            if item.is_dir():
-                shutil.copytree(item, target, dirs_exist_ok=True)
-            else:
-                shutil.copy2(item, target)
+            # copy; skip dotfiles
+            for item in src.iterdir():
+                if item.name.startswith("."):
+                    continue
+                target = paths.OPT_DIR / item.name
+                if item.is_dir():
+                    shutil.copytree(item, target, dirs_exist_ok=True)
+                else:
+                    shutil.copy2(item, target)
 
         # remove dotfiles that might slip
-        for dot in OPT_DIR.rglob(".*"):
+        for dot in paths.OPT_DIR.rglob(".*"):
             try:
                 if dot.is_file():
                     dot.unlink()
@@ -92,22 +96,28 @@ def deb_extract_to_opt(deb_path: Path):
 
         # ensure executables
         for exe in ["arksigner-universal", "arksigner-service"]:
-            pexe = OPT_DIR / exe
+            pexe = paths.OPT_DIR / exe
             if pexe.exists():
                 pexe.chmod(0o755)
 
-        if not PKCS11_MODULE.exists():
-            raise SystemExit(f"ERROR: PKCS#11 module missing after install: {PKCS11_MODULE}")
+        if not paths.PKCS11_MODULE.exists():
+            raise SystemExit(f"ERROR: PKCS#11 module missing after install: {paths.PKCS11_MODULE}")
+
+        # Remember what was installed; there is no dpkg database in native mode
+        if version:
+            paths.NATIVE_VERSION_FILE.parent.mkdir(parents=True, exist_ok=True)
+            paths.NATIVE_VERSION_FILE.write_text(version + "\n", encoding="utf-8")
 
     progress(80, "Files installed to /opt/arksigner")
 
 
+@traced
 def patchelf_set_rpath() -> str:
     if shutil.which("patchelf") is None:
         return "RPATH requested but patchelf not found (install patchelf)\n"
 
     out = ["Applying RPATH ($ORIGIN/libs) to ArkSigner binaries (opt-in)\n"]
-    targets = [OPT_DIR / "arksigner-universal", OPT_DIR / "arksigner-service"]
+    targets = [paths.OPT_DIR / "arksigner-universal", paths.OPT_DIR / "arksigner-service"]
 
     for t in targets:
         if not t.exists():
@@ -133,36 +143,49 @@ def patchelf_set_rpath() -> str:
     return "".join(out)
 
 
-def enable_start_native():
+@traced
+def enable_start_native(payload_changed: bool = True) -> str:
     progress(92, "Enabling systemd service")
-    write_native_service()
-    run(["systemctl", "daemon-reload"], check=True)
-    run(["systemctl", "stop", SERVICE_NATIVE], check=False)
-    run(["systemctl", "reset-failed", SERVICE_NATIVE], check=False)
-    run(["systemctl", "enable", "--now", SERVICE_NATIVE], check=True)
+    report = units.apply_service(
+        SERVICE_NATIVE,
+        paths.unit_file(SERVICE_NATIVE),
+        native_service_content(),
+        payload_changed,
+        restart_native_service,
+    )
     progress(100, "Completed")
+    return report
+
+
+@traced
+def restart_native_service():
+    systemd.stop_unit(SERVICE_NATIVE)
+    systemd.reset_failed(SERVICE_NATIVE)
+    systemd.enable_units([SERVICE_NATIVE], now=True, check=True)
 
 
+@traced
 def uninstall_native(purge: bool):
     """Uninstall native installation with optional purge."""
     progress(10, "Stopping service")
-    run(["systemctl", "stop", SERVICE_NATIVE], check=False)
+    systemd.stop_unit(SERVICE_NATIVE)
     
     progress(30, "Disabling service")
-    run(["systemctl", "disable", SERVICE_NATIVE], check=False)
-    SERVICE_NATIVE_PATH.unlink(missing_ok=True)
+    systemd.disable_units([SERVICE_NATIVE])
+    paths.unit_file(SERVICE_NATIVE).unlink(missing_ok=True)
     
     progress(50, "Reloading systemd")
-    run(["systemctl", "daemon-reload"], check=False)
-    run(["systemctl", "reset-failed", SERVICE_NATIVE], check=False)
+    systemd.daemon_reload()
+    systemd.reset_failed(SERVICE_NATIVE)
 
     if purge:
         progress(75, "Purging /opt/arksigner")
-        shutil.rmtree(OPT_DIR, ignore_errors=True)
+        shutil.rmtree(paths.OPT_DIR, ignore_errors=True)
     
     progress(100, "Completed")
 
 
+@traced
 def repair_native(recreate_mounts: bool = False, clear_cache: bool = True):
     """
     Repair native installation with optional advanced fixes.
@@ -178,14 +201,14 @@ def repair_native(recreate_mounts: bool = False, clear_cache: bool = True):
     
     if clear_cache:
         progress(50, "Clearing systemd cache")
-        run(["systemctl", "daemon-reload"], check=False)
-        run(["systemctl", "reset-failed", SERVICE_NATIVE], check=False)
+        systemd.daemon_reload()
+        systemd.reset_failed(SERVICE_NATIVE)
     
     progress(70, "Stopping service")
-    run(["systemctl", "stop", SERVICE_NATIVE], check=False)
+    systemd.stop_unit(SERVICE_NATIVE)
     
     progress(85, "Starting service")
-    run(["systemctl", "start", SERVICE_NATIVE], check=False)
+    systemd.start_unit(SERVICE_NATIVE)
     
     progress(100, "Repair completed")
 
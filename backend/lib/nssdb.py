@@ -0,0 +1,65 @@
+"""
+In-process reads of NSS module databases.
+
+A sql: NSS database lists its PKCS#11 modules in pkcs11.txt: blank-line
+separated entries of key=value lines (library=, name=, parameters=, NSS=).
+Reading it tells whether ArkSigner is registered, and with which library,
+without spawning modutil.
+"""
+import os
+from pathlib import Path
+from typing import Optional
+
+MODULE_NAME = "ArkSigner"
+
+# registration() states
+REGISTERED = "registered"  # present with the expected library
+STALE = "stale"  # present, but with another library
+MISSING = "missing"  # database without the module
+UNKNOWN = "unknown"  # no pkcs11.txt (legacy dbm database or never opened)
+
+
+def parse_pkcs11_txt(text: str) -> list[dict]:
+    """The module entries of a pkcs11.txt, as {key: value} dicts."""
+    modules = []
+    entry: dict = {}
+    for line in text.splitlines() + [""]:
+        line = line.strip()
+        if not line:
+            if entry:
+                modules.append(entry)
+                entry = {}
+            continue
+        if line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        entry[key.strip()] = value
+    return modules
+
+
+def modules(dbdir: Path) -> Optional[list[dict]]:
+    """Modules of the sql: database in dbdir, or None without a pkcs11.txt."""
+    try:
+        text = (Path(dbdir) / "pkcs11.txt").read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return None
+    return parse_pkcs11_txt(text)
+
+
+def _same_file(a: str, b: str) -> bool:
+    return a == b or os.path.realpath(a) == os.path.realpath(b)
+
+
+def registration(dbdir: Path, library: str, name: str = MODULE_NAME) -> tuple[str, Optional[str]]:
+    """(state, registered library path) of module name in dbdir."""
+    found = modules(dbdir)
+    if found is None:
+        return UNKNOWN, None
+    for module in found:
+        if module.get("name") == name:
+            current = module.get("library", "")
+            return (REGISTERED if _same_file(current, library) else STALE), current
+    return MISSING, None
@@ -0,0 +1,90 @@
+"""
+Filesystem locations managed by the backend, relative to a root prefix.
+
+By default everything lives on the live root. `--root PREFIX` (or
+ARKSIGNER_ROOT) moves every path below PREFIX, so isolated installs can sit
+side by side on one host and images can be prepared offline. Always access
+these as `paths.NAME` at call time: set_root() rebinds them.
+
+Files that the target system itself reads (unit files, fstab) must refer to
+target paths, see target().
+"""
+import os
+from pathlib import Path
+
+ROOT = Path("/")
+
+OPT_DIR: Path
+PKCS11_MODULE: Path
+SYSTEMD_UNIT_DIR: Path
+FSTAB: Path
+PASSWD: Path
+LOGIN_DEFS: Path
+MACHINES_DIR: Path
+NSPAWN_EXPORT_DIR: Path
+STATE_DIR: Path
+NATIVE_VERSION_FILE: Path
+CHECKPOINT_FILE: Path
+LOG_DIR: Path
+PROFILE_DIR: Path
+RUN_DIR: Path
+
+
+def _rooted(path: str) -> Path:
+    return ROOT / path.lstrip("/")
+
+
+def set_root(prefix) -> None:
+    global ROOT, OPT_DIR, PKCS11_MODULE, SYSTEMD_UNIT_DIR, FSTAB, PASSWD, LOGIN_DEFS, MACHINES_DIR
+    global NSPAWN_EXPORT_DIR, STATE_DIR, NATIVE_VERSION_FILE, CHECKPOINT_FILE
+    global LOG_DIR, PROFILE_DIR, RUN_DIR
+
+    ROOT = Path(prefix or "/").resolve()
+
+    OPT_DIR = _rooted("/opt/arksigner")
+    PKCS11_MODULE = OPT_DIR / "drivers/akis/x64/libakisp11.so"
+
+    SYSTEMD_UNIT_DIR = _rooted("/etc/systemd/system")
+    FSTAB = _rooted("/etc/fstab")
+    PASSWD = _rooted("/etc/passwd")
+    LOGIN_DEFS = _rooted("/etc/login.defs")
+    MACHINES_DIR = _rooted("/var/lib/machines")
+    NSPAWN_EXPORT_DIR = _rooted("/run/systemd/nspawn/unix-export")
+
+    STATE_DIR = _rooted("/var/lib/arksigner-manager")
+    NATIVE_VERSION_FILE = STATE_DIR / "native.version"
+    CHECKPOINT_FILE = STATE_DIR / "checkpoint.json"
+
+    LOG_DIR = _rooted("/var/log/arksigner-manager")
+    PROFILE_DIR = LOG_DIR / "profiles"
+
+    # Lock files (locks.py)
+    RUN_DIR = _rooted("/run/arksigner-manager")
+
+
+def unit_file(unit: str) -> Path:
+    return SYSTEMD_UNIT_DIR / unit
+
+
+def deb_cache(scope: str) -> Path:
+    """
+    Downloaded .deb of one lock scope (see locks.py), so concurrent installs
+    never share a file. Kept on disk (not /tmp) so an interrupted install can
+    resume after a reboot.
+    """
+    return STATE_DIR / f"arksigner-{scope}.deb"
+
+
+def relocated() -> bool:
+    return ROOT != Path("/")
+
+
+def target(path: Path) -> Path:
+    """The path as the target system sees it (PREFIX/opt/x -> /opt/x)."""
+    try:
+        return Path("/") / Path(path).relative_to(ROOT)
+    except ValueError:
+        return Path(path)
+
+
+set_root(os.environ.get("ARKSIGNER_ROOT"))
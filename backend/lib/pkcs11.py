@@ -0,0 +1,428 @@
+"""
+PKCS#11 smoke test and latency probe (--action pkcs11-probe).
+
+Every round runs in a fresh interpreter (`python -m backend.lib.pkcs11
+MODULE`) that dlopens the module with ctypes and calls C_GetFunctionList,
+C_Initialize, C_GetInfo, C_GetSlotList, C_GetTokenInfo for each slot with a
+token, and C_Finalize, timing each call. A fresh process measures a cold
+load, as a browser starting up pays it, and a module that crashes or hangs
+only takes its round down with it. The child reports one JSON line before
+and after every call, so the parent knows where a round stopped.
+
+Works with any module, e.g. SoftHSM2 (--pkcs11-module
+/usr/lib/softhsm/libsofthsm2.so) where no token is at hand.
+"""
+import ctypes
+import json
+import math
+import signal
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+PROBE_TIMEOUT_S = 30.0
+
+CALLS = ("dlopen", "C_GetFunctionList", "C_Initialize", "C_GetInfo", "C_GetSlotList",
+         "C_GetTokenInfo", "C_Finalize")
+PERCENTILES = (50, 90, 99)
+
+CKR_OK = 0
+CKR_USER_ALREADY_LOGGED_IN = 0x100
+CKF_OS_LOCKING_OK = 0x2
+CKF_TOKEN_INITIALIZED = 0x400
+CKF_SERIAL_SESSION = 0x4
+CKU_USER = 1
+CKO_PRIVATE_KEY = 3
+CKA_CLASS = 0x0
+CKA_LABEL = 0x3
+CKA_KEY_TYPE = 0x100
+CKA_SIGN = 0x108
+CKK_RSA = 0x0
+CKK_EC = 0x3
+CKM_RSA_PKCS = 0x1
+CKM_ECDSA = 0x1041
+
+# Names for the return values a probe is likely to see
+CKR_NAMES = {
+    0x0: "CKR_OK",
+    0x1: "CKR_CANCEL",
+    0x2: "CKR_HOST_MEMORY",
+    0x3: "CKR_SLOT_ID_INVALID",
+    0x5: "CKR_GENERAL_ERROR",
+    0x6: "CKR_FUNCTION_FAILED",
+    0x7: "CKR_ARGUMENTS_BAD",
+    0x30: "CKR_DEVICE_ERROR",
+    0x31: "CKR_DEVICE_MEMORY",
+    0x32: "CKR_DEVICE_REMOVED",
+    0x54: "CKR_FUNCTION_NOT_SUPPORTED",
+    0xE0: "CKR_TOKEN_NOT_PRESENT",
+    0xE1: "CKR_TOKEN_NOT_RECOGNIZED",
+    0xA0: "CKR_PIN_INCORRECT",
+    0xA4: "CKR_PIN_LOCKED",
+    0xB3: "CKR_SESSION_HANDLE_INVALID",
+    0x100: "CKR_USER_ALREADY_LOGGED_IN",
+    0x101: "CKR_USER_NOT_LOGGED_IN",
+    0x150: "CKR_BUFFER_TOO_SMALL",
+    0x190: "CKR_CRYPTOKI_NOT_INITIALIZED",
+    0x191: "CKR_CRYPTOKI_ALREADY_INITIALIZED",
+}
+
+CK_ULONG = ctypes.c_ulong
+CK_RV = CK_ULONG
+CK_SLOT_ID = CK_ULONG
+CK_SESSION_HANDLE = CK_ULONG
+CK_OBJECT_HANDLE = CK_ULONG
+CK_BBOOL = ctypes.c_ubyte
+
+
+class CK_VERSION(ctypes.Structure):
+    _fields_ = [("major", ctypes.c_ubyte), ("minor", ctypes.c_ubyte)]
+
+
+class CK_INFO(ctypes.Structure):
+    _fields_ = [
+        ("cryptokiVersion", CK_VERSION),
+        ("manufacturerID", ctypes.c_char * 32),
+        ("flags", CK_ULONG),
+        ("libraryDescription", ctypes.c_char * 32),
+        ("libraryVersion", CK_VERSION),
+    ]
+
+
+class CK_TOKEN_INFO(ctypes.Structure):
+    _fields_ = [
+        ("label", ctypes.c_char * 32),
+        ("manufacturerID", ctypes.c_char * 32),
+        ("model", ctypes.c_char * 16),
+        ("serialNumber", ctypes.c_char * 16),
+        ("flags", CK_ULONG),
+        ("ulMaxSessionCount", CK_ULONG),
+        ("ulSessionCount", CK_ULONG),
+        ("ulMaxRwSessionCount", CK_ULONG),
+        ("ulRwSessionCount", CK_ULONG),
+        ("ulMaxPinLen", CK_ULONG),
+        ("ulMinPinLen", CK_ULONG),
+        ("ulTotalPublicMemory", CK_ULONG),
+        ("ulFreePublicMemory", CK_ULONG),
+        ("ulTotalPrivateMemory", CK_ULONG),
+        ("ulFreePrivateMemory", CK_ULONG),
+        ("hardwareVersion", CK_VERSION),
+        ("firmwareVersion", CK_VERSION),
+        ("utcTime", ctypes.c_char * 16),
+    ]
+
+
+class CK_C_INITIALIZE_ARGS(ctypes.Structure):
+    _fields_ = [
+        ("CreateMutex", ctypes.c_void_p),
+        ("DestroyMutex", ctypes.c_void_p),
+        ("LockMutex", ctypes.c_void_p),
+        ("UnlockMutex", ctypes.c_void_p),
+        ("flags", CK_ULONG),
+        ("pReserved", ctypes.c_void_p),
+    ]
+
+
+class CK_ATTRIBUTE(ctypes.Structure):
+    _fields_ = [("type", CK_ULONG), ("pValue", ctypes.c_void_p), ("ulValueLen", CK_ULONG)]
+
+
+class CK_MECHANISM(ctypes.Structure):
+    _fields_ = [("mechanism", CK_ULONG), ("pParameter", ctypes.c_void_p), ("ulParameterLen", CK_ULONG)]
+
+
+# CK_FUNCTION_LIST entries, in the order of the PKCS#11 v2.40 header
+FUNCTIONS = (
+    "C_Initialize", "C_Finalize", "C_GetInfo", "C_GetFunctionList", "C_GetSlotList",
+    "C_GetSlotInfo", "C_GetTokenInfo", "C_GetMechanismList", "C_GetMechanismInfo",
+    "C_InitToken", "C_InitPIN", "C_SetPIN", "C_OpenSession", "C_CloseSession",
+    "C_CloseAllSessions", "C_GetSessionInfo", "C_GetOperationState", "C_SetOperationState",
+    "C_Login", "C_Logout", "C_CreateObject", "C_CopyObject", "C_DestroyObject",
+    "C_GetObjectSize", "C_GetAttributeValue", "C_SetAttributeValue", "C_FindObjectsInit",
+    "C_FindObjects", "C_FindObjectsFinal", "C_EncryptInit", "C_Encrypt", "C_EncryptUpdate",
+    "C_EncryptFinal", "C_DecryptInit", "C_Decrypt", "C_DecryptUpdate", "C_DecryptFinal",
+    "C_DigestInit", "C_Digest", "C_DigestUpdate", "C_DigestKey", "C_DigestFinal",
+    "C_SignInit", "C_Sign", "C_SignUpdate", "C_SignFinal", "C_SignRecoverInit",
+    "C_SignRecover", "C_VerifyInit", "C_Verify", "C_VerifyUpdate", "C_VerifyFinal",
+    "C_VerifyRecoverInit", "C_VerifyRecover", "C_DigestEncryptUpdate",
+    "C_DecryptDigestUpdate", "C_SignEncryptUpdate", "C_DecryptVerifyUpdate",
+    "C_GenerateKey", "C_GenerateKeyPair", "C_WrapKey", "C_UnwrapKey", "C_DeriveKey",
+    "C_SeedRandom", "C_GenerateRandom", "C_GetFunctionStatus", "C_CancelFunction",
+    "C_WaitForSlotEvent",
+)
+
+
+class CK_FUNCTION_LIST(ctypes.Structure):
+    _fields_ = [("version", CK_VERSION)] + [(name, ctypes.c_void_p) for name in FUNCTIONS]
+
+
+_PROTOTYPES = {
+    "C_Initialize": ctypes.CFUNCTYPE(CK_RV, ctypes.c_void_p),
+    "C_Finalize": ctypes.CFUNCTYPE(CK_RV, ctypes.c_void_p),
+    "C_GetInfo": ctypes.CFUNCTYPE(CK_RV, ctypes.POINTER(CK_INFO)),
+    "C_GetSlotList": ctypes.CFUNCTYPE(CK_RV, CK_BBOOL, ctypes.POINTER(CK_SLOT_ID), ctypes.POINTER(CK_ULONG)),
+    "C_GetTokenInfo": ctypes.CFUNCTYPE(CK_RV, CK_SLOT_ID, ctypes.POINTER(CK_TOKEN_INFO)),
+    "C_OpenSession": ctypes.CFUNCTYPE(CK_RV, CK_SLOT_ID, CK_ULONG, ctypes.c_void_p, ctypes.c_void_p,
+                                      ctypes.POINTER(CK_SESSION_HANDLE)),
+    "C_CloseSession": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE),
+    "C_Login": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE, CK_ULONG, ctypes.c_char_p, CK_ULONG),
+    "C_Logout": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE),
+    "C_GetAttributeValue": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE, CK_OBJECT_HANDLE,
+                                            ctypes.POINTER(CK_ATTRIBUTE), CK_ULONG),
+    "C_FindObjectsInit": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE, ctypes.POINTER(CK_ATTRIBUTE), CK_ULONG),
+    "C_FindObjects": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE, ctypes.POINTER(CK_OBJECT_HANDLE), CK_ULONG,
+                                      ctypes.POINTER(CK_ULONG)),
+    "C_FindObjectsFinal": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE),
+    "C_SignInit": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE, ctypes.POINTER(CK_MECHANISM), CK_OBJECT_HANDLE),
+    "C_Sign": ctypes.CFUNCTYPE(CK_RV, CK_SESSION_HANDLE, ctypes.c_char_p, CK_ULONG, ctypes.c_char_p,
+                               ctypes.POINTER(CK_ULONG)),
+}
+
+
+class Module:
+    """A dlopened PKCS#11 module and its function list."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lib = ctypes.CDLL(path)
+
+    def load_functions(self):
+        get_list = self.lib.C_GetFunctionList
+        get_list.restype = CK_RV
+        get_list.argtypes = [ctypes.POINTER(ctypes.POINTER(CK_FUNCTION_LIST))]
+        table = ctypes.POINTER(CK_FUNCTION_LIST)()
+        rv = get_list(ctypes.byref(table))
+        self.functions = table.contents if rv == CKR_OK and table else None
+        return rv
+
+    def fn(self, name: str, prototype=None):
+        """The module's entry point name, typed by prototype (or _PROTOTYPES)."""
+        address = getattr(self.functions, name)
+        if not address:
+            raise AttributeError(f"{name} is not provided by {self.path}")
+        return (prototype or _PROTOTYPES[name])(address)
+
+    def slots(self) -> tuple[int, list[int]]:
+        """(rv, slots with a token): the size query and the fetch, as callers pair them."""
+        get_slots = self.fn("C_GetSlotList")
+        count = CK_ULONG()
+        rv = get_slots(1, None, ctypes.byref(count))
+        if rv != CKR_OK:
+            return rv, []
+        slots = (CK_SLOT_ID * max(1, count.value))()
+        rv = get_slots(1, slots, ctypes.byref(count))
+        return rv, list(slots[:count.value])
+
+
+def rv_name(rv: int) -> str:
+    return CKR_NAMES.get(rv, f"0x{rv:08x}")
+
+
+def text(raw: bytes) -> str:
+    """A blank-padded CK_UTF8CHAR field as a str."""
+    return raw.decode("utf-8", errors="replace").rstrip(" \0")
+
+
+def version(v: CK_VERSION) -> str:
+    return f"{v.major}.{v.minor}"
+
+
+def library_info(info: CK_INFO) -> dict:
+    return {
+        "manufacturer": text(info.manufacturerID),
+        "description": text(info.libraryDescription),
+        "library_version": version(info.libraryVersion),
+        "cryptoki_version": version(info.cryptokiVersion),
+    }
+
+
+def token_info(slot: int, token: CK_TOKEN_INFO) -> dict:
+    return {
+        "slot": slot,
+        "label": text(token.label),
+        "manufacturer": text(token.manufacturerID),
+        "model": text(token.model),
+        "serial": text(token.serialNumber),
+        "initialized": bool(token.flags & CKF_TOKEN_INITIALIZED),
+    }
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(values: list[float], percentiles: tuple = PERCENTILES) -> dict:
+    """n, min, mean, percentiles and max of a list of milliseconds."""
+    summary = {"n": len(values), "min": min(values), "mean": statistics.fmean(values)}
+    for pct in percentiles:
+        summary[f"p{pct}"] = percentile(values, pct)
+    summary["max"] = max(values)
+    return {k: v if k == "n" else round(v, 3) for k, v in summary.items()}
+
+
+# --------------------------------------------------------------------------
+# Child: one probe round
+# --------------------------------------------------------------------------
+
+def _emit(record: dict):
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
+
+
+def _timed(call: str, fn, *args):
+    """Call fn(*args), emitting a line before and one with the duration after."""
+    _emit({"call": call})
+    t0 = time.perf_counter()
+    result = fn(*args)
+    ms = (time.perf_counter() - t0) * 1000
+    rv = result[0] if isinstance(result, tuple) else result
+    _emit({"call": call, "ms": ms, "rv": rv if isinstance(rv, int) else CKR_OK})
+    return result
+
+
+def _round(path: str) -> int:
+    module = _timed("dlopen", Module, path)
+    if _timed("C_GetFunctionList", module.load_functions) != CKR_OK or module.functions is None:
+        return 1
+
+    init_args = CK_C_INITIALIZE_ARGS(flags=CKF_OS_LOCKING_OK)
+    if _timed("C_Initialize", module.fn("C_Initialize"), ctypes.byref(init_args)) != CKR_OK:
+        return 1
+    try:
+        info = CK_INFO()
+        if _timed("C_GetInfo", module.fn("C_GetInfo"), ctypes.byref(info)) != CKR_OK:
+            return 1
+        _emit({"info": library_info(info)})
+
+        rv, slots = _timed("C_GetSlotList", module.slots)
+        if rv != CKR_OK:
+            return 1
+
+        tokens = []
+        get_token = module.fn("C_GetTokenInfo")
+        for slot in slots:
+            token = CK_TOKEN_INFO()
+            if _timed("C_GetTokenInfo", get_token, slot, ctypes.byref(token)) != CKR_OK:
+                return 1
+            tokens.append(token_info(slot, token))
+        _emit({"tokens": tokens})
+    finally:
+        _timed("C_Finalize", module.fn("C_Finalize"), None)
+    return 0
+
+
+# --------------------------------------------------------------------------
+# Parent: rounds, statistics, report
+# --------------------------------------------------------------------------
+
+def _parse_round(stdout: str) -> tuple[list[dict], dict]:
+    """(call records, other records merged) of one child's output."""
+    calls, extra = [], {}
+    for line in stdout.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict):
+            continue
+        if "call" in record:
+            calls.append(record)
+        else:
+            extra.update(record)
+    return calls, extra
+
+
+def _round_error(p, calls: list[dict]) -> Optional[str]:
+    """Why a round failed, naming the call it stopped in; None if it did not."""
+    last = calls[-1] if calls else None
+    if last is None:
+        where = "before dlopen"
+    elif "ms" not in last:
+        where = f"in {last['call']}"
+    else:
+        where = f"after {last['call']}"
+    if p.returncode == 124:
+        return f"timed out {where} (>{PROBE_TIMEOUT_S:.0f}s)"
+    if p.returncode < 0:
+        return f"crashed with {signal.Signals(-p.returncode).name} {where}"
+    if last is not None and last.get("rv", CKR_OK) != CKR_OK:
+        return f"{last['call']} returned {rv_name(last['rv'])}"
+    if p.returncode != 0:
+        lines = [l for l in p.stderr.strip().splitlines() if l.strip()]
+        return f"exit code {p.returncode} {where}" + (f": {lines[-1]}" if lines else "")
+    return None
+
+
+def probe(module: Path, repeat: int) -> dict:
+    """Run repeat rounds against module; per-call latency statistics in ms."""
+    from .proc import run
+
+    if not module.exists():
+        raise SystemExit(f"ERROR: PKCS#11 module not found: {module}")
+
+    # total: load to finalize, the figure to compare across module versions
+    samples: dict[str, list[float]] = {call: [] for call in CALLS + ("total",)}
+    failures = []
+    info: dict = {}
+    for i in range(repeat):
+        p = run([sys.executable, "-m", __name__, str(module)], check=False, timeout=PROBE_TIMEOUT_S,
+                cwd=str(Path(__file__).resolve().parents[2]))
+        calls, extra = _parse_round(p.stdout)
+        error = _round_error(p, calls)
+        # A failed round's timings are not comparable with a complete one's
+        if error is not None:
+            failures.append({"round": i + 1, "error": error})
+            continue
+        done = [record for record in calls if "ms" in record]
+        for record in done:
+            samples[record["call"]].append(record["ms"])
+        samples["total"].append(sum(record["ms"] for record in done))
+        info = extra
+
+    return {
+        "module": str(module),
+        "rounds": repeat,
+        "info": info.get("info"),
+        "tokens": info.get("tokens", []),
+        "calls": {call: summarize(ms) for call, ms in samples.items() if ms},
+        "failures": failures,
+    }
+
+
+def format_probe(result: dict) -> str:
+    ok = result["rounds"] - len(result["failures"])
+    lines = [f"PKCS#11 module: {result['module']}"]
+    info = result["info"]
+    if info:
+        lines.append(f"  Library: {info['description']} {info['library_version']} "
+                     f"({info['manufacturer']}, Cryptoki {info['cryptoki_version']})")
+    tokens = result["tokens"]
+    if tokens:
+        for token in tokens:
+            state = "" if token["initialized"] else " (not initialized)"
+            lines.append(f"  Slot {token['slot']}: {token['label'] or '-'} "
+                         f"[{token['manufacturer']} {token['model']}, serial {token['serial'] or '-'}]{state}")
+    elif info:
+        lines.append("  No token present")
+    lines.append(f"  Rounds: {ok}/{result['rounds']} ok")
+
+    if result["calls"]:
+        cols = ["min"] + [f"p{pct}" for pct in PERCENTILES] + ["max"]
+        lines.append("")
+        lines.append(f"  {'CALL (ms)':<18} {'N':>5} " + " ".join(f"{c.upper():>9}" for c in cols))
+        for call, stats in result["calls"].items():
+            lines.append(f"  {call:<18} {stats['n']:>5} " + " ".join(f"{stats[c]:>9.3f}" for c in cols))
+
+    if result["failures"]:
+        lines.append("")
+        lines.append("  Failed rounds:")
+        lines.extend(f"    #{f['round']}: {f['error']}" for f in result["failures"])
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    sys.exit(_round(sys.argv[1]))
@@ -0,0 +1,373 @@
+"""
+Desired-state planner for install/upgrade.
+
+Instead of always running the full step sequence, inspect what is already in
+place (unit file content, fstab entry, bind mount, installed version, service
+state) and compute the minimal list of steps that reaches the target.
+`--dry-run` prints the plan without executing it.
+
+Completed download/rootfs/package steps are checkpointed (see checkpoint.py);
+`--resume` drops the ones whose inputs and outputs are unchanged.
+
+Checkpoints and the downloaded .deb belong to the plan's lock scope (see
+locks.py). In fleet runs (fleet.py) the download and rootfs template are
+shared and handled by the caller.
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from . import checkpoint, events, locks, paths, systemd
+from .status import collect_status
+from .units import unit_up_to_date
+from .util import (
+    SERVICE_NATIVE,
+    container_unit,
+    progress,
+    rootfs_dir,
+    ts,
+)
+
+
+@dataclass
+class Step:
+    name: str
+    reason: str
+
+
+@dataclass
+class Plan:
+    action: str
+    mode: str
+    target_version: str
+    machine: str = ""
+    installed: str = ""
+    payload_present: bool = False
+    recreate_rootfs: bool = False
+    deb_path: Optional[Path] = None
+    deb_sha256: str = ""
+    rootfs_template: Optional[Path] = None
+    scope: str = ""
+    fleet: bool = False
+    # Steps planned only because the package may change, and why the service
+    # needs a start anyway; see _settle_target()
+    payload_only: list[str] = field(default_factory=list)
+    start_reason: str = ""
+    steps: list[Step] = field(default_factory=list)
+    skipped: list[Step] = field(default_factory=list)
+
+    def need(self, name: str, reason: str):
+        self.steps.append(Step(name, reason))
+
+    def skip(self, name: str, reason: str):
+        self.skipped.append(Step(name, reason))
+
+    def drop(self, name: str, reason: str):
+        self.steps = [s for s in self.steps if s.name != name]
+        self.skip(name, reason)
+
+    def has(self, name: str) -> bool:
+        return any(s.name == name for s in self.steps)
+
+    @property
+    def cache_scope(self) -> str:
+        """Scope of the download: a fleet fetches one .deb for all machines."""
+        return "fleet" if self.fleet else self.scope
+
+    def key(self, name: str) -> str:
+        """Checkpoint name of a step."""
+        return f"{name}@{self.cache_scope if name == 'download' else self.scope}"
+
+    def format(self) -> str:
+        lines = [f"[{ts()}] Plan for {self.action} (mode={self.mode}, target={self.target_version or 'unknown'})"]
+        if not self.steps:
+            lines.append("  nothing to do: system already matches the target")
+        for s in self.steps:
+            lines.append(f"  run   {s.name:<14} {s.reason}")
+        for s in self.skipped:
+            lines.append(f"  skip  {s.name:<14} {s.reason}")
+        return "\n".join(lines) + "\n"
+
+
+def make_plan(args, fleet: bool = False) -> Plan:
+    from .download import deb_control_version, deb_target_version
+
+    mode = args.mode
+    machine = args.machine
+    target = deb_target_version(args.deb)
+    if not target and not args.deb.startswith(("http://", "https://")) and Path(args.deb).is_file():
+        # A local file is cheap to look into; a URL is settled after the download
+        target = deb_control_version(Path(args.deb))
+    plan = Plan(action=args.action, mode=mode, target_version=target, machine=machine,
+                scope=locks.scope(mode, machine), fleet=fleet)
+
+    facts = collect_status(mode, machine, probes=["units", "bind_mount", "version"])["probes"]
+    units = facts["units"].get("data", {})
+    installed = facts["version"].get("data", {}).get("installed")
+
+    # Nothing runs under --root, so there only the enablement counts
+    pcscd = units.get("pcscd.socket", {})
+    pcscd_active = pcscd.get("active") == "active" or systemd.offline()
+    if pcscd_active and pcscd.get("file_state") == "enabled":
+        plan.skip("pcscd", "pcscd.socket already enabled and active")
+    else:
+        plan.need("pcscd", "pcscd.socket not enabled/active")
+
+    # Payload (rootfs + package, or /opt tree)
+    payload = False
+    if mode == "container":
+        rootfs_ok = (rootfs_dir(machine) / "etc/debian_version").exists()
+        if args.action == "install" and args.recreate:
+            plan.need("rootfs", "--recreate requested")
+            plan.recreate_rootfs = True
+            rootfs_ok = False
+        elif rootfs_ok and checkpoint.interrupted(plan.key("rootfs")):
+            # debootstrap writes etc/debian_version long before it finishes
+            plan.need("rootfs", "previous debootstrap was interrupted")
+            plan.recreate_rootfs = True
+            rootfs_ok = False
+        elif not rootfs_ok:
+            plan.need("rootfs", "Debian rootfs missing")
+        else:
+            plan.skip("rootfs", "Debian rootfs present")
+
+        payload_ok = rootfs_ok and _payload_present(mode, machine)
+    else:
+        payload_ok = _payload_present(mode, machine)
+    plan.installed = installed or ""
+    plan.payload_present = payload_ok
+
+    if not payload_ok:
+        payload = True
+        plan.need("package", "ArkSigner payload missing")
+    elif not target:
+        payload = True
+        plan.need("package", "target version unknown from --deb name; will compare after download")
+    elif installed != target:
+        payload = True
+        plan.need("package", f"installed {installed or 'unknown'} != target {target}")
+    else:
+        plan.skip("package", f"version {installed} already installed")
+
+    if payload:
+        plan.steps.insert(len(plan.steps) - 1, Step("download", f"fetch {args.deb}"))
+    else:
+        plan.skip("download", "package step not needed")
+
+    if mode == "container":
+        mount = facts["bind_mount"].get("data", {})
+        # Under --root only the fstab entry is written, see ensure_bind_mount_from_container
+        mount_ok = (mount.get("mounted") or systemd.offline()) and mount.get("fstab")
+        if payload or not mount_ok:
+            plan.need("bind-mount", f"bind {paths.OPT_DIR} (mounted={mount.get('mounted')}, fstab={mount.get('fstab')})")
+            if mount_ok:
+                plan.payload_only.append("bind-mount")
+        else:
+            plan.skip("bind-mount", f"{paths.OPT_DIR} mounted and persisted in fstab")
+    elif args.native_rpath:
+        plan.need("rpath", "--native-rpath requested")
+
+    # Unit file and service
+    if mode == "container":
+        from .container_mode import container_service_content
+
+        unit = container_unit(machine)
+        unit_path, content = paths.unit_file(unit), container_service_content(machine)
+    else:
+        from .native_mode import native_service_content
+
+        unit, unit_path, content = SERVICE_NATIVE, paths.unit_file(SERVICE_NATIVE), native_service_content()
+
+    unit_changed = not unit_up_to_date(unit_path, content)
+    if unit_changed:
+        plan.need("unit", f"{unit_path} missing or differs from rendered content")
+    else:
+        plan.skip("unit", f"{unit_path} up to date")
+
+    svc = units.get(unit, {})
+    active = svc.get("active") == "active" or systemd.offline()
+    if not active or svc.get("file_state") != "enabled":
+        plan.start_reason = f"{unit} is {svc.get('active')}/{svc.get('file_state')}"
+    if unit_changed or payload:
+        plan.need("restart", "unit or payload changed")
+        if not unit_changed:
+            plan.payload_only.append("restart")
+    elif plan.start_reason:
+        plan.need("start", plan.start_reason)
+    else:
+        plan.skip("restart", f"{unit} enabled and active, nothing changed")
+
+    if args.resume:
+        _resume(plan, args)
+    return plan
+
+
+def _fp_download(args) -> str:
+    if args.deb.startswith(("http://", "https://")):
+        return checkpoint.fingerprint(deb=args.deb)
+    try:
+        st = Path(args.deb).stat()
+    except OSError:
+        return ""
+    # A local file may be replaced in place
+    return checkpoint.fingerprint(deb=args.deb, size=st.st_size, mtime=st.st_mtime_ns)
+
+
+def _fp_rootfs(args) -> str:
+    return checkpoint.fingerprint(machine=args.machine, suite=args.suite, mirror=args.mirror)
+
+
+def _fp_package(plan: Plan) -> str:
+    return checkpoint.fingerprint(mode=plan.mode, machine=plan.machine, deb_sha256=plan.deb_sha256)
+
+
+def _resume(plan: Plan, args):
+    """Drop planned steps that an earlier, interrupted run already completed."""
+    if plan.has("download"):
+        def deb_valid(out: dict) -> bool:
+            return checkpoint.file_sha256(Path(out["path"])) == out["sha256"]
+
+        entry = checkpoint.completed(plan.key("download"), _fp_download(args), deb_valid)
+        if entry:
+            plan.deb_path = Path(entry["outputs"]["path"])
+            plan.deb_sha256 = entry["outputs"]["sha256"]
+            plan.drop("download", f"resumed: downloaded {entry['at']}, hash unchanged")
+
+    if plan.has("rootfs"):
+        rootfs = rootfs_dir(args.machine)
+        entry = checkpoint.completed(plan.key("rootfs"), _fp_rootfs(args),
+                                     lambda _out: (rootfs / "etc/debian_version").exists())
+        if entry:
+            plan.recreate_rootfs = False
+            plan.drop("rootfs", f"resumed: debootstrap finished {entry['at']}")
+
+    _resume_package(plan)
+
+
+def _resume_package(plan: Plan):
+    if not plan.has("package") or not plan.deb_sha256 or plan.has("rootfs"):
+        return
+    entry = checkpoint.completed(plan.key("package"), _fp_package(plan), lambda _out: _payload_present(plan.mode, plan.machine))
+    if entry:
+        plan.drop("package", f"resumed: package installed {entry['at']}")
+
+
+def _payload_present(mode: str, machine: str) -> bool:
+    if mode == "container":
+        return (rootfs_dir(machine) / "usr/bin/arksigner").exists()
+    return paths.PKCS11_MODULE.exists()
+
+
+def share_download(plans: list[Plan], args):
+    """Download once for every plan that needs the package (fleet runs)."""
+    needing = [p for p in plans if p.has("download")]
+    if not needing:
+        return
+    from .download import download_deb
+
+    with events.step("download"):
+        debp = download_deb(args.deb, paths.deb_cache(needing[0].cache_scope), resume=args.resume)
+    sha = checkpoint.file_sha256(debp)
+    checkpoint.done(needing[0].key("download"), _fp_download(args), path=str(debp), sha256=sha)
+    for plan in needing:
+        plan.deb_path, plan.deb_sha256 = debp, sha
+        plan.drop("download", "shared download, fetched once for all machines")
+        if args.resume:
+            _resume_package(plan)
+
+
+def _settle_target(plan: Plan, debp: Path):
+    """
+    The --deb URL did not carry a version: compare the real one now, and
+    drop what was planned only in case the package changed.
+    """
+    from .download import deb_control_version
+
+    plan.target_version = deb_control_version(debp)
+    if not (plan.payload_present and plan.target_version and plan.target_version == plan.installed):
+        return
+    plan.drop("package", f"version {plan.installed} already installed")
+    for name in plan.payload_only:
+        plan.drop(name, "package unchanged")
+    if plan.start_reason and not plan.has("restart"):
+        plan.need("start", plan.start_reason)
+
+
+def execute_plan(plan: Plan, args) -> str:
+    """Run only the planned steps; returns extra report text."""
+    from .util import ensure_pcscd_socket
+
+    out = []
+    machine = args.machine
+
+    if plan.has("pcscd"):
+        with events.step("pcscd"):
+            ensure_pcscd_socket()
+
+    debp = plan.deb_path
+    if plan.has("download"):
+        from .download import download_deb
+
+        with events.step("download"):
+            debp = download_deb(args.deb, paths.deb_cache(plan.cache_scope), resume=args.resume)
+        plan.deb_sha256 = checkpoint.file_sha256(debp)
+        checkpoint.done(plan.key("download"), _fp_download(args), path=str(debp), sha256=plan.deb_sha256)
+        if args.resume:
+            _resume_package(plan)
+    if debp is not None and not plan.target_version:
+        _settle_target(plan, debp)
+    service_steps = plan.has("unit") or plan.has("restart") or plan.has("start")
+
+    if plan.mode == "container":
+        from .container_mode import (
+            enable_start_container,
+            ensure_bind_mount_from_container,
+            ensure_rootfs,
+            install_deb_inside_container,
+        )
+
+        if plan.has("rootfs"):
+            fp = _fp_rootfs(args)
+            checkpoint.started(plan.key("rootfs"), fp)
+            with events.step("rootfs"):
+                ensure_rootfs(machine, args.suite, args.mirror, recreate=plan.recreate_rootfs,
+                              template=plan.rootfs_template)
+            checkpoint.done(plan.key("rootfs"), fp)
+        if plan.has("package"):
+            fp = _fp_package(plan)
+            checkpoint.started(plan.key("package"), fp)
+            with events.step("package"):
+                install_deb_inside_container(machine, debp)
+            checkpoint.done(plan.key("package"), fp)
+        if plan.has("bind-mount"):
+            with events.step("bind-mount"), locks.host(plan.action):
+                ensure_bind_mount_from_container(machine)
+        if service_steps:
+            with events.step("service"):
+                out.append(enable_start_container(machine, payload_changed=plan.has("package")))
+    else:
+        from .native_mode import deb_extract_to_opt, enable_start_native, patchelf_set_rpath
+
+        # OPT_DIR is also what a container install binds to
+        if plan.has("package"):
+            fp = _fp_package(plan)
+            checkpoint.started(plan.key("package"), fp)
+            with events.step("package"), locks.host(plan.action):
+                deb_extract_to_opt(debp)
+            checkpoint.done(plan.key("package"), fp)
+        if plan.has("rpath"):
+            with events.step("rpath"), locks.host(plan.action):
+                out.append(patchelf_set_rpath())
+        if service_steps:
+            with events.step("service"):
+                out.append(enable_start_native(payload_changed=plan.has("package") or plan.has("rpath")))
+
+    # Nothing left to resume; a fleet run clears once every machine is done
+    if not plan.fleet:
+        checkpoint.clear(plan.scope)
+        paths.deb_cache(plan.scope).unlink(missing_ok=True)
+
+    if not service_steps:
+        progress(100, "Completed" if plan.steps else "Already up to date")
+    out.append("".join(f"Skipped {s.name}: {s.reason}\n" for s in plan.skipped))
+    return "".join(out)
@@ -0,0 +1,249 @@
+"""
+Direct-exec command engine.
+
+Commands are executed from an argv list without an intermediate shell, so
+no login profile is sourced and no quoting is involved. Every call is
+recorded (argv, exit code, duration, output size) for diagnostics and
+traced as an "exec" span.
+
+Each command runs in its own process group with stdin closed, so a timeout,
+an exhausted step budget (see watchdog.py) or a cancel (see cancel.py) stops
+everything it spawned, not just the direct child.
+"""
+import os
+import pwd
+import select
+import selectors
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from . import cancel, events, trace, watchdog
+
+
+@dataclass
+class CmdRecord:
+    argv: list[str]
+    rc: int
+    duration: float
+    out_bytes: int
+    timed_out: bool = False
+
+
+_records: list[CmdRecord] = []
+
+
+def records() -> list[CmdRecord]:
+    """Return a copy of all commands executed so far in this process."""
+    return list(_records)
+
+
+def _size(s: Optional[str]) -> int:
+    return len(s.encode("utf-8", errors="replace")) if s else 0
+
+
+def run(
+    cmd: list,
+    check: bool = True,
+    timeout: Optional[float] = None,
+    input: Optional[str] = None,
+    env: Optional[dict] = None,
+    cwd: Optional[str] = None,
+    stall: bool = False,
+    user: Optional[str | int] = None,
+    group: Optional[int] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Execute argv directly (no shell) and capture its output.
+
+    A missing executable yields rc=127 and a timeout yields rc=124, mirroring
+    the shell conventions callers used to rely on. With check=True any
+    non-zero exit raises CalledProcessError, and a timeout raises
+    watchdog.CommandTimeout. Running past the enclosing step's budget always
+    raises. With stall=True the command is also stopped after printing
+    nothing for the stall timeout (see watchdog.py). With user (a name, or a
+    uid plus group) the command runs with that account's credentials when we
+    are root; a name also brings its primary and supplementary groups.
+    """
+    argv = [str(a) for a in cmd]
+    with trace.span(os.path.basename(argv[0]), cat="exec", cmd=" ".join(argv)[:300]):
+        p, expired = _run(argv, timeout, input, env, cwd, stall, _credentials(user, group))
+        trace.annotate(rc=p.returncode, bytes=_size(p.stdout) + _size(p.stderr) + _size(input))
+
+    if expired is not None and (check or expired.kind == "budget"):
+        raise expired
+    if check and p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, argv, p.stdout, p.stderr)
+    return p
+
+
+def _stop_group(proc: subprocess.Popen):
+    """SIGTERM the command's process group, SIGKILL it after the grace period."""
+    for sig, wait in ((signal.SIGTERM, cancel.GRACE_S), (signal.SIGKILL, None)):
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        try:
+            proc.wait(timeout=wait)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def _feed(proc: subprocess.Popen, data: bytes):
+    try:
+        proc.stdin.write(data)
+        proc.stdin.close()
+    except (BrokenPipeError, OSError, ValueError):
+        pass
+
+
+def _watch(proc: subprocess.Popen, input: Optional[str], limits: list, stall_s: Optional[float]):
+    """
+    Collect the command's output until it exits or a limit hits. limits are
+    (kind, deadline) pairs; stall_s bounds the time between two outputs.
+    Returns (stdout, stderr, combined chunks, kind of the limit hit or None).
+    """
+    if input is not None:
+        threading.Thread(target=_feed, args=(proc, input.encode()), daemon=True).start()
+    fds = {proc.stdout.fileno(): [], proc.stderr.fileno(): []}
+    chunks: list[bytes] = []
+    hit = None
+    last = time.monotonic()
+    with selectors.DefaultSelector() as sel:
+        for fd in fds:
+            sel.register(fd, selectors.EVENT_READ)
+        while sel.get_map():
+            now = time.monotonic()
+            waits = [(deadline - now, kind) for kind, deadline in limits]
+            if stall_s:
+                waits.append((last + stall_s - now, "stall"))
+            wait, kind = min(waits, default=(None, None))
+            if wait is not None and wait <= 0:
+                hit = kind
+                break
+            for key, _ in sel.select(wait):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    sel.unregister(key.fd)
+                    continue
+                fds[key.fd].append(data)
+                chunks.append(data)
+                last = time.monotonic()
+
+    if hit is None:
+        # Output closed; the process may still be running
+        remaining = [(deadline - time.monotonic(), kind) for kind, deadline in limits]
+        wait, kind = min(remaining, default=(None, None))
+        try:
+            proc.wait(timeout=None if wait is None else max(0.0, wait))
+        except subprocess.TimeoutExpired:
+            hit = kind
+    if hit is not None:
+        _stop_group(proc)
+        # Whatever the stopped tree printed last
+        for fd, buf in fds.items():
+            while select.select([fd], [], [], 0.5)[0]:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                buf.append(data)
+                chunks.append(data)
+    out, err = (b"".join(buf).decode("utf-8", errors="replace") for buf in fds.values())
+    return out, err, chunks, hit
+
+
+def _tail(chunks: list[bytes]) -> list[str]:
+    text = b"".join(chunks[-64:]).decode("utf-8", errors="replace")
+    return [line for line in text.splitlines() if line.strip()][-watchdog.TAIL_LINES:]
+
+
+def _expired(argv: list[str], kind: str, limit: float, elapsed: float, tail: list[str]) -> "watchdog.CommandTimeout":
+    step = watchdog.current_step()
+    what = {
+        "budget": f"step {step} ran past its {limit:g}s budget",
+        "stall": f"no output for {limit:g}s",
+        "timeout": f"timed out after {limit:g}s",
+    }[kind]
+    events.emit("timeout", kind=kind, step=step, cmd=argv, limit_s=limit,
+                elapsed_ms=round(elapsed * 1000, 1), tail=tail)
+    message = f"ERROR: {os.path.basename(argv[0])}: {what}"
+    if tail:
+        message += "\nLast output:\n" + "\n".join(f"  {line}" for line in tail)
+    return watchdog.CommandTimeout(message, kind, step, tail)
+
+
+def _credentials(user, group) -> dict:
+    """Popen arguments that drop to user; nothing unless we are root."""
+    if user is None or os.geteuid() != 0:
+        return {}
+    if isinstance(user, str):
+        pw = pwd.getpwnam(user)
+        return {"user": pw.pw_uid, "group": pw.pw_gid, "extra_groups": os.getgrouplist(user, pw.pw_gid)}
+    # Numeric ids need not exist in this system's passwd (--root images)
+    return {"user": user, "group": user if group is None else group, "extra_groups": []}
+
+
+def _run(argv: list[str], timeout, input, env, cwd, stall: bool, creds: dict):
+    cancel.check()
+    start = time.monotonic()
+    limits, sizes = [], {}
+    if timeout is not None:
+        limits.append(("timeout", start + timeout))
+        sizes["timeout"] = timeout
+    budget = watchdog.current()
+    if budget is not None:
+        limits.append(("budget", budget[1]))
+        sizes["budget"] = budget[2]
+    stall_s = watchdog.stall_timeout() if stall else None
+    sizes["stall"] = stall_s
+
+    expired = None
+    try:
+        proc = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            cwd=cwd,
+            # A session of its own is also a process group of its own
+            # (pgid == pid); process_group= would need Python 3.11
+            start_new_session=True,
+            **creds,
+        )
+    except FileNotFoundError:
+        proc = None
+        p = subprocess.CompletedProcess(argv, 127, "", f"{argv[0]}: command not found\n")
+
+    if proc is not None:
+        cancel.register(proc.pid)
+        try:
+            with proc:
+                try:
+                    out, err, chunks, hit = _watch(proc, input, limits, stall_s)
+                except BaseException:
+                    # Cancelled (or any error) while waiting: take the whole tree down
+                    _stop_group(proc)
+                    raise
+        finally:
+            cancel.unregister(proc.pid)
+        if hit is not None:
+            expired = _expired(argv, hit, sizes[hit], time.monotonic() - start, _tail(chunks))
+            err += f"\n{expired.code.splitlines()[0].removeprefix('ERROR: ')}\n"
+        p = subprocess.CompletedProcess(argv, 124 if hit else proc.returncode, out, err)
+
+    _records.append(CmdRecord(
+        argv=argv,
+        rc=p.returncode,
+        duration=time.monotonic() - start,
+        out_bytes=_size(p.stdout) + _size(p.stderr),
+        timed_out=expired is not None,
+    ))
+    # The command was stopped by a cancel: do not let the caller carry on
+    cancel.check()
+    return p, expired
@@ -0,0 +1,177 @@
+"""
+Index of a user's NSS databases: Firefox and Thunderbird profiles and the
+shared Chromium-family database (~/.pki/nssdb).
+
+Mozilla profiles are read from profiles.ini and installs.ini under every
+known root of a home directory (classic, Flatpak, Snap), so custom-named
+profiles are found and nothing is listed twice: entries are de-duplicated by
+resolved path. A root without profiles.ini falls back to globbing
+*.default*. For Chromium the root is the database itself.
+
+The index is cached in STATE_DIR/nss-databases.json per root, keyed by the
+ini files' mtimes (and the root's own mtime when it has no profiles.ini),
+so repeated calls only stat a handful of files. firefox.py and the status
+probe share it.
+"""
+import configparser
+import json
+import os
+import tempfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+from . import paths
+
+# app -> roots below the home directory (classic, Flatpak, Snap)
+APP_ROOTS = {
+    "firefox": (
+        ".mozilla/firefox",
+        ".var/app/org.mozilla.firefox/.mozilla/firefox",
+        "snap/firefox/common/.mozilla/firefox",
+    ),
+    "thunderbird": (
+        ".thunderbird",
+        ".var/app/org.mozilla.Thunderbird/.thunderbird",
+        "snap/thunderbird/common/.thunderbird",
+    ),
+    # Chrome, Chromium, Edge, Brave, ... all use the user's shared database
+    "chromium": (
+        ".pki/nssdb",
+        "snap/chromium/current/.pki/nssdb",
+    ),
+}
+APPS = tuple(APP_ROOTS)
+
+# Apps whose root is a single NSS database rather than a set of profiles
+_SHARED_DB_APPS = {"chromium"}
+
+_INDEX_VERSION = 1
+
+
+@dataclass
+class Database:
+    path: str
+    name: str
+    root: str
+    app: str
+    default: bool = False
+
+
+def _index_file() -> Path:
+    return paths.STATE_DIR / "nss-databases.json"
+
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _key(root: Path) -> dict:
+    key = {"profiles.ini": _mtime(root / "profiles.ini"), "installs.ini": _mtime(root / "installs.ini")}
+    if key["profiles.ini"] is None:
+        key["dir"] = _mtime(root)
+    return key
+
+
+def _read_ini(path: Path) -> configparser.ConfigParser:
+    ini = configparser.ConfigParser(interpolation=None, strict=False)
+    ini.optionxform = str  # keys are case-sensitive (Path, IsRelative, Default)
+    try:
+        ini.read(path, encoding="utf-8")
+    except (configparser.Error, UnicodeDecodeError):
+        pass
+    return ini
+
+
+def _resolve(root: Path, path: str, relative: bool) -> Path:
+    return root / path if relative else Path(path)
+
+
+def _scan(app: str, root: Path) -> list[Database]:
+    """Databases of one root: itself, or its profiles from the ini files or a glob."""
+    if app in _SHARED_DB_APPS:
+        return [Database(str(root), "nssdb", str(root), app, True)]
+    if not (root / "profiles.ini").exists():
+        return [Database(str(p), p.name, str(root), app) for p in sorted(root.glob("*.default*")) if p.is_dir()]
+
+    ini = _read_ini(root / "profiles.ini")
+    installs = _read_ini(root / "installs.ini")
+    # Profiles some installation starts by default ([Install<hash>] sections)
+    install_defaults = set()
+    for ini_file, prefix in ((ini, "Install"), (installs, "")):
+        for name, section in ini_file.items():
+            if name != "DEFAULT" and name.startswith(prefix) and "Default" in section:
+                install_defaults.add(str(root / section["Default"]))
+
+    found = []
+    for name, section in ini.items():
+        if not name.startswith("Profile") or "Path" not in section:
+            continue
+        path = _resolve(root, section["Path"], section.get("IsRelative", "1") == "1")
+        default = section.get("Default") == "1" or str(path) in install_defaults
+        found.append(Database(str(path), section.get("Name", path.name), str(root), app, default))
+    return found
+
+
+def _load_index() -> dict:
+    try:
+        data = json.loads(_index_file().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != _INDEX_VERSION:
+        return {}
+    return data.get("roots", {})
+
+
+def _save_index(roots: dict):
+    """Best-effort: without a writable STATE_DIR every call just rescans."""
+    target = _index_file()
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".nss-databases.", dir=str(target.parent))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": _INDEX_VERSION, "roots": roots}, f, indent=2)
+        os.replace(tmp, target)
+    except OSError:
+        pass
+
+
+def databases(home: str, apps: Optional[list[str]] = None) -> list[Database]:
+    """Every NSS database of home for apps (default: all), de-duplicated by resolved path."""
+    return databases_by_home([home], apps)[home]
+
+
+def databases_by_home(homes: list[str], apps: Optional[list[str]] = None) -> dict[str, list[Database]]:
+    """databases() for several homes, reading and writing the index once."""
+    index = _load_index()
+    changed = False
+    result = {}
+    for home in homes:
+        found: list[Database] = []
+        for app in apps or APPS:
+            for rel in APP_ROOTS[app]:
+                root = Path(home) / rel
+                key = _key(root)
+                entry = index.get(str(root))
+                if entry is None or entry.get("key") != key:
+                    dbs = _scan(app, root) if root.is_dir() else []
+                    entry = {"key": key, "databases": [asdict(d) for d in dbs]}
+                    index[str(root)] = entry
+                    changed = True
+                found.extend(Database(**d) for d in entry["databases"])
+
+        # Per home: another user's symlinked profile is not this user's to skip
+        unique: dict[str, Database] = {}
+        for d in found:
+            real = os.path.realpath(d.path)
+            if real in unique:
+                unique[real].default = unique[real].default or d.default
+            else:
+                unique[real] = d
+        result[home] = list(unique.values())
+    if changed:
+        _save_index(index)
+    return result
@@ -0,0 +1,184 @@
+"""
+Function-level profiling for --profile.
+
+Only imported when --profile is given, so a normal run pays nothing. By
+default the action runs under cProfile and writes a .pstats file plus a
+.collapsed file (flamegraph.pl / speedscope input). With --profiler
+sampling, py-spy is attached to the process instead when it is installed;
+its raw output is already in collapsed-stack format. cProfile only sees
+the main thread; work on probe threads shows up as time spent in join().
+
+Each run keeps its files under PROFILE_DIR (or the --profile path); only
+the newest KEEP_PROFILES runs are kept. Rotation only ever touches files
+named like ours (arksigner-<stamp>-<pid>-<action>), since --profile may
+point at a shared directory and the CLI runs as root.
+"""
+import os
+import re
+import shutil
+import signal
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from . import events, paths
+from .util import ts
+
+KEEP_PROFILES = 20
+TOP_ENTRIES = 15
+
+_STEM_RE = re.compile(r"^arksigner-\d{8}-\d{6}-\d+-")
+
+
+def _rotate(out_dir: Path):
+    runs: dict[str, float] = {}
+    for p in out_dir.iterdir():
+        if p.suffix in (".pstats", ".collapsed") and _STEM_RE.match(p.name):
+            runs[p.stem] = max(runs.get(p.stem, 0.0), p.stat().st_mtime)
+    for stem in sorted(runs, key=runs.get, reverse=True)[KEEP_PROFILES:]:
+        for suffix in (".pstats", ".collapsed"):
+            (out_dir / f"{stem}{suffix}").unlink(missing_ok=True)
+
+
+def _label(func: tuple) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # built-in
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _write_collapsed(stats, path: Path):
+    """
+    Approximate collapsed stacks from cProfile's caller graph: each
+    function's own time is attributed to the chain of its heaviest callers.
+    """
+    raw = stats.stats  # func -> (cc, nc, tt, ct, callers)
+    lines = []
+    for func, (_cc, _nc, tt, _ct, callers) in raw.items():
+        if tt <= 0:
+            continue
+        chain = [func]
+        seen = {func}
+        cur = callers
+        while cur and len(chain) < 64:
+            parent = max(cur, key=lambda c: cur[c][3])
+            if parent in seen:
+                break
+            chain.append(parent)
+            seen.add(parent)
+            cur = raw.get(parent, (0, 0, 0, 0, {}))[4]
+        stack = ";".join(_label(f).replace(";", ",") for f in reversed(chain))
+        lines.append(f"{stack} {max(1, round(tt * 1e6))}\n")
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def _top_entries(stats) -> list[dict]:
+    rows = []
+    for func, (_cc, nc, tt, ct, _callers) in stats.stats.items():
+        rows.append({"function": _label(func), "calls": nc,
+                     "tottime_ms": round(tt * 1000, 2), "cumtime_ms": round(ct * 1000, 2)})
+    rows.sort(key=lambda r: r["cumtime_ms"], reverse=True)
+    return rows[:TOP_ENTRIES]
+
+
+def _report(entries: list[dict], files: list[Path]):
+    events.emit("profile", entries=entries, files=[str(p) for p in files])
+    lines = [f"[{ts()}] Profile written: {', '.join(str(p) for p in files)}"]
+    if entries and "samples" in entries[0]:
+        lines.append(f"  {'samples':>8} {'own':>8} {'share':>6}  function")
+        for r in entries:
+            lines.append(f"  {r['samples']:>8} {r['own_samples']:>8} {r['share']:>6.1%}  {r['function']}")
+    elif entries:
+        lines.append(f"  {'cumtime':>10} {'tottime':>10} {'calls':>8}  function")
+        for r in entries:
+            lines.append(f"  {r['cumtime_ms']:>8.1f}ms {r['tottime_ms']:>8.1f}ms {r['calls']:>8}  {r['function']}")
+    print("\n".join(lines))
+
+
+@contextmanager
+def _cprofile(stem: Path):
+    import cProfile
+    import pstats
+
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        stats = pstats.Stats(prof)
+        pst = stem.with_suffix(".pstats")
+        col = stem.with_suffix(".collapsed")
+        stats.dump_stats(str(pst))
+        _write_collapsed(stats, col)
+        _report(_top_entries(stats), [pst, col])
+
+
+@contextmanager
+def _sampling(stem: Path, pyspy: str):
+    col = stem.with_suffix(".collapsed")
+    p = subprocess.Popen(
+        [pyspy, "record", "--pid", str(os.getpid()), "--format", "raw",
+         "--rate", "250", "--output", str(col), "--nonblocking"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    time.sleep(0.2)  # let py-spy attach before the action starts
+    try:
+        yield
+    finally:
+        # SIGINT makes py-spy stop sampling and write its output
+        p.send_signal(signal.SIGINT)
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+        _report(_top_collapsed(col), [col])
+
+
+def _top_collapsed(path: Path) -> list[dict]:
+    """Top frames by inclusive sample count from a collapsed-stack file."""
+    counts: dict[str, int] = {}
+    own: dict[str, int] = {}
+    total = 0
+    try:
+        text = path.read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return []
+    for line in text.splitlines():
+        stack, _, n = line.rpartition(" ")
+        if not n.isdigit():
+            continue
+        n = int(n)
+        total += n
+        frames = stack.split(";")
+        for f in set(frames):
+            counts[f] = counts.get(f, 0) + n
+        own[frames[-1]] = own.get(frames[-1], 0) + n
+    rows = [{"function": f, "samples": c, "own_samples": own.get(f, 0),
+             "share": round(c / total, 3) if total else 0.0} for f, c in counts.items()]
+    rows.sort(key=lambda r: r["samples"], reverse=True)
+    return rows[:TOP_ENTRIES]
+
+
+@contextmanager
+def profiled(name: str, path: Optional[str] = None, profiler: str = "cprofile"):
+    """Profile the enclosed block and write/report the results."""
+    out_dir = Path(path) if path else paths.PROFILE_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    stem = out_dir / f"arksigner-{stamp}-{os.getpid()}-{name.replace(',', '+')}"
+
+    pyspy = shutil.which("py-spy") if profiler == "sampling" else None
+    if profiler == "sampling" and pyspy is None:
+        events.warning("py-spy not installed; falling back to cProfile")
+        print(f"[{ts()}] WARNING: py-spy not installed; falling back to cProfile")
+
+    ctx = _sampling(stem, pyspy) if pyspy else _cprofile(stem)
+    try:
+        with ctx:
+            yield
+    finally:
+        _rotate(out_dir)
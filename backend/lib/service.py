@@ -0,0 +1,315 @@
+"""
+Long-lived privileged helper exposed on the system bus.
+
+D-Bus activation starts `arksigner-manager-cli --serve` as root on the first
+call. Every Run() call is authorized through polkit for the calling bus name,
+executed in-process (the backend is already imported and warm), and streams
+its progress back to the caller as signals. The helper exits after
+IDLE_TIMEOUT seconds without calls.
+
+Calls run concurrently; locks.py keeps mutations apart, and each call's
+output is routed to its own caller (see _Router). Cancel() stops the
+caller's own running calls, each of which has its own cancel scope.
+
+--user and --home are never taken from the caller's arguments: they are
+the account of the caller's bus connection, so firefox-add only ever
+touches the caller's own NSS databases (or, with --all-users and the
+manage authorization, everyone's).
+"""
+import contextvars
+import io
+import pwd
+import sys
+import threading
+import time
+import traceback
+
+BUS_NAME = "tr.org.arksigner.Manager1"
+OBJECT_PATH = "/tr/org/arksigner/Manager1"
+INTERFACE = "tr.org.arksigner.Manager1"
+
+POLKIT_ACTION_STATUS = "tr.org.arksigner.Manager.status"
+POLKIT_ACTION_MANAGE = "tr.org.arksigner.Manager.manage"
+
+IDLE_TIMEOUT = 120
+
+# Read-only actions that still need POLKIT_ACTION_MANAGE, see Helper.run
+TOKEN_ACTIONS = {"pkcs11-probe", "sign-bench"}
+
+INTROSPECTION_XML = f"""
+<node>
+  <interface name="{INTERFACE}">
+    <method name="Run">
+      <arg type="as" name="args" direction="in"/>
+      <arg type="i" name="rc" direction="out"/>
+      <arg type="s" name="output" direction="out"/>
+    </method>
+    <method name="Cancel">
+      <arg type="u" name="cancelled" direction="out"/>
+    </method>
+    <signal name="Progress">
+      <arg type="i" name="pct"/>
+      <arg type="s" name="message"/>
+    </signal>
+    <signal name="Output">
+      <arg type="s" name="line"/>
+    </signal>
+  </interface>
+</node>
+"""
+
+
+# The writer of the Run() call the current thread works for
+_output: contextvars.ContextVar = contextvars.ContextVar("arksigner_output", default=None)
+
+
+class _Router(io.TextIOBase):
+    """Process-wide stdout/stderr that sends each call's output to its caller."""
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    def writable(self):
+        return True
+
+    def write(self, s: str) -> int:
+        return (_output.get() or self._fallback).write(s)
+
+    def flush(self):
+        (_output.get() or self._fallback).flush()
+
+
+class _SignalWriter(io.TextIOBase):
+    """File-like stdout replacement that turns each line into a D-Bus signal."""
+
+    def __init__(self, conn, dest: str):
+        self._conn = conn
+        self._dest = dest
+        self._buf = ""
+        self.lines: list[str] = []
+
+    def writable(self):
+        return True
+
+    def write(self, s: str) -> int:
+        self._buf += s
+        while "\n" in self._buf:
+            line, self._buf = self._buf.split("\n", 1)
+            self._emit(line)
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def close_buffer(self):
+        if self._buf:
+            self._emit(self._buf)
+            self._buf = ""
+
+    def _emit(self, line: str):
+        from gi.repository import GLib
+
+        self.lines.append(line)
+        if line.startswith("PROGRESS "):
+            parts = line.split(" ", 2)
+            try:
+                pct = int(parts[1])
+                self._conn.emit_signal(self._dest, OBJECT_PATH, INTERFACE, "Progress",
+                                       GLib.Variant("(is)", (pct, parts[2] if len(parts) > 2 else "")))
+            except (ValueError, IndexError):
+                pass
+        self._conn.emit_signal(self._dest, OBJECT_PATH, INTERFACE, "Output", GLib.Variant("(s)", (line,)))
+
+
+class Helper:
+    def __init__(self, loop):
+        self._loop = loop
+        self._active = 0
+        self._last = time.monotonic()
+        # Cancel scopes of the running calls, by caller
+        self._scopes: dict[str, list] = {}
+        self._scopes_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    def authorized(self, conn, sender: str, action_id: str) -> bool:
+        from gi.repository import Gio, GLib
+
+        subject = ("system-bus-name", {"name": GLib.Variant("s", sender)})
+        # flags=1: AllowUserInteraction (polkit agent may prompt the user)
+        res = conn.call_sync(
+            "org.freedesktop.PolicyKit1",
+            "/org/freedesktop/PolicyKit1/Authority",
+            "org.freedesktop.PolicyKit1.Authority",
+            "CheckAuthorization",
+            GLib.Variant("((sa{sv})sa{ss}us)", (subject, action_id, {}, 1, "")),
+            GLib.VariantType.new("((bba{ss}))"),
+            Gio.DBusCallFlags.NONE,
+            GLib.MAXINT,
+            None,
+        )
+        ((is_authorized, _challenge, _details),) = res.unpack()
+        return bool(is_authorized)
+
+    def caller_account(self, conn, sender: str) -> pwd.struct_passwd:
+        """The account of the process behind the sender's bus connection."""
+        from gi.repository import Gio, GLib
+
+        (uid,) = conn.call_sync(
+            "org.freedesktop.DBus",
+            "/org/freedesktop/DBus",
+            "org.freedesktop.DBus",
+            "GetConnectionUnixUser",
+            GLib.Variant("(s)", (sender,)),
+            GLib.VariantType.new("(u)"),
+            Gio.DBusCallFlags.NONE,
+            5000,
+            None,
+        ).unpack()
+        return pwd.getpwuid(uid)
+
+    def cancel(self, sender: str) -> int:
+        """Cancel every running call of sender; returns how many there were."""
+        from . import cancel
+
+        with self._scopes_lock:
+            scopes = list(self._scopes.get(sender, ()))
+        for scope in scopes:
+            scope.request()
+            cancel.kill_later(scope)
+        return len(scopes)
+
+    def run(self, conn, sender: str, argv: list[str]) -> tuple[int, str]:
+        from . import cancel, locks
+        from .main import READ_ONLY_ACTIONS, batch_steps, build_parser, run_steps
+        from .util import ts
+
+        ap = build_parser()
+        try:
+            args = ap.parse_args(argv)
+            # Process-wide settings cannot differ between concurrent calls, and
+            # caller-chosen files would be loaded, read or written as root
+            if (args.serve or args.batch or args.root or args.control_stdin
+                    or args.step_budget or args.stall_timeout is not None or args.pkcs11_module
+                    or args.pin_file or args.results or args.compare):
+                raise SystemExit(2)
+            steps = batch_steps(ap, args)
+        except SystemExit:
+            return 2, f"ERROR: invalid arguments: {' '.join(argv)}\n"
+
+        try:
+            account = self.caller_account(conn, sender)
+        except Exception as e:
+            return 126, f"ERROR: Cannot identify the caller: {e}\n"
+        for step in steps:
+            step.user, step.home = account.pw_name, account.pw_dir
+
+        # Registering the NSS module writes to user databases as root, even
+        # when it rides along with a read-only action like status. The
+        # PKCS#11 actions change nothing, but load the vendor module as root
+        # and open sessions on the token, so they need manage as well.
+        read_only = all(
+            step.action in READ_ONLY_ACTIONS and step.action not in TOKEN_ACTIONS
+            and not (step.firefox_add or step.all_users)
+            for step in steps
+        )
+        action_id = POLKIT_ACTION_STATUS if read_only else POLKIT_ACTION_MANAGE
+        try:
+            if not self.authorized(conn, sender, action_id):
+                return 126, "ERROR: Not authorized\n"
+        except Exception as e:
+            return 126, f"ERROR: Authorization check failed: {e}\n"
+
+        out = _SignalWriter(conn, sender)
+        rc = 0
+        token = _output.set(out)
+        with cancel.scoped() as scope, locks.call():
+            with self._scopes_lock:
+                self._scopes.setdefault(sender, []).append(scope)
+            try:
+                try:
+                    run_steps(steps)
+                except cancel.Cancelled:
+                    print(f"[{ts()}] Cancelled; teardown took {cancel.teardown_ms():.0f} ms")
+                    rc = cancel.EXIT_CODE
+                except SystemExit as e:
+                    if isinstance(e.code, str):
+                        print(e.code)
+                        rc = 1
+                    else:
+                        rc = int(e.code or 0)
+                except Exception:
+                    print(traceback.format_exc(), end="")
+                    rc = 1
+                out.close_buffer()
+            finally:
+                with self._scopes_lock:
+                    self._scopes[sender].remove(scope)
+                    if not self._scopes[sender]:
+                        del self._scopes[sender]
+                _output.reset(token)
+        return rc, "\n".join(out.lines) + ("\n" if out.lines else "")
+
+    # ------------------------------------------------------------------
+    def on_method_call(self, conn, sender, _path, _iface, method, params, invocation):
+        from gi.repository import GLib
+
+        if method == "Cancel":
+            # Only ever the caller's own calls, so no authorization needed
+            invocation.return_value(GLib.Variant("(u)", (self.cancel(sender),)))
+            return
+        if method != "Run":
+            invocation.return_dbus_error(f"{INTERFACE}.Error.UnknownMethod", method)
+            return
+
+        (argv,) = params.unpack()
+        self._active += 1
+
+        def task():
+            try:
+                rc, output = self.run(conn, sender, list(argv))
+                invocation.return_value(GLib.Variant("(is)", (rc, output)))
+            finally:
+                GLib.idle_add(self._done)
+
+        threading.Thread(target=task, daemon=True).start()
+
+    def _done(self):
+        self._active -= 1
+        self._last = time.monotonic()
+        return False
+
+    def check_idle(self):
+        if self._active == 0 and time.monotonic() - self._last >= IDLE_TIMEOUT:
+            self._loop.quit()
+            return False
+        return True
+
+
+def serve():
+    from gi.repository import Gio, GLib
+
+    sys.stdout = _Router(sys.stdout)
+    sys.stderr = _Router(sys.stderr)
+    loop = GLib.MainLoop()
+    helper = Helper(loop)
+    node = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION_XML)
+
+    def on_bus_acquired(conn, _name):
+        conn.register_object(OBJECT_PATH, node.interfaces[0], helper.on_method_call, None, None)
+
+    def on_name_lost(_conn, _name):
+        loop.quit()
+
+    owner = Gio.bus_own_name(
+        Gio.BusType.SYSTEM,
+        BUS_NAME,
+        Gio.BusNameOwnerFlags.NONE,
+        on_bus_acquired,
+        None,
+        on_name_lost,
+    )
+    GLib.timeout_add_seconds(10, helper.check_idle)
+    try:
+        loop.run()
+    finally:
+        Gio.bus_unown_name(owner)
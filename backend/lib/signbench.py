@@ -0,0 +1,371 @@
+"""
+Signing throughput benchmark (--action sign-bench).
+
+Logs in to a slot of the PKCS#11 module and makes --ops signatures with
+every RSA and EC private key on the token (or the one labelled --key),
+spread over --sessions concurrent sessions with a thread each; ctypes
+releases the GIL during the calls, so the sessions really run in
+parallel. RSA keys sign a SHA-256 DigestInfo with CKM_RSA_PKCS and EC
+keys the bare digest with CKM_ECDSA, as NSS does for browsers. Each
+operation (C_SignInit + C_Sign) is timed after one untimed warm-up per
+session; the report gives ops/s and p50/p95/p99 per key.
+
+Results record the layout they were taken on (mode, whether OPT_DIR is a
+bind mount, the module's real path), so a native and a container install
+can be compared: --results FILE writes them as JSON, --compare FILE sets
+the run against an earlier one.
+"""
+import ctypes
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from . import paths
+from .pkcs11 import (
+    CK_ATTRIBUTE,
+    CK_C_INITIALIZE_ARGS,
+    CK_INFO,
+    CK_MECHANISM,
+    CK_OBJECT_HANDLE,
+    CK_SESSION_HANDLE,
+    CK_TOKEN_INFO,
+    CK_ULONG,
+    CKA_CLASS,
+    CKA_KEY_TYPE,
+    CKA_LABEL,
+    CKA_SIGN,
+    CKF_OS_LOCKING_OK,
+    CKF_SERIAL_SESSION,
+    CKK_EC,
+    CKK_RSA,
+    CKM_ECDSA,
+    CKM_RSA_PKCS,
+    CKO_PRIVATE_KEY,
+    CKR_OK,
+    CKR_USER_ALREADY_LOGGED_IN,
+    CKU_USER,
+    Module,
+    library_info,
+    rv_name,
+    summarize,
+    token_info,
+)
+
+RESULTS_VERSION = 1
+PERCENTILES = (50, 95, 99)
+MAX_SIGNATURE = 1024  # bytes; RSA-8192
+
+_DIGEST = hashlib.sha256(b"arksigner-manager sign-bench").digest()
+# DER prefix of a DigestInfo for SHA-256 (RFC 8017, 9.2)
+_SHA256_DIGEST_INFO = bytes.fromhex("3031300d060960864801650304020105000420")
+
+# key type -> (name, mechanism, mechanism name, data to sign)
+_KEY_TYPES = {
+    CKK_RSA: ("rsa", CKM_RSA_PKCS, "CKM_RSA_PKCS", _SHA256_DIGEST_INFO + _DIGEST),
+    CKK_EC: ("ecdsa", CKM_ECDSA, "CKM_ECDSA", _DIGEST),
+}
+
+
+def _check(rv: int, call: str):
+    if rv != CKR_OK:
+        raise SystemExit(f"ERROR: {call} failed: {rv_name(rv)}")
+
+
+def read_pin(pin_file: Optional[str]) -> Optional[bytes]:
+    """The user PIN from pin_file ('-': stdin), first line only."""
+    if pin_file is None:
+        return None
+    try:
+        if pin_file == "-":
+            line = sys.stdin.readline()
+        else:
+            with open(pin_file, encoding="utf-8") as f:
+                line = f.readline()
+    except OSError as e:
+        raise SystemExit(f"ERROR: cannot read PIN file {pin_file}: {e}")
+    return line.rstrip("\r\n").encode("utf-8")
+
+
+def layout(mode: str, machine: str) -> dict:
+    """How the module reaches the host in this install."""
+    from .util import is_mounted
+
+    return {
+        "mode": mode,
+        "machine": machine if mode == "container" else None,
+        "opt_dir_bind_mount": is_mounted(paths.OPT_DIR),
+    }
+
+
+class _Session:
+    def __init__(self, module: Module, slot: int):
+        self.module = module
+        self.handle = CK_SESSION_HANDLE()
+        _check(module.fn("C_OpenSession")(slot, CKF_SERIAL_SESSION, None, None, ctypes.byref(self.handle)),
+               "C_OpenSession")
+
+    def close(self):
+        self.module.fn("C_CloseSession")(self.handle)
+
+
+def _attribute(module: Module, session: _Session, key: int, kind: int) -> bytes:
+    """Value of one attribute of key (size query, then fetch)."""
+    get = module.fn("C_GetAttributeValue")
+    attr = CK_ATTRIBUTE(kind, None, 0)
+    if get(session.handle, key, ctypes.byref(attr), 1) != CKR_OK or attr.ulValueLen in (0, CK_ULONG(-1).value):
+        return b""
+    buf = ctypes.create_string_buffer(attr.ulValueLen)
+    attr.pValue = ctypes.cast(buf, ctypes.c_void_p)
+    if get(session.handle, key, ctypes.byref(attr), 1) != CKR_OK:
+        return b""
+    return buf.raw[:attr.ulValueLen]
+
+
+def _find_keys(module: Module, session: _Session, label: Optional[str]) -> list[dict]:
+    """The private signing keys on the token with a type we benchmark."""
+    key_class = CK_ULONG(CKO_PRIVATE_KEY)
+    sign = ctypes.c_ubyte(1)
+    template = (CK_ATTRIBUTE * 2)(
+        CK_ATTRIBUTE(CKA_CLASS, ctypes.cast(ctypes.byref(key_class), ctypes.c_void_p), ctypes.sizeof(key_class)),
+        CK_ATTRIBUTE(CKA_SIGN, ctypes.cast(ctypes.byref(sign), ctypes.c_void_p), ctypes.sizeof(sign)),
+    )
+    _check(module.fn("C_FindObjectsInit")(session.handle, template, 2), "C_FindObjectsInit")
+    handles = []
+    try:
+        batch = (CK_OBJECT_HANDLE * 16)()
+        count = CK_ULONG()
+        while True:
+            _check(module.fn("C_FindObjects")(session.handle, batch, 16, ctypes.byref(count)), "C_FindObjects")
+            if not count.value:
+                break
+            handles.extend(batch[:count.value])
+    finally:
+        module.fn("C_FindObjectsFinal")(session.handle)
+
+    keys = []
+    for handle in handles:
+        raw_type = _attribute(module, session, handle, CKA_KEY_TYPE)
+        key_type = CK_ULONG.from_buffer_copy(raw_type).value if len(raw_type) == ctypes.sizeof(CK_ULONG) else None
+        if key_type not in _KEY_TYPES:
+            continue
+        key_label = _attribute(module, session, handle, CKA_LABEL).decode("utf-8", errors="replace")
+        if label is not None and key_label != label:
+            continue
+        keys.append({"handle": handle, "type": key_type, "label": key_label})
+    return keys
+
+
+def _bench_key(module: Module, slot: int, key: dict, ops: int, sessions: int) -> dict:
+    """ops signatures with key over sessions concurrent sessions."""
+    name, mechanism, mechanism_name, data = _KEY_TYPES[key["type"]]
+    sign_init = module.fn("C_SignInit")
+    sign = module.fn("C_Sign")
+
+    opened = [_Session(module, slot) for _ in range(sessions)]
+    shares = [ops // sessions + (1 if i < ops % sessions else 0) for i in range(sessions)]
+    latencies: list[list[float]] = [[] for _ in range(sessions)]
+    errors: list[Optional[str]] = [None] * sessions
+    start = threading.Barrier(sessions + 1)
+
+    def one(i: int):
+        mech = CK_MECHANISM(mechanism, None, 0)
+        signature = ctypes.create_string_buffer(MAX_SIGNATURE)
+        size = CK_ULONG()
+        handle = opened[i].handle
+
+        def op() -> int:
+            rv = sign_init(handle, ctypes.byref(mech), key["handle"])
+            if rv != CKR_OK:
+                return rv
+            size.value = MAX_SIGNATURE
+            return sign(handle, data, len(data), signature, ctypes.byref(size))
+
+        rv = op()  # warm-up, untimed
+        try:
+            start.wait()
+        except threading.BrokenBarrierError:
+            return
+        if rv != CKR_OK:
+            errors[i] = f"warm-up: {rv_name(rv)}"
+            return
+        for _ in range(shares[i]):
+            t0 = time.perf_counter()
+            rv = op()
+            if rv != CKR_OK:
+                errors[i] = rv_name(rv)
+                return
+            latencies[i].append((time.perf_counter() - t0) * 1000)
+
+    threads = [threading.Thread(target=one, args=(i,), name=f"sign-{i}") for i in range(sessions)]
+    try:
+        for t in threads:
+            t.start()
+        start.wait()
+        t0 = time.perf_counter()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+    finally:
+        start.abort()
+        for s in opened:
+            s.close()
+
+    done = [ms for per_session in latencies for ms in per_session]
+    failed = [e for e in errors if e is not None]
+    return {
+        "label": key["label"],
+        "type": name,
+        "mechanism": mechanism_name,
+        "sessions": sessions,
+        "ops": len(done),
+        "failed_sessions": len(failed),
+        "error": failed[0] if failed else None,
+        "wall_s": round(wall, 3),
+        "ops_per_s": round(len(done) / wall, 1) if wall > 0 else 0.0,
+        "latency_ms": summarize(done, PERCENTILES) if done else None,
+    }
+
+
+def bench(module_path: Path, slot: Optional[int], pin: Optional[bytes], ops: int, sessions: int,
+          key_label: Optional[str] = None) -> dict:
+    """Run the benchmark on slot (default: the first with a token) of module_path."""
+    if not module_path.exists():
+        raise SystemExit(f"ERROR: PKCS#11 module not found: {module_path}")
+    try:
+        module = Module(str(module_path))
+    except OSError as e:
+        raise SystemExit(f"ERROR: cannot load {module_path}: {e}")
+    _check(module.load_functions(), "C_GetFunctionList")
+    # The sessions' threads need the module's own locking
+    init_args = CK_C_INITIALIZE_ARGS(flags=CKF_OS_LOCKING_OK)
+    _check(module.fn("C_Initialize")(ctypes.byref(init_args)), "C_Initialize")
+    try:
+        info = CK_INFO()
+        _check(module.fn("C_GetInfo")(ctypes.byref(info)), "C_GetInfo")
+        rv, slots = module.slots()
+        _check(rv, "C_GetSlotList")
+        if not slots:
+            raise SystemExit(f"ERROR: no token present in any slot of {module_path}")
+        if slot is None:
+            slot = slots[0]
+        elif slot not in slots:
+            raise SystemExit(f"ERROR: no token in slot {slot} (slots with a token: {', '.join(map(str, slots))})")
+        token = CK_TOKEN_INFO()
+        _check(module.fn("C_GetTokenInfo")(slot, ctypes.byref(token)), "C_GetTokenInfo")
+
+        session = _Session(module, slot)
+        try:
+            if pin is not None:
+                rv = module.fn("C_Login")(session.handle, CKU_USER, pin, len(pin))
+                if rv != CKR_USER_ALREADY_LOGGED_IN:
+                    _check(rv, "C_Login")
+            keys = _find_keys(module, session, key_label)
+            if not keys:
+                wanted = f"labelled {key_label!r}" if key_label is not None else "(RSA or EC)"
+                hint = "" if pin is not None else "; private keys usually need a login (--pin-file)"
+                raise SystemExit(f"ERROR: no private signing key {wanted} on slot {slot}{hint}")
+            results = [_bench_key(module, slot, key, ops, sessions) for key in keys]
+            if pin is not None:
+                module.fn("C_Logout")(session.handle)
+        finally:
+            session.close()
+    finally:
+        module.fn("C_Finalize")(None)
+
+    return {
+        "version": RESULTS_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": socket.gethostname(),
+        "module": str(module_path),
+        "module_realpath": os.path.realpath(module_path),
+        "library": library_info(info),
+        "token": token_info(slot, token),
+        "ops": ops,
+        "sessions": sessions,
+        "keys": results,
+    }
+
+
+def _layout_text(result: dict) -> str:
+    layout = result.get("layout") or {}
+    if not layout:
+        return "unknown"
+    text = f"{layout['mode']} mode"
+    if layout.get("machine"):
+        text += f", machine {layout['machine']}"
+    if layout.get("opt_dir_bind_mount"):
+        text += f", {paths.OPT_DIR} bind-mounted"
+    return text
+
+
+def _key_name(key: dict) -> str:
+    return f"{key['type']}:{key['label'] or '-'}"
+
+
+def format_bench(result: dict) -> str:
+    token = result["token"]
+    lib = result["library"]
+    lines = [
+        f"Signing benchmark: slot {token['slot']} ({token['label'] or '-'}), "
+        f"{result['ops']} ops per key, {result['sessions']} session(s)",
+        f"  Module: {result['module_realpath']} ({lib['description']} {lib['library_version']})",
+        f"  Layout: {_layout_text(result)}",
+        "",
+        f"  {'KEY':<24} {'MECHANISM':<13} {'OPS':>6} {'OPS/S':>9} "
+        + " ".join(f"{f'P{pct} ms':>9}" for pct in PERCENTILES),
+    ]
+    for key in result["keys"]:
+        stats = key["latency_ms"] or {}
+        cols = " ".join(f"{stats[f'p{pct}']:>9.3f}" if stats else f"{'-':>9}" for pct in PERCENTILES)
+        line = f"  {_key_name(key):<24} {key['mechanism']:<13} {key['ops']:>6} {key['ops_per_s']:>9.1f} {cols}"
+        if key["error"]:
+            line += f"  {key['failed_sessions']} session(s) failed: {key['error']}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def load_results(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"ERROR: cannot read benchmark results {path}: {e}")
+    if not isinstance(data, dict) or data.get("version") != RESULTS_VERSION:
+        raise SystemExit(f"ERROR: {path} is not a sign-bench results file (version {RESULTS_VERSION})")
+    return data
+
+
+def save_results(result: dict, path: str):
+    try:
+        Path(path).write_text(json.dumps(result, indent=2) + "\n", encoding="utf-8")
+    except OSError as e:
+        raise SystemExit(f"ERROR: cannot write benchmark results {path}: {e}")
+
+
+def format_compare(result: dict, baseline: dict, baseline_path: str) -> str:
+    """The change of every key's ops/s and percentiles against baseline."""
+    lines = [f"Compared with {baseline_path} ({_layout_text(baseline)}, "
+             f"{baseline['sessions']} session(s)):"]
+    earlier = {_key_name(k): k for k in baseline.get("keys", [])}
+    metrics = [("ops/s", 1, lambda k: k["ops_per_s"])] + [
+        (f"p{pct} ms", 3, lambda k, pct=pct: (k["latency_ms"] or {}).get(f"p{pct}")) for pct in PERCENTILES
+    ]
+    for key in result["keys"]:
+        name = _key_name(key)
+        old = earlier.get(name)
+        if old is None:
+            lines.append(f"  {name}: not in the baseline")
+            continue
+        for metric, digits, get in metrics:
+            a, b = get(old), get(key)
+            if a is None or b is None:
+                continue
+            change = f"{(b - a) / a * 100:+.1f}%" if a else "-"
+            lines.append(f"  {name:<24} {metric:<7} {a:>10.{digits}f} -> {b:>10.{digits}f}  {change:>8}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,286 @@
+"""
+Concurrent, structured status collection.
+
+Every probe runs in its own thread with its own timeout; a probe that does
+not answer in time is reported as timed out instead of holding up the rest.
+The result is a plain dict that can be dumped as JSON (--action status
+--json) or rendered as the classic text report.
+"""
+import contextvars
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from . import locks, nssdb, paths, systemd
+from .proc import run
+from .util import (
+    SERVICE_NATIVE,
+    cache_get,
+    cache_put,
+    container_unit,
+    fstab_bind_line,
+    is_mounted,
+    rootfs_dir,
+    ts,
+)
+
+
+def _probe_units(mode: str, machine: str, deadline: float) -> dict:
+    units = ["pcscd.socket", container_unit(machine) if mode == "container" else SERVICE_NATIVE]
+    return {
+        name: {"load": st.load, "active": st.active, "sub": st.sub, "file_state": st.file_state}
+        for name, st in systemd.unit_states(units).items()
+    }
+
+
+def _probe_machine(mode: str, machine: str, deadline: float) -> dict:
+    machines = [
+        {"name": name, "class": cls, "service": service}
+        for name, cls, service in systemd.list_machines()
+    ]
+    rootfs = rootfs_dir(machine)
+    return {
+        "name": machine,
+        "rootfs": str(rootfs),
+        "rootfs_present": (rootfs / "etc/debian_version").exists(),
+        "running": any(m["name"] == machine for m in machines),
+        "machines": machines,
+    }
+
+
+def _probe_bind_mount(mode: str, machine: str, deadline: float) -> dict:
+    src = rootfs_dir(machine) / "usr/bin/arksigner"
+    fstab_line = fstab_bind_line(machine)
+    try:
+        fstab = paths.FSTAB.read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        fstab = ""
+    return {
+        "target": str(paths.OPT_DIR),
+        "source": str(src),
+        "mounted": is_mounted(paths.OPT_DIR),
+        "fstab": any(line.strip() == fstab_line for line in fstab.splitlines()),
+    }
+
+
+def _probe_pkcs11(mode: str, machine: str, deadline: float) -> dict:
+    present = paths.PKCS11_MODULE.exists()
+    missing: list[str] = []
+    if present:
+        p = run(["ldd", str(paths.PKCS11_MODULE)], check=False, timeout=max(0.1, deadline - time.monotonic()))
+        missing = [line.split()[0] for line in (p.stdout or "").splitlines() if "not found" in line]
+    return {"module": str(paths.PKCS11_MODULE), "present": present, "missing_libs": missing}
+
+
+def _dpkg_version(status_file: Path) -> str:
+    """Version of the first arksigner* package in a dpkg status database."""
+    try:
+        text = status_file.read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return ""
+    for stanza in text.split("\n\n"):
+        fields = {}
+        for line in stanza.splitlines():
+            if ":" in line and not line.startswith(" "):
+                key, value = line.split(":", 1)
+                fields[key] = value.strip()
+        if fields.get("Package", "").startswith("arksigner") and "installed" in fields.get("Status", ""):
+            return fields.get("Version", "")
+    return ""
+
+
+def _probe_version(mode: str, machine: str, deadline: float) -> dict:
+    if mode == "container":
+        version = _dpkg_version(rootfs_dir(machine) / "var/lib/dpkg/status")
+    else:
+        try:
+            version = paths.NATIVE_VERSION_FILE.read_text(encoding="utf-8").strip()
+        except OSError:
+            version = ""
+    return {"installed": version or None}
+
+
+def _tree_size(root: Path, deadline: float) -> tuple[int, bool]:
+    """Apparent size of a tree; stops at the deadline and reports it as partial."""
+    total = 0
+    stack = [str(root)]
+    while stack:
+        if time.monotonic() >= deadline:
+            return total, True
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total, False
+
+
+def _probe_disk(mode: str, machine: str, deadline: float) -> dict:
+    root = rootfs_dir(machine) if mode == "container" else paths.OPT_DIR
+    if not root.exists():
+        return {"path": str(root), "present": False}
+    st = os.statvfs(root)
+    # Leave a little headroom so the probe returns before its own timeout
+    size, partial = _tree_size(root, deadline - 0.05)
+    return {
+        "path": str(root),
+        "present": True,
+        "bytes": size,
+        "partial": partial,
+        "fs_free_bytes": st.f_bavail * st.f_frsize,
+        "fs_total_bytes": st.f_blocks * st.f_frsize,
+    }
+
+
+def _probe_lock(mode: str, machine: str, deadline: float) -> dict:
+    # Reads the holder files only; status never waits for a lock
+    name = locks.scope(mode, machine)
+    return {"scope": name, "holder": locks.holder(name), "host": locks.holder(locks.HOST)}
+
+
+def _probe_nss(mode: str, machine: str, deadline: float, home: Optional[str] = None) -> dict:
+    # Cached database index plus one pkcs11.txt read per database; spawns nothing
+    from .profiles import databases
+
+    library = str(paths.PKCS11_MODULE)
+    dbs = []
+    for db in databases(home):
+        state, current = nssdb.registration(Path(db.path), library)
+        dbs.append({"app": db.app, "path": db.path, "name": db.name, "default": db.default,
+                    "state": state, "library": current})
+    return {
+        "home": home,
+        "databases": dbs,
+        "registered": sum(db["state"] == nssdb.REGISTERED for db in dbs),
+    }
+
+
+# name -> (probe, timeout seconds, modes it applies to)
+PROBES: dict[str, tuple[Callable[[str, str, float], dict], float, tuple[str, ...]]] = {
+    "units": (_probe_units, 2.0, ("container", "native")),
+    "machine": (_probe_machine, 2.0, ("container",)),
+    "bind_mount": (_probe_bind_mount, 1.0, ("container",)),
+    "pkcs11": (_probe_pkcs11, 3.0, ("container", "native")),
+    "version": (_probe_version, 1.0, ("container", "native")),
+    "disk": (_probe_disk, 2.0, ("container", "native")),
+    "lock": (_probe_lock, 1.0, ("container", "native")),
+    "nss": (_probe_nss, 1.0, ("container", "native")),
+}
+
+# Probes about the invoking user; they run only when a home is given
+_HOME_PROBES = {"nss"}
+
+# Probes that walk a tree or spawn ldd; left out of the default set (polled
+# by the GUI) unless asked for with deep=True (--json --deep)
+_DEEP_PROBES = {"pkcs11", "disk"}
+
+
+def collect_status(mode: str, machine: str, probes: Optional[list[str]] = None,
+                   home: Optional[str] = None, deep: bool = False) -> dict:
+    """
+    Run the selected probes concurrently and return their results. In a
+    batch run, probes already answered by an earlier step are reused.
+    """
+    if probes is None:
+        probes = [n for n in PROBES if deep or n not in _DEEP_PROBES]
+    names = [n for n in probes
+             if mode in PROBES[n][2] and (home is not None or n not in _HOME_PROBES)]
+    results: dict[str, dict] = {}
+    for name in names:
+        hit = cache_get(("probe", mode, machine, name))
+        if hit is not None:
+            results[name] = hit
+    threads: dict[str, tuple[threading.Thread, float, float]] = {}
+    t0 = time.monotonic()
+
+    def worker(name: str, fn, started: float, deadline: float):
+        try:
+            extra = {"home": home} if name in _HOME_PROBES else {}
+            data = fn(mode, machine, deadline, **extra)
+            res = {"ok": True, "data": data}
+        except Exception as e:
+            res = {"ok": False, "error": str(e)}
+        res["elapsed_ms"] = round((time.monotonic() - started) * 1000, 2)
+        results[name] = res
+
+    for name in names:
+        if name in results:
+            continue
+        fn, timeout, _modes = PROBES[name]
+        started = time.monotonic()
+        # Daemon threads: a hung probe must never keep the process alive. They
+        # run in the caller's context, which carries the probe cache
+        th = threading.Thread(target=contextvars.copy_context().run,
+                              args=(worker, name, fn, started, started + timeout), daemon=True)
+        th.start()
+        threads[name] = (th, started, timeout)
+
+    for name, (th, started, timeout) in threads.items():
+        th.join(max(0.0, started + timeout - time.monotonic()))
+        if name not in results:
+            results[name] = {
+                "ok": False,
+                "error": f"timed out after {timeout}s",
+                "elapsed_ms": round((time.monotonic() - started) * 1000, 2),
+            }
+        elif results[name]["ok"]:
+            cache_put(("probe", mode, machine, name), results[name])
+
+    return {
+        "collected_at": ts(),
+        "mode": mode,
+        "machine": machine,
+        "elapsed_ms": round((time.monotonic() - t0) * 1000, 2),
+        "probes": {name: dict(results[name], timeout_s=PROBES[name][1]) for name in names},
+    }
+
+
+def status(mode: str, machine: str, home: Optional[str] = None) -> str:
+    facts = collect_status(mode, machine, probes=["units", "machine", "lock", "nss"], home=home)["probes"]
+    units = facts["units"].get("data", {})
+
+    def unit_state(unit: str) -> str:
+        return units.get(unit, {}).get("active") or "unknown"
+
+    lines = []
+    lines.append(f"[{ts()}] ArkSigner Manager status")
+    lines.append(f"Mode:    {mode}")
+    lines.append(f"Module:  {paths.PKCS11_MODULE}")
+    lines.append(f"pcscd.socket: {unit_state('pcscd.socket')}")
+    busy = facts["lock"].get("data", {}).get("holder")
+    if busy:
+        lines.append(f"Busy:    {busy.get('action')} in progress (pid {busy.get('pid')}, since {busy.get('since')})")
+
+    if mode == "container":
+        rootfs = rootfs_dir(machine)
+        lines.append(f"Machine: {machine}")
+        lines.append(f"Rootfs:  {rootfs}")
+        unit = container_unit(machine)
+        lines.append(f"{unit}: {unit_state(unit)}")
+        machines = facts["machine"].get("data", {}).get("machines", [])
+        if machines:
+            lines.append("")
+            lines.append(f"{'MACHINE':<24} {'CLASS':<10} SERVICE")
+            for m in machines:
+                lines.append(f"{m['name']:<24} {m['class']:<10} {m['service']}")
+    else:
+        lines.append(f"{SERVICE_NATIVE}: {unit_state(SERVICE_NATIVE)}")
+
+    nss = facts.get("nss", {}).get("data")
+    if nss and nss["databases"]:
+        lines.append("")
+        lines.append(f"NSS:     registered in {nss['registered']} of {len(nss['databases'])} database(s)")
+        for db in nss["databases"]:
+            detail = f" ({db['library']})" if db["state"] == nssdb.STALE else ""
+            lines.append(f"  {db['state']:<10} {db['app']:<11} {db['path']}{detail}")
+
+    return "\n".join(lines).strip() + "\n"
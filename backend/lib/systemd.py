@@ -0,0 +1,379 @@
+"""
+Thin D-Bus client for org.freedesktop.systemd1 and org.freedesktop.machine1.
+
+Unit and machine operations go straight to the managers over the system bus
+(via Gio) instead of forking systemctl/machinectl for every check. When the
+bus or the GObject bindings are unavailable, or ARKSIGNER_SYSTEMD_BACKEND=cli
+is set, the same calls fall back to the command line tools.
+
+Under a --root prefix nothing here touches the running host: unit state is
+read from the files below the prefix, enablement goes through
+`systemctl --root=PREFIX`, and runtime operations (start/stop, reload,
+machine control) are skipped. tools/bench sets ARKSIGNER_SYSTEMD_BACKEND=shim
+to run them through its stand-in tools, which act on the prefix, instead.
+
+The bus address follows DBUS_SYSTEM_BUS_ADDRESS, so the client can be pointed
+at a private dbus-daemon running a mock service.
+"""
+import os
+import signal
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from . import paths
+from .proc import run
+
+SD_NAME = "org.freedesktop.systemd1"
+SD_PATH = "/org/freedesktop/systemd1"
+SD_MANAGER = "org.freedesktop.systemd1.Manager"
+
+MD_NAME = "org.freedesktop.machine1"
+MD_PATH = "/org/freedesktop/machine1"
+MD_MANAGER = "org.freedesktop.machine1.Manager"
+
+CALL_TIMEOUT_MS = 25000
+JOB_TIMEOUT = 90.0
+
+_conn = None
+
+
+@dataclass
+class UnitState:
+    name: str
+    load: str = "not-found"
+    active: str = "inactive"
+    sub: str = "dead"
+    file_state: str = "not-found"
+
+
+def _bus():
+    """Return a cached system bus connection, or None to use the CLI fallback."""
+    global _conn
+    if _conn is None:
+        _conn = False
+        if os.environ.get("ARKSIGNER_SYSTEMD_BACKEND", "") not in ("cli", "shim") and not paths.relocated():
+            try:
+                from gi.repository import Gio
+
+                _conn = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+            except Exception:
+                _conn = False
+    return _conn or None
+
+
+def offline() -> bool:
+    """True when runtime operations are skipped: under --root, unless benchmarking."""
+    return paths.relocated() and os.environ.get("ARKSIGNER_SYSTEMD_BACKEND", "") != "shim"
+
+
+def _call(dest: str, path: str, iface: str, method: str, params=None, reply: Optional[str] = None,
+          timeout_ms: int = CALL_TIMEOUT_MS):
+    from gi.repository import Gio, GLib
+
+    v = _bus().call_sync(
+        dest,
+        path,
+        iface,
+        method,
+        params,
+        GLib.VariantType.new(reply) if reply else None,
+        Gio.DBusCallFlags.NONE,
+        timeout_ms,
+        None,
+    )
+    return v.unpack() if v is not None else None
+
+
+def _call_many(calls: list[tuple]) -> list:
+    """
+    Issue several method calls concurrently and wait for all replies.
+    Each entry is (dest, path, iface, method, params, reply_type).
+    """
+    from gi.repository import Gio, GLib
+
+    ctx = GLib.MainContext.new()
+    ctx.push_thread_default()
+    results: list = [None] * len(calls)
+    pending = [len(calls)]
+
+    def done(conn, res, idx):
+        try:
+            results[idx] = conn.call_finish(res).unpack()
+        except GLib.Error as e:
+            results[idx] = e
+        pending[0] -= 1
+
+    try:
+        bus = _bus()
+        for idx, (dest, path, iface, method, params, reply) in enumerate(calls):
+            bus.call(dest, path, iface, method, params, GLib.VariantType.new(reply),
+                     Gio.DBusCallFlags.NONE, CALL_TIMEOUT_MS, None, done, idx)
+        while pending[0]:
+            ctx.iteration(True)
+    finally:
+        ctx.pop_thread_default()
+    return results
+
+
+def _fail(what: str, err) -> SystemExit:
+    msg = getattr(err, "message", None) or str(err)
+    return SystemExit(f"ERROR: {what} failed: {msg}")
+
+
+# --------------------------------------------------------------------------
+# Units
+# --------------------------------------------------------------------------
+
+UNIT_DIRS = ("/etc/systemd/system", "/usr/lib/systemd/system", "/lib/systemd/system")
+
+
+def _offline_states(states: dict[str, UnitState]) -> dict[str, UnitState]:
+    """Unit state of an image below the --root prefix; nothing there is running."""
+    wants = [*paths.SYSTEMD_UNIT_DIR.glob("*.wants"), *paths.SYSTEMD_UNIT_DIR.glob("*.requires")]
+    for unit, st in states.items():
+        if any((paths.ROOT / d.lstrip("/") / unit).exists() for d in UNIT_DIRS):
+            st.load = "loaded"
+            st.file_state = "disabled"
+        if any(os.path.lexists(d / unit) for d in wants):
+            st.file_state = "enabled"
+    return states
+
+
+def unit_states(units: list[str]) -> dict[str, UnitState]:
+    """Load, active, sub and unit-file state of several units in one round trip."""
+    states = {u: UnitState(name=u) for u in units}
+    if not units:
+        return states
+    if offline():
+        return _offline_states(states)
+
+    if _bus() is None:
+        p = run(["systemctl", "show", "-p", "Id,LoadState,ActiveState,SubState,UnitFileState", *units],
+                check=False)
+        for unit, block in zip(units, (p.stdout or "").split("\n\n")):
+            props = dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+            st = states[unit]
+            st.load = props.get("LoadState") or st.load
+            st.active = props.get("ActiveState") or st.active
+            st.sub = props.get("SubState") or st.sub
+            st.file_state = props.get("UnitFileState") or st.file_state
+        return states
+
+    from gi.repository import GLib
+
+    listed, files = _call_many([
+        (SD_NAME, SD_PATH, SD_MANAGER, "ListUnitsByNames",
+         GLib.Variant("(as)", (units,)), "(a(ssssssouso))"),
+        (SD_NAME, SD_PATH, SD_MANAGER, "ListUnitFilesByPatterns",
+         GLib.Variant("(asas)", ([], units)), "(a(ss))"),
+    ])
+    if not isinstance(listed, Exception):
+        for name, _desc, load, active, sub, *_rest in listed[0]:
+            if name in states:
+                states[name].load = load
+                states[name].active = active
+                states[name].sub = sub
+    if not isinstance(files, Exception):
+        for path, state in files[0]:
+            name = os.path.basename(path)
+            if name in states:
+                states[name].file_state = state
+    return states
+
+
+def is_active(unit: str) -> str:
+    return unit_states([unit])[unit].active
+
+
+def _wait_job(method: str, unit: str, timeout: float) -> str:
+    """Queue a start/stop/restart job and wait for its JobRemoved result."""
+    from gi.repository import GLib
+
+    ctx = GLib.MainContext.new()
+    ctx.push_thread_default()
+    bus = _bus()
+    finished: dict[str, str] = {}
+
+    def on_job_removed(_conn, _sender, _path, _iface, _signal, params):
+        _id, job, _unit, result = params.unpack()
+        finished[job] = result
+
+    sub_id = bus.signal_subscribe(SD_NAME, SD_MANAGER, "JobRemoved", SD_PATH, None, 0, on_job_removed)
+    try:
+        _call(SD_NAME, SD_PATH, SD_MANAGER, "Subscribe")
+        (job,) = _call(SD_NAME, SD_PATH, SD_MANAGER, method,
+                       GLib.Variant("(ss)", (unit, "replace")), "(o)")
+        deadline = time.monotonic() + timeout
+        while job not in finished:
+            if time.monotonic() >= deadline:
+                return "timeout"
+            if not ctx.pending():
+                time.sleep(0.01)
+            ctx.iteration(False)
+        return finished[job]
+    finally:
+        bus.signal_unsubscribe(sub_id)
+        try:
+            _call(SD_NAME, SD_PATH, SD_MANAGER, "Unsubscribe")
+        except Exception:
+            pass
+        ctx.pop_thread_default()
+
+
+def _job(verb: str, method: str, unit: str, check: bool, timeout: float) -> str:
+    if offline():
+        return "skipped"
+    if _bus() is None:
+        p = run(["systemctl", verb, unit], check=False)
+        if check and p.returncode != 0:
+            raise _fail(f"systemctl {verb} {unit}", (p.stderr or "").strip())
+        return "done" if p.returncode == 0 else "failed"
+
+    try:
+        result = _wait_job(method, unit, timeout)
+    except Exception as e:
+        if check:
+            raise _fail(f"{method} {unit}", e)
+        return "failed"
+    if check and result != "done":
+        raise _fail(f"{method} {unit}", f"job result: {result}")
+    return result
+
+
+def start_unit(unit: str, check: bool = False, timeout: float = JOB_TIMEOUT) -> str:
+    return _job("start", "StartUnit", unit, check, timeout)
+
+
+def stop_unit(unit: str, check: bool = False, timeout: float = JOB_TIMEOUT) -> str:
+    return _job("stop", "StopUnit", unit, check, timeout)
+
+
+def restart_unit(unit: str, check: bool = False, timeout: float = JOB_TIMEOUT) -> str:
+    return _job("restart", "RestartUnit", unit, check, timeout)
+
+
+def daemon_reload(check: bool = False):
+    if offline():
+        return
+    if _bus() is None:
+        run(["systemctl", "daemon-reload"], check=check)
+        return
+    try:
+        _call(SD_NAME, SD_PATH, SD_MANAGER, "Reload", timeout_ms=int(JOB_TIMEOUT * 1000))
+    except Exception as e:
+        if check:
+            raise _fail("daemon-reload", e)
+
+
+def reset_failed(unit: str):
+    if offline():
+        return
+    if _bus() is None:
+        run(["systemctl", "reset-failed", unit], check=False)
+        return
+    from gi.repository import GLib
+
+    try:
+        _call(SD_NAME, SD_PATH, SD_MANAGER, "ResetFailedUnit", GLib.Variant("(s)", (unit,)))
+    except Exception:
+        pass
+
+
+def enable_units(units: list[str], now: bool = False, check: bool = False):
+    """Equivalent of `systemctl enable [--now] UNIT...`; --now is moot under --root."""
+    if offline():
+        run(["systemctl", "enable", f"--root={paths.ROOT}", *units], check=check)
+        return
+    if _bus() is None:
+        cmd = ["systemctl", "enable"] + (["--now"] if now else []) + list(units)
+        run(cmd, check=check)
+        return
+
+    from gi.repository import GLib
+
+    try:
+        _call(SD_NAME, SD_PATH, SD_MANAGER, "EnableUnitFiles",
+              GLib.Variant("(asbb)", (list(units), False, True)), "(ba(sss))")
+        daemon_reload(check=check)
+    except SystemExit:
+        raise
+    except Exception as e:
+        if check:
+            raise _fail(f"enable {' '.join(units)}", e)
+        return
+    if now:
+        for unit in units:
+            start_unit(unit, check=check)
+
+
+def disable_units(units: list[str], check: bool = False):
+    if offline():
+        run(["systemctl", "disable", f"--root={paths.ROOT}", *units], check=check)
+        return
+    if _bus() is None:
+        run(["systemctl", "disable", *units], check=check)
+        return
+
+    from gi.repository import GLib
+
+    try:
+        _call(SD_NAME, SD_PATH, SD_MANAGER, "DisableUnitFiles",
+              GLib.Variant("(asb)", (list(units), False)), "(a(sss))")
+        daemon_reload()
+    except Exception as e:
+        if check:
+            raise _fail(f"disable {' '.join(units)}", e)
+
+
+# --------------------------------------------------------------------------
+# Machines
+# --------------------------------------------------------------------------
+
+def list_machines() -> list[tuple[str, str, str]]:
+    """Registered machines as (name, class, service) tuples."""
+    if offline():
+        return []
+    if _bus() is None:
+        p = run(["machinectl", "list", "--no-legend", "--no-pager"], check=False)
+        out = []
+        for line in (p.stdout or "").splitlines():
+            cols = line.split()
+            if len(cols) >= 3:
+                out.append((cols[0], cols[1], cols[2]))
+        return out
+    try:
+        (machines,) = _call(MD_NAME, MD_PATH, MD_MANAGER, "ListMachines", reply="(a(ssso))")
+    except Exception:
+        return []
+    return [(name, cls, service) for name, cls, service, _path in machines]
+
+
+def terminate_machine(machine: str):
+    if offline():
+        return
+    if _bus() is None:
+        run(["machinectl", "terminate", machine], check=False)
+        return
+    from gi.repository import GLib
+
+    try:
+        _call(MD_NAME, MD_PATH, MD_MANAGER, "TerminateMachine", GLib.Variant("(s)", (machine,)))
+    except Exception:
+        pass
+
+
+def poweroff_machine(machine: str):
+    """Ask the container's init to shut down (SIGRTMIN+4, as machinectl poweroff)."""
+    if offline():
+        return
+    if _bus() is None:
+        run(["machinectl", "poweroff", machine], check=False)
+        return
+    from gi.repository import GLib
+
+    try:
+        _call(MD_NAME, MD_PATH, MD_MANAGER, "KillMachine",
+              GLib.Variant("(ssi)", (machine, "leader", int(signal.SIGRTMIN) + 4)))
+    except Exception:
+        pass
@@ -0,0 +1,141 @@
+"""
+Nested timing spans for backend actions.
+
+Every action, step (events.step), instrumented function (@traced) and
+subprocess (proc.run) is recorded as a span with wall time, CPU time, exit
+code and bytes moved. Finished spans are sent to the GUI as "span" events
+and `--trace out.json` writes them in Chrome trace-event format, which
+opens in Perfetto (ui.perfetto.dev) and chrome://tracing. Spans are only
+kept in memory once record() was called (for --trace), so the long-lived
+D-Bus helper does not accumulate them.
+
+CPU time is the calling thread's CPU plus that of child processes reaped
+during the span, so it is approximate when threads run commands in parallel.
+"""
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+_spans: list[dict] = []
+_recording = False
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def record():
+    """Keep finished spans for write_chrome_trace()."""
+    global _recording
+    _recording = True
+
+
+def _children_cpu() -> float:
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+
+def _stack() -> list:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def annotate(**fields):
+    """Attach fields (rc, bytes, ...) to the innermost open span of this thread."""
+    stack = _stack()
+    if stack:
+        stack[-1]["args"].update(fields)
+
+
+@contextmanager
+def span(name: str, cat: str = "step", **fields):
+    stack = _stack()
+    sp = {
+        "name": name,
+        "cat": cat,
+        "ts": time.time(),
+        "tid": threading.get_native_id(),
+        "depth": len(stack),
+        "args": dict(fields),
+    }
+    t0 = time.monotonic()
+    cpu0 = time.thread_time() + _children_cpu()
+    stack.append(sp)
+    ok = False
+    try:
+        yield sp
+        ok = True
+    finally:
+        stack.pop()
+        sp["dur"] = time.monotonic() - t0
+        sp["cpu"] = time.thread_time() + _children_cpu() - cpu0
+        if not ok:
+            sp["args"].setdefault("error", True)
+        _finish(sp)
+
+
+def traced(fn=None, *, name: Optional[str] = None):
+    """Decorator: run the function inside a span named after it."""
+    if fn is None:
+        return functools.partial(traced, name=name)
+
+    label = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(label, cat="func"):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def _finish(sp: dict):
+    if _recording:
+        with _lock:
+            _spans.append(sp)
+
+    from . import events
+
+    if events.enabled():
+        events.emit(
+            "span",
+            name=sp["name"],
+            cat=sp["cat"],
+            depth=sp["depth"],
+            duration_ms=round(sp["dur"] * 1000, 2),
+            cpu_ms=round(sp["cpu"] * 1000, 2),
+            rc=sp["args"].get("rc"),
+            bytes=sp["args"].get("bytes"),
+        )
+
+
+def spans() -> list[dict]:
+    with _lock:
+        return list(_spans)
+
+
+def write_chrome_trace(path: str):
+    """Write all finished spans as complete ("X") trace events."""
+    pid = os.getpid()
+    trace_events = [
+        {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "arksigner-manager-cli"}},
+    ]
+    for sp in spans():
+        args = dict(sp["args"])
+        args["cpu_ms"] = round(sp["cpu"] * 1000, 3)
+        trace_events.append({
+            "name": sp["name"],
+            "cat": sp["cat"],
+            "ph": "X",
+            "ts": round(sp["ts"] * 1e6),
+            "dur": round(sp["dur"] * 1e6),
+            "pid": pid,
+            "tid": sp["tid"],
+            "args": args,
+        })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f, default=str)
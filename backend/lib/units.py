@@ -0,0 +1,122 @@
+"""
+systemd unit file generation.
+
+Units are rendered from templates and compared by content hash with what is
+on disk. A unit is only rewritten (atomically) when its content changed, and
+daemon-reload / restart only happen when the unit or the payload changed.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+from . import paths, systemd
+from .util import rootfs_dir
+
+CONTAINER_TEMPLATE = """[Unit]
+Description=ArkSigner Debian Container (nspawn)
+After=pcscd.socket
+Requires=pcscd.socket
+
+[Service]
+Type=simple
+ExecStart=/usr/bin/systemd-nspawn \\
+  -D {rootfs} \\
+  --machine={machine} \\
+  --bind=/run/pcscd:/run/pcscd \\
+  --bind-ro=/dev/bus/usb:/dev/bus/usb \\
+  --console=passive \\
+  --keep-unit \\
+  /bin/bash -lc "/etc/init.d/arksignerd start; exec sleep infinity"
+KillMode=mixed
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+NATIVE_TEMPLATE = """[Unit]
+Description=ArkSigner Service (native)
+After=pcscd.socket
+Requires=pcscd.socket
+
+[Service]
+Type=simple
+User=root
+Environment=LD_LIBRARY_PATH={opt_dir}/libs:/usr/local/lib64
+ExecStart={opt_dir}/arksigner-universal
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+
+def render_container_unit(machine: str) -> str:
+    # Unit files are read by the target system: no --root prefix in them
+    return CONTAINER_TEMPLATE.format(rootfs=paths.target(rootfs_dir(machine)), machine=machine)
+
+
+def render_native_unit() -> str:
+    return NATIVE_TEMPLATE.format(opt_dir=paths.target(paths.OPT_DIR))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def unit_up_to_date(path: Path, content: str) -> bool:
+    try:
+        return content_hash(path.read_bytes()) == content_hash(content.encode("utf-8"))
+    except OSError:
+        return False
+
+
+def write_unit(path: Path, content: str) -> bool:
+    """Atomically replace path with content. Returns False if it was already identical."""
+    if unit_up_to_date(path, content):
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return True
+
+
+def apply_service(unit: str, path: Path, content: str, payload_changed: bool,
+                  restart: Callable[[], None]) -> str:
+    """
+    Bring a service in line with its rendered unit. Reload only when the unit
+    file changed, restart only when the unit or the payload changed, and
+    otherwise just make sure it is enabled and running. Returns a report of
+    what was skipped.
+    """
+    report = []
+    changed = write_unit(path, content)
+    if changed:
+        systemd.daemon_reload(check=True)
+    else:
+        report.append(f"Skipped daemon-reload: {path.name} unchanged")
+
+    if changed or payload_changed:
+        restart()
+        return "".join(f"{line}\n" for line in report)
+
+    st = systemd.unit_states([unit])[unit]
+    if st.active == "active" and st.file_state == "enabled":
+        report.append(f"Skipped restart: {unit} active, unit and payload unchanged")
+    else:
+        systemd.enable_units([unit], now=True, check=True)
+        report.append(f"Skipped restart: {unit} was {st.active}/{st.file_state}, enabled and started instead")
+    return "".join(f"{line}\n" for line in report)
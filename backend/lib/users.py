@@ -0,0 +1,74 @@
+"""
+Login accounts for host-wide actions (--all-users).
+
+Real users are accounts with a UID in login.defs' UID_MIN..UID_MAX range, a
+login shell and an existing home directory. On the live root they come from
+the passwd database (so LDAP/SSSD users are included); below --root from
+the prefix's /etc/passwd.
+"""
+import os
+import pwd
+from dataclasses import dataclass
+
+from . import paths
+
+UID_MIN = 1000
+UID_MAX = 60000
+_NOLOGIN_SHELLS = {"/usr/sbin/nologin", "/sbin/nologin", "/bin/false", "/usr/bin/false", ""}
+
+
+@dataclass
+class Account:
+    name: str
+    uid: int
+    gid: int
+    home: str
+
+
+def _login_defs() -> dict[str, str]:
+    values = {}
+    try:
+        text = paths.LOGIN_DEFS.read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return values
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and not fields[0].startswith("#"):
+            values[fields[0]] = fields[1]
+    return values
+
+
+def _uid_range() -> tuple[int, int]:
+    defs = _login_defs()
+    try:
+        return int(defs.get("UID_MIN", UID_MIN)), int(defs.get("UID_MAX", UID_MAX))
+    except ValueError:
+        return UID_MIN, UID_MAX
+
+
+def _passwd_entries() -> list[tuple[str, int, int, str, str]]:
+    if not paths.relocated():
+        return [(p.pw_name, p.pw_uid, p.pw_gid, p.pw_dir, p.pw_shell) for p in pwd.getpwall()]
+    entries = []
+    try:
+        text = paths.PASSWD.read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return entries
+    for line in text.splitlines():
+        fields = line.split(":")
+        if len(fields) == 7 and fields[2].isdigit() and fields[3].isdigit():
+            home = str(paths.ROOT / fields[5].lstrip("/"))
+            entries.append((fields[0], int(fields[2]), int(fields[3]), home, fields[6]))
+    return entries
+
+
+def login_users() -> list[Account]:
+    """Real users with a home directory, by name; each account once."""
+    lo, hi = _uid_range()
+    seen: dict[str, Account] = {}
+    for name, uid, gid, home, shell in _passwd_entries():
+        if not lo <= uid <= hi or shell in _NOLOGIN_SHELLS or name in seen:
+            continue
+        if os.path.isdir(home):
+            seen[name] = Account(name, uid, gid, home)
+    return sorted(seen.values(), key=lambda a: a.name)
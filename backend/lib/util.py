@@ -1,43 +1,102 @@
+import contextvars
 import os
-import subprocess
+import re
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from typing import Callable
+
+from . import events, paths, systemd
+from .proc import run
 
 DEFAULT_DEB_URL = "https://downloads.arksigner.com/files/arksigner-pub-2.3.12.deb"
 DEFAULT_SUITE = "bullseye"
 DEFAULT_MACHINE = "debian-arksigner"
 DEFAULT_MIRROR = "http://deb.debian.org/debian"
 
-OPT_DIR = Path("/opt/arksigner")
-PKCS11_MODULE = OPT_DIR / "drivers/akis/x64/libakisp11.so"
-
 SERVICE_CONTAINER = "arksigner-nspawn.service"
 SERVICE_NATIVE = "arksigner-native.service"
 
-SERVICE_CONTAINER_PATH = Path("/etc/systemd/system") / SERVICE_CONTAINER
-SERVICE_NATIVE_PATH = Path("/etc/systemd/system") / SERVICE_NATIVE
+# True while fleet.run_fleet drives several machines, see container_unit()
+in_fleet: contextvars.ContextVar = contextvars.ContextVar("arksigner_in_fleet", default=False)
 
 
-def ts() -> str:
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+class _ProbeCache:
+    def __init__(self):
+        self.values: dict = {}
+        self.paused = 0
+
+
+# Cache for read-only probes, only active in batch runs (--actions) so that
+# consecutive steps share one status probe and one mount scan. It belongs to
+# one run_steps() call: a context variable, so concurrent and later calls in
+# the D-Bus helper never see each other's results or pauses.
+_cache: contextvars.ContextVar = contextvars.ContextVar("arksigner_probe_cache", default=None)
+
+
+@contextmanager
+def probe_cache():
+    """Cache probe results for the duration of the block."""
+    token = _cache.set(_ProbeCache())
+    try:
+        yield
+    finally:
+        _cache.reset(token)
+
+
+def cache_get(key):
+    cache = _cache.get()
+    if cache is None or cache.paused:
+        return None
+    return cache.values.get(key)
+
+
+def cache_put(key, value):
+    cache = _cache.get()
+    if cache is not None and not cache.paused:
+        cache.values[key] = value
+
 
+def cached(key, fn: Callable):
+    value = cache_get(key)
+    if value is None:
+        value = fn()
+        cache_put(key, value)
+    return value
 
-def run(cmd: list[str], check=True) -> subprocess.CompletedProcess:
-    return subprocess.run(cmd, check=check, text=True, capture_output=True)
+
+@contextmanager
+def mutating():
+    """Bypass and drop cached probe results while a block changes the system."""
+    cache = _cache.get()
+    if cache is None:
+        yield
+        return
+    cache.values.clear()
+    cache.paused += 1
+    try:
+        yield
+    finally:
+        cache.paused -= 1
+        cache.values.clear()
 
 
-def sh(cmd: str, check=True) -> subprocess.CompletedProcess:
-    return subprocess.run(["/bin/bash", "-lc", cmd], check=check, text=True, capture_output=True)
+def ts() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
 def require_root():
-    if os.geteuid() != 0:
+    # A scratch root does not touch the live system
+    if os.geteuid() != 0 and not paths.relocated():
         raise SystemExit("ERROR: Must run as root (use pkexec).")
 
 
 def ensure_pcscd_socket():
     # Best-effort; do not hard-fail if unit missing
-    run(["systemctl", "enable", "--now", "pcscd.socket"], check=False)
+    st = systemd.unit_states(["pcscd.socket"])["pcscd.socket"]
+    if st.active == "active" and st.file_state == "enabled":
+        return
+    systemd.enable_units(["pcscd.socket"], now=True)
 
 
 def progress(pct: int, msg: str):
@@ -47,37 +106,73 @@ def progress(pct: int, msg: str):
     except Exception:
         pct = 0
     pct = max(0, min(100, pct))
-    print(f"PROGRESS {pct} {msg}", flush=True)
+    if events.enabled():
+        events.emit("progress", pct=pct, message=msg)
+    else:
+        machine = events.tags().get("machine")
+        if machine:
+            msg = f"[{machine}] {msg}"
+        print(f"PROGRESS {pct} {msg}", flush=True)
 
 
 def system_status(unit: str) -> str:
-    p = run(["systemctl", "is-active", unit], check=False)
-    s = (p.stdout or "").strip()
+    s = systemd.is_active(unit)
     return s if s else "unknown"
 
 
+def _mount_points() -> frozenset:
+    points = set()
+    try:
+        with open("/proc/self/mountinfo", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 4:
+                    points.add(fields[4].replace("\\040", " "))
+    except OSError:
+        pass
+    return frozenset(points)
+
+
+def is_mounted(path: Path) -> bool:
+    """Check /proc/self/mountinfo for a mount point without spawning findmnt."""
+    return str(path) in cached("mountinfo", _mount_points)
+
+
+def umount_lazy(path: Path):
+    """
+    Best-effort lazy unmount; skips the umount call when nothing is mounted,
+    and always under --root, where nothing is ever mounted by us.
+    """
+    if not systemd.offline() and is_mounted(path):
+        run(["umount", "-lf", str(path)], check=False)
+
+
 def rootfs_dir(machine: str) -> Path:
-    return Path("/var/lib/machines") / machine
-
-
-def status(mode: str, machine: str) -> str:
-    lines = []
-    lines.append(f"[{ts()}] ArkSigner Manager status")
-    lines.append(f"Mode:    {mode}")
-    lines.append(f"Module:  {PKCS11_MODULE}")
-    lines.append(f"pcscd.socket: {system_status('pcscd.socket')}")
-
-    if mode == "container":
-        rootfs = rootfs_dir(machine)
-        lines.append(f"Machine: {machine}")
-        lines.append(f"Rootfs:  {rootfs}")
-        lines.append(f"{SERVICE_CONTAINER}: {system_status(SERVICE_CONTAINER)}")
-        p = run(["machinectl", "list"], check=False)
-        if (p.stdout or "").strip():
-            lines.append("")
-            lines.append(p.stdout.strip())
-    else:
-        lines.append(f"{SERVICE_NATIVE}: {system_status(SERVICE_NATIVE)}")
+    return paths.MACHINES_DIR / machine
+
+
+def container_unit(machine: str) -> str:
+    """
+    The unit running machine. A single-machine run always uses
+    SERVICE_CONTAINER, which is what the GUI watches. Fleet runs keep it for
+    the machine it was written for (the default machine on a fresh host) and
+    give every other machine arksigner-nspawn-<machine>.service; once that
+    unit exists, single-machine runs on that machine use it too.
+    """
+    own = f"arksigner-nspawn-{machine}.service"
+    if paths.unit_file(own).exists():
+        return own
+    if not in_fleet.get():
+        return SERVICE_CONTAINER
+    try:
+        m = re.search(r"--machine=(\S+)", paths.unit_file(SERVICE_CONTAINER).read_text(encoding="utf-8"))
+    except OSError:
+        m = None
+    owner = m.group(1) if m else DEFAULT_MACHINE
+    return SERVICE_CONTAINER if machine == owner else own
 
-    return "\n".join(lines).strip() + "\n"
 
+def fstab_bind_line(machine: str) -> str:
+    """fstab entry binding the container's ArkSigner tree to OPT_DIR (target paths)."""
+    src = rootfs_dir(machine) / "usr/bin/arksigner"
+    return f"{paths.target(src)} {paths.target(paths.OPT_DIR)} none bind 0 0"
@@ -0,0 +1,126 @@
+"""
+Time budgets and stall detection for commands.
+
+Every step (events.step) gets a wall-time budget, STEP_BUDGETS by default,
+overridable with --step-budget STEP=SECONDS (0 disables it). Commands started
+through proc.run inside a step are stopped once the step's budget runs out:
+SIGTERM to their process group, SIGKILL after cancel.GRACE_S. Time spent
+waiting for a lock does not count against the budget.
+
+Commands that normally keep printing (debootstrap, apt-get) are started with
+proc.run(..., stall=True) and are also stopped when they stay silent for
+--stall-timeout seconds; curl gets the same limit through --speed-time.
+
+A stopped command yields a "timeout" event carrying the last lines of its
+output, and a CommandTimeout error.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+STEP_BUDGETS = {
+    "download": 1800,
+    "pcscd": 120,
+    "rootfs": 3600,
+    "rootfs-template": 3600,
+    "package": 1800,
+    "bind-mount": 120,
+    "rpath": 300,
+    "service": 300,
+    "firefox-add": 300,
+    "pkcs11-probe": 600,
+    "sign-bench": 3600,
+    "repair": 600,
+    "uninstall": 600,
+    "purge": 600,
+}
+STALL_TIMEOUT_S = 600.0
+TAIL_LINES = 20
+
+_budgets = dict(STEP_BUDGETS)
+_stall_s: Optional[float] = STALL_TIMEOUT_S
+_local = threading.local()
+
+
+class CommandTimeout(SystemExit):
+    """A command hit its step budget, stalled or ran past its timeout."""
+
+    def __init__(self, message: str, kind: str, step: Optional[str], tail: list[str]):
+        super().__init__(message)
+        self.kind = kind
+        self.step = step
+        self.tail = tail
+
+
+def parse_budget(spec: str) -> tuple[str, float]:
+    """argparse type for --step-budget STEP=SECONDS."""
+    import argparse
+
+    name, sep, seconds = spec.partition("=")
+    try:
+        value = float(seconds)
+    except ValueError:
+        value = -1.0
+    if not sep or not name or value < 0:
+        raise argparse.ArgumentTypeError(f"expected STEP=SECONDS, got {spec!r}")
+    return name, value
+
+
+def configure(budgets: Optional[list[tuple[str, float]]] = None, stall_s: Optional[float] = None):
+    """Apply --step-budget overrides and --stall-timeout (0 disables either)."""
+    global _stall_s
+    for name, seconds in budgets or ():
+        _budgets[name] = seconds
+    if stall_s is not None:
+        _stall_s = stall_s or None
+
+
+def stall_timeout() -> Optional[float]:
+    return _stall_s
+
+
+def _frames() -> list:
+    if not hasattr(_local, "frames"):
+        _local.frames = []
+    return _local.frames
+
+
+@contextmanager
+def budget(step: str):
+    """Run the block under step's budget (nested steps keep the tighter one)."""
+    seconds = _budgets.get(step) or None
+    frames = _frames()
+    frames.append([step, time.monotonic() + seconds if seconds else None, seconds])
+    try:
+        yield
+    finally:
+        frames.pop()
+
+
+def current() -> Optional[tuple[str, float, float]]:
+    """(step, deadline, budget) of the tightest budget this thread is under."""
+    tight = None
+    for step, deadline, seconds in _frames():
+        if deadline is not None and (tight is None or deadline < tight[1]):
+            tight = (step, deadline, seconds)
+    return tight
+
+
+def current_step() -> Optional[str]:
+    frames = _frames()
+    return frames[-1][0] if frames else None
+
+
+def extend(seconds: float):
+    """Push this thread's deadlines back, e.g. by the time spent waiting for a lock."""
+    for frame in _frames():
+        if frame[1] is not None:
+            frame[1] += seconds
+
+
+def curl_args() -> list[str]:
+    """curl options that abort a transfer stalled for the stall timeout."""
+    if not _stall_s:
+        return []
+    return ["--speed-limit", "1", "--speed-time", str(int(_stall_s))]
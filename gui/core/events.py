@@ -0,0 +1,102 @@
+import json
+from typing import Optional
+
+# Must match backend/lib/events.py PROTOCOL_VERSION and EVENT_TAG
+PROTOCOL_VERSION = 1
+EVENT_TAG = "EVENT "
+
+EVENT_TYPES = {
+    "progress",
+    "step-start",
+    "step-end",
+    "bytes",
+    "heartbeat",
+    "warning",
+    "result",
+    "action-result",
+    "machine-result",
+    "lock-wait",
+    "span",
+    "profile",
+    "cancelled",
+    "timeout",
+}
+
+
+def parse_event(line: str) -> Optional[dict]:
+    """
+    Parse one line of the backend event stream.
+    Returns None for blank/garbled lines, other protocol versions and
+    unknown event types, so callers can simply skip them.
+    """
+    line = line.strip()
+    if not line.startswith("{"):
+        return None
+    try:
+        ev = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(ev, dict) or ev.get("v") != PROTOCOL_VERSION:
+        return None
+    if ev.get("type") not in EVENT_TYPES:
+        return None
+    return ev
+
+
+def split_tagged(line: str) -> tuple[str, Optional[dict]]:
+    """
+    Split a stdout line of a backend run with --events-stdout into its text
+    and its event. An event can land in the middle of a line another thread
+    was printing, so the tag is looked for anywhere; the text before it is
+    kept.
+    """
+    idx = line.find(EVENT_TAG + "{")
+    if idx < 0:
+        return line, None
+    ev = parse_event(line[idx + len(EVENT_TAG):])
+    if ev is None:
+        return line, None
+    return line[:idx], ev
+
+
+def format_event(ev: dict) -> Optional[str]:
+    """Human-readable diagnostics line for an event, or None if not worth showing."""
+    t = ev.get("type")
+    if t == "progress":
+        if ev.get("machine"):
+            return f"{ev.get('pct', 0)}% [{ev['machine']}] {ev.get('message', '')}"
+        return f"{ev.get('pct', 0)}% {ev.get('message', '')}"
+    if t == "step-start":
+        return f"▶ {ev.get('step')}"
+    if t == "step-end":
+        mark = "✓" if ev.get("ok") else "✗"
+        return f"{mark} {ev.get('step')} ({ev.get('duration_ms', 0):.0f} ms)"
+    if t in ("action-result", "machine-result"):
+        line = f"[{ev.get('status')}] {ev.get('action') or ev.get('machine')}"
+        if ev.get("duration_ms") is not None:
+            line += f" ({ev['duration_ms'] / 1000:.1f} s)"
+        if ev.get("error"):
+            line += f": {ev['error']}"
+        return line
+    if t == "lock-wait":
+        holder = ev.get("holder") or {}
+        who = f"{holder['action']} (pid {holder.get('pid')})" if holder.get("action") else "another instance"
+        return f"Waiting for {ev.get('lock')} lock held by {who}; position {ev.get('position')} in queue"
+    if t == "profile":
+        return "Profile: " + ", ".join(ev.get("files") or [])
+    if t == "timeout":
+        what = {"budget": "step budget exhausted", "stall": "no output"}.get(ev.get("kind"), "timed out")
+        cmd = " ".join(ev.get("cmd") or [])
+        lines = [f"TIMEOUT ({what}, {ev.get('limit_s') or 0:.0f} s) in {ev.get('step') or '-'}: {cmd}"]
+        lines += [f"  | {line}" for line in ev.get("tail") or []]
+        return "\n".join(lines)
+    if t == "cancelled":
+        return f"Cancelled; backend teardown took {ev.get('teardown_ms') or 0:.0f} ms"
+    if t == "warning":
+        return f"WARNING: {ev.get('message', '')}"
+    return None
+
+
+def slowest_spans(spans: list[dict], limit: int = 10) -> list[dict]:
+    """The `limit` longest spans, slowest first (ties keep arrival order)."""
+    return sorted(spans, key=lambda ev: -float(ev.get("duration_ms") or 0))[:limit]
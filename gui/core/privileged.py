@@ -1,9 +1,14 @@
 import os
 import shutil
+import signal
 import subprocess
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Optional
+
+from gui.core.events import split_tagged
 
 
 def _dev_repo_root() -> Path:
@@ -46,7 +51,7 @@ def find_backend_cli() -> str:
     return installed_paths[0]  # Will fail clearly if not found
 
 
-def build_pkexec_cmd(
+def build_backend_args(
     action: str,
     mode: str,
     machine: str,
@@ -58,14 +63,46 @@ def build_pkexec_cmd(
     force_terminate: bool = False,
     recreate_mounts: bool = False,
     clear_cache: bool = True,
+    resume: bool = False,
 ) -> list[str]:
+    """Build the backend CLI arguments (shared by pkexec and the D-Bus helper)."""
+    user = os.environ.get("USER", "")
+    home = os.path.expanduser("~")
+
+    # "a,b,c" runs several actions under one privileged invocation
+    args = [
+        "--actions" if "," in action else "--action", action,
+        "--mode", mode,
+        "--machine", machine,
+        "--suite", suite,
+        "--deb", deb,
+        "--user", user,
+        "--home", home,
+    ]
+
+    if recreate:
+        args.append("--recreate")
+    if firefox_add:
+        args.append("--firefox-add")
+    if native_rpath:
+        args.append("--native-rpath")
+    if force_terminate:
+        args.append("--force-terminate")
+    if recreate_mounts:
+        args.append("--recreate-mounts")
+    if clear_cache:
+        args.append("--clear-cache")
+    if resume:
+        args.append("--resume")
+
+    return args
+
+
+def build_pkexec_cmd(backend_args: list[str]) -> list[str]:
     """
     Build pkexec command for running backend with root privileges.
     In dev mode, runs Python directly without pkexec wrapper.
     """
-    user = os.environ.get("USER", "")
-    home = os.path.expanduser("~")
-
     backend_cli = find_backend_cli()
     repo = _dev_repo_root()
 
@@ -92,30 +129,7 @@ def build_pkexec_cmd(
             backend_cli,
         ]
 
-    # Add arguments
-    cmd.extend([
-        "--action", action,
-        "--mode", mode,
-        "--machine", machine,
-        "--suite", suite,
-        "--deb", deb,
-        "--user", user,
-        "--home", home,
-    ])
-
-    if recreate:
-        cmd.append("--recreate")
-    if firefox_add:
-        cmd.append("--firefox-add")
-    if native_rpath:
-        cmd.append("--native-rpath")
-    if force_terminate:
-        cmd.append("--force-terminate")
-    if recreate_mounts:
-        cmd.append("--recreate-mounts")
-    if clear_cache:
-        cmd.append("--clear-cache")
-
+    cmd.extend(backend_args)
     return cmd
 
 
@@ -124,37 +138,139 @@ class RunResult:
     rc: int
     out: str
     err: str
+    cancelled: bool = False
+    teardown_s: Optional[float] = None  # cancel request -> backend exit
+
+
+class CancelHandle:
+    """
+    Lets the UI cancel a run_pkexec_stream() or run_helper_stream() call
+    from another thread. A pkexec'd backend runs as root, so it is asked
+    through its control stdin (--control-stdin); the SIGTERM to its process
+    group only reaches it when it runs unprivileged (dev mode without
+    pkexec). Through the D-Bus helper, the helper's Cancel() method stops
+    this connection's running calls.
+    """
+
+    def __init__(self):
+        self._proc: Optional[subprocess.Popen] = None
+        self._bus = None
+        self._lock = threading.Lock()
+        self.requested_at: Optional[float] = None
+
+    def attach(self, proc: subprocess.Popen):
+        with self._lock:
+            self._proc = proc
+            pending = self.requested_at is not None
+        if pending:
+            self._send()
+
+    def attach_helper(self, bus):
+        with self._lock:
+            self._bus = bus
+            pending = self.requested_at is not None
+        if pending:
+            self._send()
+
+    def cancel(self):
+        with self._lock:
+            if self.requested_at is not None:
+                return
+            self.requested_at = time.monotonic()
+        self._send()
+
+    def _send(self):
+        if self._bus is not None:
+            self._send_helper()
+            return
+        p = self._proc
+        if p is None or p.poll() is not None:
+            return
+        try:
+            assert p.stdin is not None
+            p.stdin.write("cancel\n")
+            p.stdin.flush()
+        except (OSError, ValueError):
+            pass
+        try:
+            os.killpg(p.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _send_helper(self):
+        from gi.repository import Gio, GLib
+
+        # Asynchronous: cancel() is called from the UI thread
+        self._bus.call(
+            HELPER_BUS_NAME,
+            HELPER_OBJECT_PATH,
+            HELPER_INTERFACE,
+            "Cancel",
+            None,
+            GLib.VariantType.new("(u)"),
+            Gio.DBusCallFlags.NONE,
+            5000,
+            None,
+            None,
+        )
 
 
 def run_pkexec_stream(
     cmd: list[str],
     on_line: Callable[[str], None],
     on_progress: Callable[[int, str], None],
+    on_event: Optional[Callable[[dict], None]] = None,
+    cancel: Optional[CancelHandle] = None,
 ) -> RunResult:
     """
     Run pkexec and stream stdout live.
-    Backend prints machine-readable progress lines:
+    Structured events (progress, step timings, bytes, warnings, result)
+    arrive as "EVENT {...}" lines on stdout (--events-stdout; pkexec closes
+    any extra descriptor), see gui/core/events.py. Older backends print
+    text progress lines instead:
         PROGRESS <pct> <message>
+    and those are still understood.
+
+    The backend runs in its own process group and reads cancel requests
+    from stdin; see CancelHandle. Closing stdin (the GUI going away)
+    cancels it as well.
     """
     try:
         p = subprocess.Popen(
-            cmd,
+            cmd + ["--events-stdout", "--control-stdin"],
             text=True,
+            stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             bufsize=1,
             universal_newlines=True,
+            start_new_session=True,
         )
     except Exception as e:
         err_msg = f"Failed to start process: {e}"
         on_line(err_msg)
         return RunResult(rc=1, out=err_msg, err=str(e))
+    if cancel is not None:
+        cancel.attach(p)
+
+    def handle_event(ev: dict):
+        if ev["type"] == "progress":
+            try:
+                on_progress(max(0, min(100, int(ev.get("pct", 0)))), str(ev.get("message", "")))
+            except (TypeError, ValueError):
+                pass
+        if on_event is not None:
+            on_event(ev)
 
     collected: list[str] = []
     try:
         assert p.stdout is not None
-        for line in p.stdout:
-            line = line.rstrip("\n")
+        for raw in p.stdout:
+            line, ev = split_tagged(raw.rstrip("\n"))
+            if ev is not None:
+                handle_event(ev)
+                if not line:
+                    continue
             collected.append(line)
             on_line(line)
 
@@ -173,6 +289,109 @@ def run_pkexec_stream(
         on_line(f"Stream error: {e}")
     finally:
         rc = p.wait()
+        ended = time.monotonic()
+        try:
+            p.stdin.close()
+        except (OSError, ValueError):
+            pass
 
     text = "\n".join(collected).strip() + ("\n" if collected else "")
-    return RunResult(rc=rc, out=text, err="")
+    res = RunResult(rc=rc, out=text, err="")
+    if cancel is not None and cancel.requested_at is not None:
+        res.cancelled = True
+        res.teardown_s = max(0.0, ended - cancel.requested_at)
+    return res
+
+
+# ----------------------------------------------------------------------
+# D-Bus helper (tr.org.arksigner.Manager1)
+# ----------------------------------------------------------------------
+
+HELPER_BUS_NAME = "tr.org.arksigner.Manager1"
+HELPER_OBJECT_PATH = "/tr/org/arksigner/Manager1"
+HELPER_INTERFACE = "tr.org.arksigner.Manager1"
+
+
+def helper_available() -> bool:
+    """
+    True if the privileged helper is installed (activatable) or running.
+    Set ARKSIGNER_MANAGER_NO_HELPER=1 to always use pkexec.
+    """
+    if os.environ.get("ARKSIGNER_MANAGER_NO_HELPER", "") == "1":
+        return False
+    try:
+        from gi.repository import Gio, GLib
+
+        bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        (names,) = bus.call_sync(
+            "org.freedesktop.DBus",
+            "/org/freedesktop/DBus",
+            "org.freedesktop.DBus",
+            "ListActivatableNames",
+            None,
+            GLib.VariantType.new("(as)"),
+            Gio.DBusCallFlags.NONE,
+            2000,
+            None,
+        ).unpack()
+        return HELPER_BUS_NAME in names
+    except Exception:
+        return False
+
+
+def run_helper_stream(
+    backend_args: list[str],
+    on_line: Callable[[str], None],
+    on_progress: Callable[[int, str], None],
+    cancel: Optional[CancelHandle] = None,
+) -> RunResult:
+    """
+    Run backend_args through the D-Bus helper. Output and progress arrive as
+    signals; polkit authorization is kept for the session, and the backend
+    is already warm, so repeated calls skip the prompt and interpreter start.
+    The call can be stopped through cancel, see CancelHandle.
+    """
+    try:
+        from gi.repository import Gio, GLib
+
+        bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+    except Exception as e:
+        on_line(f"Failed to reach system bus: {e}")
+        return RunResult(rc=1, out="", err=str(e))
+
+    def on_signal(_conn, _sender, _path, _iface, signal, params):
+        if signal == "Output":
+            on_line(params.unpack()[0])
+        elif signal == "Progress":
+            pct, msg = params.unpack()
+            on_progress(max(0, min(100, pct)), msg)
+
+    sub_id = bus.signal_subscribe(
+        HELPER_BUS_NAME, HELPER_INTERFACE, None, HELPER_OBJECT_PATH, None,
+        Gio.DBusSignalFlags.NONE, on_signal,
+    )
+    if cancel is not None:
+        cancel.attach_helper(bus)
+    try:
+        rc, out = bus.call_sync(
+            HELPER_BUS_NAME,
+            HELPER_OBJECT_PATH,
+            HELPER_INTERFACE,
+            "Run",
+            GLib.Variant("(as)", (backend_args,)),
+            GLib.VariantType.new("(is)"),
+            Gio.DBusCallFlags.ALLOW_INTERACTIVE_AUTHORIZATION,
+            GLib.MAXINT,
+            None,
+        ).unpack()
+    except Exception as e:
+        on_line(f"Helper call failed: {e}")
+        return RunResult(rc=1, out="", err=str(e))
+    finally:
+        bus.signal_unsubscribe(sub_id)
+
+    res = RunResult(rc=rc, out=out, err="")
+    if cancel is not None and cancel.requested_at is not None:
+        res.cancelled = True
+        res.teardown_s = max(0.0, time.monotonic() - cancel.requested_at)
+    return res
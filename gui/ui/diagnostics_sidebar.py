@@ -1,8 +1,9 @@
 import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
-from gi.repository import Gtk, Gio
+from gi.repository import Gtk, Gio, Pango
 
+from gui.core.events import slowest_spans
 from gui.core.logging import logs_dir
 
 
@@ -68,6 +69,17 @@ class DiagnosticsSidebar(Gtk.Box):
 
         self.append(sc)
 
+        # Slowest spans of the last backend run (filled from "span" events)
+        self.spans_grid = Gtk.Grid(column_spacing=12, row_spacing=2)
+        self.spans_grid.set_margin_start(6)
+        self.spans_grid.set_margin_end(6)
+        self.spans_expander = Gtk.Expander(label="Slowest spans")
+        self.spans_expander.set_margin_start(12)
+        self.spans_expander.set_margin_end(12)
+        self.spans_expander.set_child(self.spans_grid)
+        self.spans_expander.set_visible(False)
+        self.append(self.spans_expander)
+
         # Action buttons
         bottom = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
         bottom.set_margin_top(10)
@@ -105,3 +117,35 @@ class DiagnosticsSidebar(Gtk.Box):
         # Auto-scroll to bottom
         end_iter = self.buf.get_end_iter()
         self.text.scroll_to_iter(end_iter, 0.0, False, 0.0, 0.0)
+
+    def set_spans(self, spans: list):
+        while (child := self.spans_grid.get_first_child()) is not None:
+            self.spans_grid.remove(child)
+
+        rows = slowest_spans(spans)
+        self.spans_expander.set_visible(bool(rows))
+        if not rows:
+            return
+
+        for col, head in enumerate(("Span", "Wall", "CPU", "rc")):
+            lbl = Gtk.Label(label=head, xalign=0)
+            lbl.add_css_class("heading")
+            self.spans_grid.attach(lbl, col, 0, 1, 1)
+
+        for row, ev in enumerate(rows, start=1):
+            name = f"{'  ' * int(ev.get('depth') or 0)}{ev.get('name', '')}"
+            rc = ev.get("rc")
+            cells = (
+                name,
+                f"{float(ev.get('duration_ms') or 0) / 1000:.2f} s",
+                f"{float(ev.get('cpu_ms') or 0) / 1000:.2f} s",
+                "" if rc is None else str(rc),
+            )
+            for col, text in enumerate(cells):
+                lbl = Gtk.Label(label=text, xalign=0)
+                lbl.add_css_class("monospace")
+                if col == 0:
+                    lbl.set_ellipsize(Pango.EllipsizeMode.END)
+                    lbl.set_max_width_chars(28)
+                    lbl.set_tooltip_text(f"{ev.get('cat', '')}: {ev.get('name', '')}")
+                self.spans_grid.attach(lbl, col, row, 1, 1)
@@ -5,8 +5,18 @@ gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
 from gi.repository import Gtk, Gio, GLib, Adw
 
+from backend.lib.systemd import unit_states
+from gui.core.events import format_event
 from gui.core.logging import gui_log
-from gui.core.privileged import build_pkexec_cmd, run_pkexec_stream, RunResult
+from gui.core.privileged import (
+    CancelHandle,
+    RunResult,
+    build_backend_args,
+    build_pkexec_cmd,
+    helper_available,
+    run_helper_stream,
+    run_pkexec_stream,
+)
 from gui.ui.diagnostics_sidebar import DiagnosticsSidebar
 from gui.ui.pages.actions_page import ActionsPage
 from gui.ui.pages.install_setup_page import InstallSetupPage
@@ -38,6 +48,7 @@ class MainWindow(Adw.ApplicationWindow):
 
         self._busy = False
         self._cancel_token = 0
+        self._cancel_handle = None
         self._last_install_cfg = None
         self.last_output = "Ready.\n"
 
@@ -452,23 +463,14 @@ class MainWindow(Adw.ApplicationWindow):
 
     def _detect_mode_and_show_upgrade(self):
         """Detect current installation mode by checking systemd units"""
-        import subprocess
-
         try:
-            p = subprocess.run(
-                ["systemctl", "is-active", "arksigner-nspawn.service"],
-                capture_output=True,
-                text=True
-            )
-            if p.returncode == 0:
+            states = unit_states(["arksigner-nspawn.service", "arksigner-native.service"])
+            if states["arksigner-nspawn.service"].active == "active":
                 mode = "container"
+            elif states["arksigner-native.service"].active == "active":
+                mode = "native"
             else:
-                p2 = subprocess.run(
-                    ["systemctl", "is-active", "arksigner-native.service"],
-                    capture_output=True,
-                    text=True
-                )
-                mode = "native" if p2.returncode == 0 else "unknown"
+                mode = "unknown"
         except Exception:
             mode = "unknown"
 
@@ -495,11 +497,12 @@ class MainWindow(Adw.ApplicationWindow):
             self.toast("Nothing to cancel")
             return
 
-        self._cancel_token += 1
-        self.toast("Cancelling...")
-        self.append_diag("Cancelled by user.")
-        self.set_busy(False)
-        self.stack.set_visible_child_name(self.PAGE_EMPTY)
+        # Stay busy until the backend has cleaned up and exited
+        self._cancel_handle.cancel()
+        self.page_progress.btn_cancel.set_sensitive(False)
+        self.page_progress.set_text("Cancelling…")
+        self.toast("Cancelling…")
+        self.append_diag("Cancel requested; waiting for the backend to clean up.")
 
     def on_post_install_done(self):
         self.stack.set_visible_child_name(self.PAGE_EMPTY)
@@ -509,10 +512,9 @@ class MainWindow(Adw.ApplicationWindow):
             self.toast("Missing install context")
             return
         cfg = dict(self._last_install_cfg)
-        cfg["firefox_add"] = True
         self.stack.set_visible_child_name(self.PAGE_PROGRESS)
-        self.page_progress.reset("Adding to Firefox…")
-        self.run_action("status", cfg=cfg, show_progress=True, auto_open_diag=False)
+        self.page_progress.reset("Adding to browsers…")
+        self.run_action("firefox-add,status", cfg=cfg, show_progress=True, auto_open_diag=False)
 
     def on_uninstall_confirm(self, cfg):
         self.stack.set_visible_child_name(self.PAGE_PROGRESS)
@@ -556,7 +558,7 @@ class MainWindow(Adw.ApplicationWindow):
         recreate_mounts = bool(cfg.get("recreate_mounts", False))
         clear_cache = bool(cfg.get("clear_cache", True))
 
-        cmd = build_pkexec_cmd(
+        backend_args = build_backend_args(
             action=action,
             mode=mode,
             machine=machine,
@@ -568,12 +570,21 @@ class MainWindow(Adw.ApplicationWindow):
             force_terminate=force_terminate,
             recreate_mounts=recreate_mounts,
             clear_cache=clear_cache,
+            # Checkpoints are fingerprinted, so resuming is always safe
+            resume=action in ("install", "upgrade"),
         )
+        use_helper = helper_available()
+        cmd = build_pkexec_cmd(backend_args)
+        handle = CancelHandle()
+        self._cancel_handle = handle
 
         self.set_busy(True)
 
         self.append_diag(f"\n==== {action.upper()} (mode={mode}) ====")
-        self.append_diag(f"Command: {' '.join(cmd)}")
+        if use_helper:
+            self.append_diag(f"Helper: {' '.join(backend_args)}")
+        else:
+            self.append_diag(f"Command: {' '.join(cmd)}")
 
         if auto_open_diag:
             self.btn_diag.set_active(True)
@@ -589,8 +600,28 @@ class MainWindow(Adw.ApplicationWindow):
             if show_progress:
                 GLib.idle_add(self.page_progress.set_progress, pct, msg)
 
+        spans = []
+
+        def on_event(ev: dict):
+            if token != self._cancel_token:
+                return
+            if ev.get("type") == "span":
+                spans.append(ev)
+                return
+            if ev.get("type") == "result":
+                GLib.idle_add(self.diag_sidebar.set_spans, list(spans))
+            if ev.get("type") == "timeout" and ev.get("kind") != "timeout":
+                GLib.idle_add(self.toast, f"{ev.get('step') or 'Step'} timed out; see Diagnostics")
+            text = format_event(ev)
+            if text:
+                GLib.idle_add(self.append_diag, text)
+
         def task():
-            res = run_pkexec_stream(cmd, on_line=on_line, on_progress=on_progress)
+            if use_helper:
+                res = run_helper_stream(backend_args, on_line=on_line, on_progress=on_progress, cancel=handle)
+            else:
+                res = run_pkexec_stream(cmd, on_line=on_line, on_progress=on_progress, on_event=on_event,
+                                        cancel=handle)
             GLib.idle_add(self.finish_run, action, res, after_install, token)
 
         threading.Thread(target=task, daemon=True).start()
@@ -599,9 +630,15 @@ class MainWindow(Adw.ApplicationWindow):
         if token != self._cancel_token:
             return
 
+        self._cancel_handle = None
         self.set_busy(False)
 
-        if res.rc == 0:
+        if res.cancelled:
+            msg = f"Cancelled; teardown took {res.teardown_s:.1f} s"
+            self.toast(msg)
+            self.append_diag(msg)
+            self.stack.set_visible_child_name(self.PAGE_EMPTY)
+        elif res.rc == 0:
             self.toast("Done")
             if action == "install" and after_install:
                 self.stack.set_visible_child_name(self.PAGE_POST)
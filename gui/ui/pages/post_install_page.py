@@ -7,7 +7,7 @@ from gi.repository import Gtk
 class PostInstallPage:
     """
     Right-panel post-install page:
-      - offers optional Firefox PKCS#11 registration
+      - offers optional PKCS#11 registration in Firefox, Thunderbird and Chromium
       - provides Finish to return home
     Exposes:
       - self.widget : Gtk.Widget
@@ -34,7 +34,7 @@ class PostInstallPage:
         outer.append(title)
 
         body = Gtk.Label(
-            label="ArkSigner has been installed.\nYou can optionally register the PKCS#11 module in Firefox.",
+            label="ArkSigner has been installed.\nYou can optionally register the PKCS#11 module in Firefox, Thunderbird and Chromium.",
             xalign=0,
         )
         body.add_css_class("dim-label")
@@ -43,7 +43,7 @@ class PostInstallPage:
 
         outer.append(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL))
 
-        self.btn_firefox = Gtk.Button(label="Add to Firefox (optional)")
+        self.btn_firefox = Gtk.Button(label="Add to browsers (optional)")
         self.btn_firefox.add_css_class("suggested-action")
         self.btn_firefox.connect("clicked", lambda *_: (None if self._busy else self.on_firefox_add()))
         outer.append(self.btn_firefox)
@@ -1,9 +1,10 @@
-import subprocess
 import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
 from gi.repository import Gtk, Adw
 
+from backend.lib.systemd import unit_states
+
 
 class PurgePage:
     """
@@ -143,13 +144,11 @@ class PurgePage:
     def detect_mode(self):
         """Detect current installation mode and update UI"""
         try:
+            # Both units in one D-Bus round trip
+            states = unit_states(["arksigner-nspawn.service", "arksigner-native.service"])
+
             # Check container mode
-            p = subprocess.run(
-                ["systemctl", "is-active", "arksigner-nspawn.service"],
-                capture_output=True,
-                text=True
-            )
-            if p.returncode == 0:
+            if states["arksigner-nspawn.service"].active == "active":
                 self._detected_mode = "container"
                 self.row_detected.set_subtitle("Container Mode")
                 self.lbl_service.set_text("arksigner-nspawn.service")
@@ -159,12 +158,7 @@ class PurgePage:
                 return
 
             # Check native mode
-            p2 = subprocess.run(
-                ["systemctl", "is-active", "arksigner-native.service"],
-                capture_output=True,
-                text=True
-            )
-            if p2.returncode == 0:
+            if states["arksigner-native.service"].active == "active":
                 self._detected_mode = "native"
                 self.row_detected.set_subtitle("Native Mode")
                 self.lbl_service.set_text("arksigner-native.service")
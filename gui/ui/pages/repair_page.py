@@ -1,9 +1,10 @@
-import subprocess
 import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
 from gi.repository import Gtk, Adw
 
+from backend.lib.systemd import unit_states
+
 
 class RepairPage:
     """
@@ -166,15 +167,14 @@ class RepairPage:
     def detect_mode(self):
         """Detect current installation mode and service status"""
         try:
-            # Check container mode
-            p = subprocess.run(
-                ["systemctl", "is-active", "arksigner-nspawn.service"],
-                capture_output=True,
-                text=True
-            )
-            container_status = p.stdout.strip()
-
-            if container_status in ("active", "activating", "failed", "inactive"):
+            # Both units in one D-Bus round trip
+            states = unit_states(["arksigner-nspawn.service", "arksigner-native.service"])
+
+            # Check container mode (skip units systemd does not know about)
+            container = states["arksigner-nspawn.service"]
+            container_status = container.active
+
+            if container.load != "not-found" and container_status in ("active", "activating", "failed", "inactive"):
                 self._detected_mode = "container"
                 self._service_status = container_status
                 self.row_detected.set_subtitle("Container Mode")
@@ -185,14 +185,10 @@ class RepairPage:
                 return
 
             # Check native mode
-            p2 = subprocess.run(
-                ["systemctl", "is-active", "arksigner-native.service"],
-                capture_output=True,
-                text=True
-            )
-            native_status = p2.stdout.strip()
-
-            if native_status in ("active", "activating", "failed", "inactive"):
+            native = states["arksigner-native.service"]
+            native_status = native.active
+
+            if native.load != "not-found" and native_status in ("active", "activating", "failed", "inactive"):
                 self._detected_mode = "native"
                 self._service_status = native_status
                 self.row_detected.set_subtitle("Native Mode")
@@ -8,7 +8,7 @@ URL:            https://github.com/mfn77/Arksigner-Manager
 
 Source0:        %{name}-%{version}.tar.gz
 
-Requires:       python3
+Requires:       python3 >= 3.10
 Requires:       python3-gobject
 Requires:       gtk4
 Requires:       libadwaita
@@ -29,6 +29,7 @@ Requires:       xz
 Requires:       zstd
 Requires:       patchelf
 Requires:       rsync
+BuildRequires:  python3-devel
 
 %description
 GUI and CLI to install/upgrade/repair ArkSigner in either a Debian systemd-nspawn container
@@ -57,12 +58,18 @@ test -f gui/ui/pages/progress_page.py
 test -f gui/core/privileged.py
 test -f assets/tr.org.arksigner.Manager.desktop
 test -f assets/tr.org.arksigner.Manager.policy
+test -f assets/tr.org.arksigner.Manager1.service
+test -f assets/tr.org.arksigner.Manager1.conf
 
 # Install tree under /usr/share/arksigner-manager
 install -d %{buildroot}%{_datadir}/%{name}
 rsync -a --exclude '__pycache__' --exclude '*.pyc' gui/ %{buildroot}%{_datadir}/%{name}/gui/
 rsync -a --exclude '__pycache__' --exclude '*.pyc' backend/ %{buildroot}%{_datadir}/%{name}/backend/
 
+# Ship bytecode: /usr/share is outside the automatic byte-compilation paths,
+# and the root CLI should not compile the backend on every first run
+%py_byte_compile %{python3} %{buildroot}%{_datadir}/%{name}
+
 # Root CLI entry (polkit target)
 install -d %{buildroot}%{_libexecdir}/%{name}
 install -m 0755 /dev/stdin %{buildroot}%{_libexecdir}/%{name}/arksigner-manager-cli <<'EOF'
@@ -83,6 +90,11 @@ ln -sf %{_libexecdir}/%{name}/arksigner-manager-cli %{buildroot}%{_bindir}/arksi
 install -d %{buildroot}%{_datadir}/polkit-1/actions
 install -m 0644 assets/tr.org.arksigner.Manager.policy %{buildroot}%{_datadir}/polkit-1/actions/tr.org.arksigner.Manager.policy
 
+# Privileged D-Bus helper (activated on demand, exits when idle)
+install -d %{buildroot}%{_datadir}/dbus-1/system-services %{buildroot}%{_datadir}/dbus-1/system.d
+install -m 0644 assets/tr.org.arksigner.Manager1.service %{buildroot}%{_datadir}/dbus-1/system-services/tr.org.arksigner.Manager1.service
+install -m 0644 assets/tr.org.arksigner.Manager1.conf %{buildroot}%{_datadir}/dbus-1/system.d/tr.org.arksigner.Manager1.conf
+
 # Desktop entry
 install -d %{buildroot}%{_datadir}/applications
 install -m 0644 assets/tr.org.arksigner.Manager.desktop %{buildroot}%{_datadir}/applications/tr.org.arksigner.Manager.desktop
@@ -107,6 +119,8 @@ fi
 %{_bindir}/arksigner-manager
 %{_bindir}/arksigner-manager-cli
 %{_datadir}/polkit-1/actions/tr.org.arksigner.Manager.policy
+%{_datadir}/dbus-1/system-services/tr.org.arksigner.Manager1.service
+%{_datadir}/dbus-1/system.d/tr.org.arksigner.Manager1.conf
 %{_datadir}/applications/tr.org.arksigner.Manager.desktop
 %{_datadir}/icons/hicolor/scalable/apps/tr.org.arksigner.Manager.svg
 %{_datadir}/icons/hicolor/symbolic/apps/tr.org.arksigner.Manager-symbolic.svg
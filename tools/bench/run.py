@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the backend CLI against shimmed system tools.
+
+Every action (install, status, upgrade, repair, uninstall, purge) runs in
+both modes against a scratch root (ARKSIGNER_ROOT), with tools/bench/shims
+first on PATH and a synthetic .deb served from a local HTTP server. No root
+privileges are needed and the live system is never touched.
+
+Per action it records wall time, subprocess count (exec spans from --trace)
+and bytes written under the scratch root, and compares them with a JSON
+baseline:
+
+    tools/bench/run.py                      # compare with baseline.json
+    tools/bench/run.py --update-baseline    # record a new baseline
+    tools/bench/run.py --latency 0.1 --latency-debootstrap 2
+
+Exits non-zero when an action regresses beyond the tolerances.
+"""
+import argparse
+import functools
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parents[1]
+CLI = REPO / "backend" / "arksigner_manager.py"
+
+SEQUENCE = ["install", "status", "upgrade", "repair", "uninstall", "purge"]
+MODES = ["container", "native"]
+MACHINE = "bench-arksigner"
+
+# A regression is a result above baseline * (1 + rel) + abs
+WALL_TOLERANCE = (0.50, 0.25)
+BYTES_TOLERANCE = (0.10, 4096)
+
+
+# --------------------------------------------------------------------------
+# Synthetic package
+# --------------------------------------------------------------------------
+
+def _tar(files: dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o755 if name.endswith(("universal", "service")) else 0o644
+            info.mtime = 0
+            tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _ar(members: list[tuple[str, bytes]]) -> bytes:
+    out = [b"!<arch>\n"]
+    for name, data in members:
+        hdr = f"{name + '/':<16}{0:<12}{0:<6}{0:<6}{'100644':<8}{len(data):<10}`\n"
+        out.append(hdr.encode())
+        out.append(data)
+        if len(data) % 2:
+            out.append(b"\n")
+    return b"".join(out)
+
+
+def make_deb(version: str, payload_kib: int) -> bytes:
+    control = f"Package: arksigner-pub\nVersion: {version}\nArchitecture: amd64\n"
+    base = "./usr/bin/arksigner/"
+    data = _tar({
+        base + "drivers/akis/x64/libakisp11.so": b"\x7fELF" + os.urandom(1024),
+        base + "libs/libfoo.so": b"\x7fELF" + bytes(payload_kib * 1024),
+        base + "arksigner-universal": b"#!/bin/sh\nexec sleep infinity\n",
+    })
+    return _ar([
+        ("debian-binary", b"2.0\n"),
+        ("control.tar.gz", _tar({"./control": control.encode()})),
+        ("data.tar.gz", data),
+    ])
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(directory: Path) -> tuple[ThreadingHTTPServer, str]:
+    handler = functools.partial(_QuietHandler, directory=str(directory))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+# --------------------------------------------------------------------------
+# Measurement
+# --------------------------------------------------------------------------
+
+def _snapshot(root: Path) -> dict[str, tuple[int, int]]:
+    snap = {}
+    for dirpath, _dirs, files in os.walk(root):
+        for name in files:
+            p = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(p)
+            except OSError:
+                continue
+            # ctime also moves when extraction rewrites a file with an old mtime
+            snap[p] = (st.st_size, st.st_ctime_ns)
+    return snap
+
+
+def _bytes_written(before: dict, after: dict) -> int:
+    return sum(size for p, (size, ctime) in after.items() if before.get(p) != (size, ctime))
+
+
+def run_action(action: str, mode: str, deb_url: str, root: Path, env: dict, trace: Path) -> dict:
+    argv = [
+        sys.executable, str(CLI),
+        "--action", action, "--mode", mode, "--machine", MACHINE,
+        "--deb", deb_url, "--home", str(root / "home"), "--trace", str(trace),
+    ]
+    before = _snapshot(root)
+    t0 = time.monotonic()
+    p = subprocess.run(argv, env=env, capture_output=True, text=True)
+    wall = time.monotonic() - t0
+    after = _snapshot(root)
+    if p.returncode != 0:
+        raise SystemExit(f"ERROR: {mode}/{action} failed (rc={p.returncode}):\n{p.stdout}{p.stderr}")
+
+    spans = json.loads(trace.read_text())["traceEvents"]
+    return {
+        "wall_s": round(wall, 3),
+        "subprocesses": sum(1 for ev in spans if ev.get("cat") == "exec"),
+        "bytes_written": _bytes_written(before, after),
+    }
+
+
+def run_sequence(mode: str, urls: dict, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"arksigner-bench-{mode}-") as td:
+        td = Path(td)
+        root = td / "root"
+        (root / "home").mkdir(parents=True)
+        env = dict(
+            os.environ,
+            PATH=f"{HERE / 'shims'}:{os.environ.get('PATH', '/usr/bin:/bin')}",
+            PYTHONPATH=str(REPO),
+            ARKSIGNER_ROOT=str(root),
+            # Run start/stop, machinectl and mount through the shims instead of
+            # skipping them as --root runs do
+            ARKSIGNER_SYSTEMD_BACKEND="shim",
+            ARKSIGNER_SHIM_STATE=str(td / "shim"),
+            ARKSIGNER_SHIM_LATENCY=str(args.latency),
+            ARKSIGNER_SHIM_LATENCY_DEBOOTSTRAP=str(args.latency_debootstrap),
+        )
+        results = {}
+        for action in SEQUENCE:
+            url = urls["upgrade"] if action in ("upgrade", "repair", "uninstall", "purge") else urls["install"]
+            results[action] = run_action(action, mode, url, root, env, td / f"{action}.trace.json")
+        return results
+
+
+def measure(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="arksigner-bench-www-") as www:
+        www = Path(www)
+        (www / "arksigner-pub-2.3.12.deb").write_bytes(make_deb("2.3.12", args.payload_kib))
+        (www / "arksigner-pub-2.3.13.deb").write_bytes(make_deb("2.3.13", args.payload_kib))
+        httpd, base = serve(www)
+        urls = {
+            "install": f"{base}/arksigner-pub-2.3.12.deb",
+            "upgrade": f"{base}/arksigner-pub-2.3.13.deb",
+        }
+        try:
+            runs = [{mode: run_sequence(mode, urls, args) for mode in MODES} for _ in range(args.repeat)]
+        finally:
+            httpd.shutdown()
+
+    # Median wall time across repeats; counts are deterministic
+    results = {}
+    for mode in MODES:
+        for action in SEQUENCE:
+            samples = [r[mode][action] for r in runs]
+            results[f"{mode}/{action}"] = {
+                "wall_s": round(statistics.median(s["wall_s"] for s in samples), 3),
+                "subprocesses": max(s["subprocesses"] for s in samples),
+                "bytes_written": max(s["bytes_written"] for s in samples),
+            }
+    return results
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    failures = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if cur["wall_s"] > base["wall_s"] * (1 + WALL_TOLERANCE[0]) + WALL_TOLERANCE[1]:
+            failures.append(f"{key}: wall {cur['wall_s']:.3f}s > baseline {base['wall_s']:.3f}s")
+        if cur["subprocesses"] > base["subprocesses"]:
+            failures.append(f"{key}: subprocesses {cur['subprocesses']} > baseline {base['subprocesses']}")
+        if cur["bytes_written"] > base["bytes_written"] * (1 + BYTES_TOLERANCE[0]) + BYTES_TOLERANCE[1]:
+            failures.append(f"{key}: bytes written {cur['bytes_written']} > baseline {base['bytes_written']}")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--baseline", default=str(HERE / "baseline.json"))
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--latency", type=float, default=0.02, help="seconds per shim call")
+    ap.add_argument("--latency-debootstrap", type=float, default=0.2)
+    ap.add_argument("--payload-kib", type=int, default=2048, help="size of the synthetic library in the .deb")
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args()
+
+    if shutil.which("curl") is None or shutil.which("ar") is None:
+        raise SystemExit("ERROR: curl and ar are required")
+
+    results = measure(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'action':<22} {'wall':>8} {'procs':>6} {'written':>10}")
+        for key, r in results.items():
+            print(f"{key:<22} {r['wall_s']:>7.3f}s {r['subprocesses']:>6} {r['bytes_written']:>10}")
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline written: {baseline_path}")
+        return
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --update-baseline")
+        return
+
+    failures = compare(results, json.loads(baseline_path.read_text()))
+    for f in failures:
+        print(f"REGRESSION {f}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
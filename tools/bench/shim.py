@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Stand-in for systemctl, machinectl, systemd-nspawn, debootstrap, modutil,
+mount and umount, used by tools/bench/run.py. The tool is picked from
+argv[0] (tools/bench/shims/* are symlinks to this file).
+
+State (unit and machine tables, call log) lives in $ARKSIGNER_SHIM_STATE;
+paths are resolved under $ARKSIGNER_ROOT. Every call sleeps for
+$ARKSIGNER_SHIM_LATENCY seconds, or $ARKSIGNER_SHIM_LATENCY_<TOOL> (e.g.
+ARKSIGNER_SHIM_LATENCY_DEBOOTSTRAP=2) to model slow steps.
+"""
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+import time
+from pathlib import Path
+
+ROOT = Path(os.environ.get("ARKSIGNER_ROOT", "/"))
+STATE = Path(os.environ.get("ARKSIGNER_SHIM_STATE", "/tmp/arksigner-shim"))
+# Units that exist on every host the backend runs on
+BUILTIN_UNITS = {"pcscd.socket"}
+
+
+def _load(name: str) -> dict:
+    try:
+        return json.loads((STATE / name).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(name: str, data: dict):
+    STATE.mkdir(parents=True, exist_ok=True)
+    (STATE / name).write_text(json.dumps(data, indent=1))
+
+
+def _latency(tool: str):
+    key = "ARKSIGNER_SHIM_LATENCY_" + tool.upper().replace("-", "_")
+    delay = float(os.environ.get(key) or os.environ.get("ARKSIGNER_SHIM_LATENCY") or 0)
+    if delay > 0:
+        time.sleep(delay)
+
+
+# --------------------------------------------------------------------------
+# systemctl / machinectl
+# --------------------------------------------------------------------------
+
+def _unit_file(unit: str) -> Path:
+    return ROOT / "etc/systemd/system" / unit
+
+
+def _machine_of(unit: str) -> str:
+    try:
+        m = re.search(r"--machine=(\S+)", _unit_file(unit).read_text())
+    except OSError:
+        return ""
+    return m.group(1) if m else ""
+
+
+def _set_active(units: dict, unit: str, active: bool):
+    units.setdefault(unit, {})["active"] = active
+    machine = _machine_of(unit)
+    if machine:
+        machines = _load("machines.json")
+        if active:
+            machines[machine] = unit
+        else:
+            machines.pop(machine, None)
+        _save("machines.json", machines)
+
+
+def _wanted_by(unit: str, root: Path) -> list[str]:
+    if unit in BUILTIN_UNITS:
+        return ["sockets.target"]
+    try:
+        text = (root / "etc/systemd/system" / unit).read_text()
+    except OSError:
+        return []
+    return [t for line in text.splitlines() if line.startswith("WantedBy=") for t in line[9:].split()]
+
+
+def _systemctl_offline(verb: str, names: list[str], root: Path) -> int:
+    """`systemctl --root=PREFIX enable|disable`: only the [Install] symlinks change."""
+    if verb not in ("enable", "disable"):
+        print(f"shim systemctl: {verb} is not supported with --root", file=sys.stderr)
+        return 1
+    unit_dir = root / "etc/systemd/system"
+    for u in names:
+        if u not in BUILTIN_UNITS and not (unit_dir / u).exists():
+            if verb == "disable":
+                continue
+            print(f"Failed to enable unit: Unit file {u} does not exist.", file=sys.stderr)
+            return 1
+        for target in _wanted_by(u, root):
+            link = unit_dir / f"{target}.wants" / u
+            if verb == "enable" and not os.path.lexists(link):
+                link.parent.mkdir(parents=True, exist_ok=True)
+                link.symlink_to(f"/etc/systemd/system/{u}")
+            elif verb == "disable" and os.path.lexists(link):
+                link.unlink()
+    return 0
+
+
+def systemctl(args: list[str]) -> int:
+    units = _load("units.json")
+    if not args:
+        return 1
+    verb, rest = args[0], args[1:]
+    root = next((a.split("=", 1)[1] for a in rest if a.startswith("--root=")), None)
+    if root is not None:
+        return _systemctl_offline(verb, [a for a in rest if not a.startswith("-")], Path(root))
+    now = "--now" in rest
+    names = [a for a in rest if not a.startswith("-")]
+
+    if verb == "show":
+        names = [a for a in rest[rest.index("-p") + 2:]] if "-p" in rest else names
+        blocks = []
+        for u in names:
+            st = units.get(u, {})
+            loaded = u in BUILTIN_UNITS or _unit_file(u).exists()
+            active = st.get("active", u in BUILTIN_UNITS)
+            enabled = st.get("enabled", u in BUILTIN_UNITS)
+            blocks.append(
+                f"Id={u}\nLoadState={'loaded' if loaded else 'not-found'}\n"
+                f"ActiveState={'active' if active and loaded else 'inactive'}\n"
+                f"SubState={'running' if active and loaded else 'dead'}\n"
+                f"UnitFileState={('enabled' if enabled else 'disabled') if loaded else ''}\n"
+            )
+        sys.stdout.write("\n".join(blocks))
+        return 0
+    if verb == "is-active":
+        return 0 if all(units.get(u, {}).get("active") for u in names) else 3
+    if verb in ("daemon-reload", "reset-failed"):
+        return 0
+
+    for u in names:
+        if u not in BUILTIN_UNITS and not _unit_file(u).exists():
+            if verb in ("stop", "disable"):
+                continue
+            print(f"Failed to {verb} {u}: Unit {u} not found.", file=sys.stderr)
+            return 5
+        if verb in ("start", "restart"):
+            _set_active(units, u, True)
+        elif verb == "stop":
+            _set_active(units, u, False)
+        elif verb == "enable":
+            units.setdefault(u, {})["enabled"] = True
+            if now:
+                _set_active(units, u, True)
+        elif verb == "disable":
+            units.setdefault(u, {})["enabled"] = False
+            if now:
+                _set_active(units, u, False)
+        else:
+            print(f"shim systemctl: unsupported verb {verb}", file=sys.stderr)
+            return 1
+    _save("units.json", units)
+    return 0
+
+
+def machinectl(args: list[str]) -> int:
+    machines = _load("machines.json")
+    if args and args[0] == "list":
+        for name in machines:
+            print(f"{name} container systemd-nspawn debian 11 -")
+        return 0
+    if args and args[0] in ("terminate", "poweroff", "kill"):
+        for name in args[1:]:
+            unit = machines.pop(name, None)
+            if unit:
+                units = _load("units.json")
+                units.setdefault(unit, {})["active"] = False
+                _save("units.json", units)
+        _save("machines.json", machines)
+        return 0
+    return 0
+
+
+# --------------------------------------------------------------------------
+# debootstrap / systemd-nspawn
+# --------------------------------------------------------------------------
+
+def debootstrap(args: list[str]) -> int:
+    pos = [a for a in args if not a.startswith("-")]
+    if len(pos) < 2:
+        return 1
+    suite, target = pos[0], Path(pos[1])
+    (target / "etc").mkdir(parents=True, exist_ok=True)
+    (target / "var/lib/dpkg").mkdir(parents=True, exist_ok=True)
+    (target / "root").mkdir(parents=True, exist_ok=True)
+    (target / "etc/debian_version").write_text("11.9\n")
+    (target / "etc/os-release").write_text(f"ID=debian\nVERSION_CODENAME={suite}\n")
+    (target / "var/lib/dpkg/status").write_text("")
+    return 0
+
+
+def _deb_members(deb: Path) -> dict:
+    data = deb.read_bytes()
+    members, pos = {}, 8
+    while pos + 60 <= len(data):
+        hdr = data[pos:pos + 60]
+        name = hdr[:16].decode().strip().rstrip("/")
+        size = int(hdr[48:58].decode().strip())
+        members[name] = data[pos + 60:pos + 60 + size]
+        pos += 60 + size + (size % 2)
+    return members
+
+
+def systemd_nspawn(args: list[str]) -> int:
+    rootfs = Path(args[args.index("-D") + 1]) if "-D" in args else None
+    cmd = args[-1] if args else ""
+    if rootfs is None or "/root/arksigner.deb" not in cmd:
+        return 0
+    members = _deb_members(rootfs / "root/arksigner.deb")
+    control = next(v for k, v in members.items() if k.startswith("control.tar"))
+    payload = next(v for k, v in members.items() if k.startswith("data.tar"))
+    with tarfile.open(fileobj=io.BytesIO(control)) as tf:
+        fields = tf.extractfile("./control").read().decode()
+    with tarfile.open(fileobj=io.BytesIO(payload)) as tf:
+        tf.extractall(rootfs)
+    pkg = re.search(r"^Package:\s*(\S+)", fields, re.M).group(1)
+    ver = re.search(r"^Version:\s*(\S+)", fields, re.M).group(1)
+    (rootfs / "var/lib/dpkg").mkdir(parents=True, exist_ok=True)
+    (rootfs / "var/lib/dpkg/status").write_text(
+        f"Package: {pkg}\nStatus: install ok installed\nVersion: {ver}\n\n")
+    return 0
+
+
+# --------------------------------------------------------------------------
+# mount / umount / modutil
+# --------------------------------------------------------------------------
+
+def mount(args: list[str]) -> int:
+    # There is no unprivileged bind mount; copying gives the same view
+    pos = [a for a in args if not a.startswith("-")]
+    if "--bind" in args and len(pos) >= 2:
+        shutil.copytree(pos[-2], pos[-1], dirs_exist_ok=True, symlinks=True)
+    return 0
+
+
+def umount(args: list[str]) -> int:
+    return 0
+
+
+def _opt(args: list[str], flag: str) -> str:
+    return args[args.index(flag) + 1] if flag in args[:-1] else ""
+
+
+def modutil(args: list[str]) -> int:
+    # Keeps pkcs11.txt the way NSS writes it, so registration checks see it
+    db = Path(_opt(args, "-dbdir").removeprefix("sql:"))
+    txt = db / "pkcs11.txt"
+    entries = [e for e in txt.read_text().split("\n\n") if e.strip()] if txt.exists() else []
+    if "-delete" in args:
+        name = _opt(args, "-delete")
+        kept = [e for e in entries if f"name={name}\n" not in e + "\n"]
+        if len(kept) == len(entries):
+            print(f"modutil: module {name} not found", file=sys.stderr)
+            return 1
+        entries = kept
+    elif "-add" in args:
+        entries.append(f"library={_opt(args, '-libfile')}\nname={_opt(args, '-add')}\n")
+    db.mkdir(parents=True, exist_ok=True)
+    txt.write_text("".join(e.rstrip("\n") + "\n\n" for e in entries))
+    return 0
+
+
+TOOLS = {
+    "systemctl": systemctl,
+    "machinectl": machinectl,
+    "debootstrap": debootstrap,
+    "systemd-nspawn": systemd_nspawn,
+    "mount": mount,
+    "umount": umount,
+    "modutil": modutil,
+}
+
+
+def main() -> int:
+    tool = os.path.basename(sys.argv[0])
+    if tool not in TOOLS:
+        print(f"shim: unknown tool {tool}", file=sys.stderr)
+        return 127
+    STATE.mkdir(parents=True, exist_ok=True)
+    with open(STATE / "calls.log", "a") as f:
+        f.write(json.dumps([tool] + sys.argv[1:]) + "\n")
+    _latency(tool)
+    return TOOLS[tool](sys.argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Import-time regression check for the backend CLI.
+
+Runs `python -X importtime -c "import backend.lib.main"` a few times, takes
+the best cumulative time, and fails if it exceeds the budget or if any of the
+heavy action modules are imported eagerly again.
+
+    tools/check-import-time.py [--budget-ms 80] [--runs 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Only needed by mutating actions; main must not pull them in at import time
+LAZY_MODULES = [
+    "backend.lib.container_mode",
+    "backend.lib.native_mode",
+    "backend.lib.download",
+    "backend.lib.firefox",
+    "backend.lib.fleet",
+    "backend.lib.plan",
+    "backend.lib.service",
+    "backend.lib.units",
+]
+
+
+def measure() -> tuple[float, set[str]]:
+    """Return (cumulative ms for backend.lib.main, set of modules imported)."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="")
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.lib.main"],
+        cwd=str(ROOT), env=env, capture_output=True, text=True,
+    )
+    if p.returncode != 0:
+        raise SystemExit(f"ERROR: import failed:\n{p.stderr}")
+
+    total = None
+    modules = set()
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = [x.strip() for x in line[len("import time:"):].split("|")]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        name = parts[2].strip()
+        modules.add(name)
+        if name == "backend.lib.main":
+            total = int(parts[1]) / 1000.0
+    if total is None:
+        raise SystemExit("ERROR: backend.lib.main not found in -X importtime output")
+    return total, modules
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--budget-ms", type=float, default=80.0)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    # First run warms the bytecode cache; keep the best of the rest
+    measure()
+    best, modules = min(measure() for _ in range(max(1, args.runs)))
+
+    eager = [m for m in LAZY_MODULES if m in modules]
+    print(f"backend.lib.main import: {best:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if best > args.budget_ms:
+        print(f"FAIL: over budget by {best - args.budget_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Check of the systemd D-Bus client (backend/lib/systemd.py) against a mock.
+
+Starts a private dbus-daemon, registers a mock org.freedesktop.systemd1 and
+org.freedesktop.machine1 manager on it (this script with --mock), points
+DBUS_SYSTEM_BUS_ADDRESS at it and drives unit_states, start/stop jobs,
+enable_units/disable_units and the machine calls through the Gio path. PATH
+is emptied for the checks, so a silent fall back to systemctl/machinectl
+fails instead of passing.
+
+    tools/check-systemd-dbus.py
+
+Needs dbus-daemon and the GObject bindings (python3-gi); without them the
+check is skipped.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BUS_CONF = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>system</type>
+  <listen>unix:path={socket}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow user="*"/>
+    <allow own="*"/>
+    <allow send_type="method_call"/>
+    <allow send_type="method_return"/>
+    <allow send_type="error"/>
+    <allow send_type="signal"/>
+    <allow receive_type="method_call"/>
+    <allow receive_type="method_return"/>
+    <allow receive_type="error"/>
+    <allow receive_type="signal"/>
+  </policy>
+</busconfig>
+"""
+
+MOCK_XML = """
+<node>
+  <interface name="org.freedesktop.systemd1.Manager">
+    <method name="ListUnitsByNames">
+      <arg type="as" direction="in"/><arg type="a(ssssssouso)" direction="out"/>
+    </method>
+    <method name="ListUnitFilesByPatterns">
+      <arg type="as" direction="in"/><arg type="as" direction="in"/><arg type="a(ss)" direction="out"/>
+    </method>
+    <method name="StartUnit"><arg type="s" direction="in"/><arg type="s" direction="in"/><arg type="o" direction="out"/></method>
+    <method name="StopUnit"><arg type="s" direction="in"/><arg type="s" direction="in"/><arg type="o" direction="out"/></method>
+    <method name="RestartUnit"><arg type="s" direction="in"/><arg type="s" direction="in"/><arg type="o" direction="out"/></method>
+    <method name="EnableUnitFiles">
+      <arg type="as" direction="in"/><arg type="b" direction="in"/><arg type="b" direction="in"/>
+      <arg type="b" direction="out"/><arg type="a(sss)" direction="out"/>
+    </method>
+    <method name="DisableUnitFiles">
+      <arg type="as" direction="in"/><arg type="b" direction="in"/><arg type="a(sss)" direction="out"/>
+    </method>
+    <method name="ResetFailedUnit"><arg type="s" direction="in"/></method>
+    <method name="Reload"/>
+    <method name="Subscribe"/>
+    <method name="Unsubscribe"/>
+    <signal name="JobRemoved"><arg type="u"/><arg type="o"/><arg type="s"/><arg type="s"/></signal>
+  </interface>
+  <interface name="org.freedesktop.machine1.Manager">
+    <method name="ListMachines"><arg type="a(ssso)" direction="out"/></method>
+    <method name="TerminateMachine"><arg type="s" direction="in"/></method>
+    <method name="KillMachine">
+      <arg type="s" direction="in"/><arg type="s" direction="in"/><arg type="i" direction="in"/>
+    </method>
+  </interface>
+</node>
+"""
+
+SD_PATH = "/org/freedesktop/systemd1"
+MD_PATH = "/org/freedesktop/machine1"
+UNIT_DIR = "/etc/systemd/system"
+
+
+# --------------------------------------------------------------------------
+# Mock managers (run with --mock)
+# --------------------------------------------------------------------------
+
+def _escape(name: str) -> str:
+    """Object path element, as sd_bus_path_encode() builds it."""
+    return "".join(c if c.isalnum() else f"_{ord(c):02x}" for c in name)
+
+
+def mock():
+    from gi.repository import Gio, GLib
+
+    units = {
+        "pcscd.socket": {"active": "active", "file": "enabled"},
+        "arksigner-nspawn.service": {"active": "inactive", "file": "disabled"},
+    }
+    machines = {"debian-arksigner": "arksigner-nspawn.service"}
+    jobs = [0]
+    loop = GLib.MainLoop()
+    node = Gio.DBusNodeInfo.new_for_xml(MOCK_XML)
+
+    def job(conn, unit: str, active: str):
+        jobs[0] += 1
+        job_id = jobs[0]
+        path = f"{SD_PATH}/job/{job_id}"
+        found = unit in units
+        if found:
+            units[unit]["active"] = active
+
+        def removed():
+            conn.emit_signal(None, SD_PATH, "org.freedesktop.systemd1.Manager", "JobRemoved",
+                             GLib.Variant("(uoss)", (job_id, path, unit, "done" if found else "failed")))
+            return False
+
+        # After the reply, as systemd does
+        GLib.timeout_add(20, removed)
+        return GLib.Variant("(o)", (path,))
+
+    def on_systemd(conn, _sender, _path, _iface, method, params, invocation):
+        args = params.unpack()
+        if method == "ListUnitsByNames":
+            out = []
+            for name in args[0]:
+                st = units.get(name)
+                out.append((name, "", "loaded" if st else "not-found", st["active"] if st else "inactive",
+                            "running" if st and st["active"] == "active" else "dead", "",
+                            f"{SD_PATH}/unit/x", 0, "", "/"))
+            reply = GLib.Variant("(a(ssssssouso))", (out,))
+        elif method == "ListUnitFilesByPatterns":
+            reply = GLib.Variant("(a(ss))", ([(f"{UNIT_DIR}/{name}", st["file"])
+                                               for name, st in units.items() if name in args[1]],))
+        elif method in ("StartUnit", "RestartUnit"):
+            reply = job(conn, args[0], "active")
+        elif method == "StopUnit":
+            reply = job(conn, args[0], "inactive")
+        elif method in ("EnableUnitFiles", "DisableUnitFiles"):
+            state = "enabled" if method == "EnableUnitFiles" else "disabled"
+            changes = []
+            for name in args[0]:
+                if name in units:
+                    units[name]["file"] = state
+                    changes.append(("symlink" if state == "enabled" else "unlink",
+                                    f"{UNIT_DIR}/multi-user.target.wants/{name}", f"{UNIT_DIR}/{name}"))
+            reply = (GLib.Variant("(ba(sss))", (True, changes)) if state == "enabled"
+                     else GLib.Variant("(a(sss))", (changes,)))
+        else:
+            reply = None
+        invocation.return_value(reply)
+
+    def on_machined(_conn, _sender, _path, _iface, method, params, invocation):
+        args = params.unpack()
+        if method == "ListMachines":
+            invocation.return_value(GLib.Variant("(a(ssso))", ([
+                (name, "container", service, f"{MD_PATH}/machine/{_escape(name)}")
+                for name, service in machines.items()
+            ],)))
+            return
+        if method == "TerminateMachine":
+            machines.pop(args[0], None)
+        invocation.return_value(None)
+
+    def on_acquired(conn, _name):
+        conn.register_object(SD_PATH, node.interfaces[0], on_systemd, None, None)
+        conn.register_object(MD_PATH, node.interfaces[1], on_machined, None, None)
+
+    for name in ("org.freedesktop.systemd1", "org.freedesktop.machine1"):
+        Gio.bus_own_name(Gio.BusType.SYSTEM, name, Gio.BusNameOwnerFlags.NONE,
+                         on_acquired if name.endswith("systemd1") else None, None, lambda *_: loop.quit())
+    loop.run()
+
+
+# --------------------------------------------------------------------------
+# Checks
+# --------------------------------------------------------------------------
+
+def checks() -> list[str]:
+    """Exercise the client; returns the failures."""
+    sys.path.insert(0, str(ROOT))
+    from backend.lib import systemd
+
+    failures = []
+
+    def expect(what: str, got, want):
+        ok = got == want
+        print(f"{'ok  ' if ok else 'FAIL'} {what}: {got!r}" + ("" if ok else f" (want {want!r})"))
+        if not ok:
+            failures.append(what)
+
+    unit = "arksigner-nspawn.service"
+    st = systemd.unit_states(["pcscd.socket", unit, "missing.service"])
+    expect("pcscd.socket state", (st["pcscd.socket"].active, st["pcscd.socket"].file_state), ("active", "enabled"))
+    expect(f"{unit} state", (st[unit].load, st[unit].active, st[unit].file_state), ("loaded", "inactive", "disabled"))
+    expect("missing unit", (st["missing.service"].load, st["missing.service"].file_state), ("not-found", "not-found"))
+
+    systemd.enable_units([unit], now=True, check=True)
+    st = systemd.unit_states([unit])[unit]
+    expect("enable --now", (st.active, st.sub, st.file_state), ("active", "running", "enabled"))
+    expect("restart job", systemd.restart_unit(unit, check=True), "done")
+    expect("stop job", systemd.stop_unit(unit), "done")
+    expect("stop of a missing unit", systemd.stop_unit("missing.service"), "failed")
+    systemd.disable_units([unit], check=True)
+    st = systemd.unit_states([unit])[unit]
+    expect("disable", (st.active, st.file_state), ("inactive", "disabled"))
+    systemd.reset_failed(unit)
+    systemd.daemon_reload(check=True)
+
+    expect("list_machines", systemd.list_machines(), [("debian-arksigner", "container", unit)])
+    systemd.poweroff_machine("debian-arksigner")
+    systemd.terminate_machine("debian-arksigner")
+    expect("terminate_machine", systemd.list_machines(), [])
+    return failures
+
+
+def main():
+    if "--mock" in sys.argv[1:]:
+        mock()
+        return
+    try:
+        import gi  # noqa: F401
+    except ImportError:
+        print("SKIP: the GObject bindings (python3-gi) are not installed")
+        return
+    daemon = shutil.which("dbus-daemon")
+    if daemon is None:
+        print("SKIP: dbus-daemon not found")
+        return
+
+    with tempfile.TemporaryDirectory(prefix="arksigner-dbus-") as tmp:
+        conf = Path(tmp) / "bus.conf"
+        socket = Path(tmp) / "bus.sock"
+        conf.write_text(BUS_CONF.format(socket=socket))
+        # stderr: unprivileged, it complains about the fd limit
+        bus = subprocess.Popen([daemon, f"--config-file={conf}", "--nofork"], stderr=subprocess.DEVNULL)
+        mock_proc = None
+        try:
+            deadline = time.monotonic() + 5
+            while not socket.exists():
+                if time.monotonic() >= deadline:
+                    raise SystemExit("ERROR: private dbus-daemon did not start")
+                time.sleep(0.02)
+            address = f"unix:path={socket}"
+            os.environ["DBUS_SYSTEM_BUS_ADDRESS"] = address
+            mock_proc = subprocess.Popen([sys.executable, __file__, "--mock"])
+
+            from gi.repository import Gio, GLib
+
+            conn = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+            deadline = time.monotonic() + 5
+            while True:
+                (owned,) = conn.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus", "org.freedesktop.DBus",
+                                          "ListNames", None, GLib.VariantType.new("(as)"),
+                                          Gio.DBusCallFlags.NONE, 1000, None).unpack()
+                if {"org.freedesktop.systemd1", "org.freedesktop.machine1"} <= set(owned):
+                    break
+                if time.monotonic() >= deadline:
+                    raise SystemExit("ERROR: mock managers did not come up")
+                time.sleep(0.02)
+
+            # Any fall back to systemctl/machinectl must fail loudly
+            os.environ["PATH"] = tmp
+            os.environ.pop("ARKSIGNER_ROOT", None)
+            os.environ.pop("ARKSIGNER_SYSTEMD_BACKEND", None)
+            failures = checks()
+        finally:
+            if mock_proc is not None:
+                mock_proc.terminate()
+                mock_proc.wait()
+            bus.terminate()
+            bus.wait()
+
+    if failures:
+        print(f"FAIL: {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("systemd D-Bus client: all checks passed")
+
+
+if __name__ == "__main__":
+    main()